@@ -0,0 +1,254 @@
+"""
+Archive.py : append-only store of finished games.
+
+Two files:
+  <path>      game records, appended one after the other
+  <path>.idx  fixed size index entries, one per player of every game, in
+              the order the games were written (so sorted by time)
+
+A game record is
+  [record length : 4][time : 8][rows][cols][k][result][move count : 2]
+  then for player X and player O : [client id : 8][name length][name]
+  then the moves : [row][col] per move, X moves first and the marks alternate
+An index entry is [time : 8][client id : 8][record offset : 8].
+
+The index is memory mapped. Lookups by time are a binary search over it,
+lookups by player use a table of entry numbers built from it at open, so
+no lookup parses the archive file. Appends are queued and written in
+batches by a background thread, never on the caller's thread.
+"""
+
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from Config import Protocol
+import Log
+
+RECORD = struct.Struct("!IdBBBBH")
+PLAYER = struct.Struct("!dB")
+MOVE = struct.Struct("!BB")
+INDEX_ENTRY = struct.Struct("!ddQ")
+
+#results of a game record
+X_WINS = 0
+O_WINS = 1
+DRAW = 2
+ABANDONED = 3 #reset or left before it was decided
+
+
+class ArchiveError(Exception):
+	pass
+
+
+#bytes of one game record. game is a dict : {'time', 'rows', 'cols', 'k',
+#'result', 'players' : [(client_id, name), (client_id, name)], 'moves' : [(row, col), ...]}
+def encode_game(game):
+	players = b""
+	for client_id, name in game['players']:
+		name = name.encode('utf-8')[:255]
+		players += PLAYER.pack(float(client_id), len(name)) + name
+	moves = b"".join(MOVE.pack(row, col) for row, col in game['moves'])
+	size = RECORD.size + len(players) + len(moves)
+	return RECORD.pack(size, game['time'], game['rows'], game['cols'], game['k'], game['result'], len(game['moves'])) + players + moves
+
+#the game dict of a record (see encode_game)
+def decode_game(data):
+	size, finished, rows, cols, k, result, move_count = RECORD.unpack_from(data)
+	offset = RECORD.size
+	players = []
+	for i in range(2):
+		client_id, name_length = PLAYER.unpack_from(data, offset)
+		offset += PLAYER.size
+		if(client_id.is_integer()):
+			client_id = int(client_id)
+		players.append((client_id, data[offset:offset + name_length].decode('utf-8')))
+		offset += name_length
+	moves = [MOVE.unpack_from(data, offset + i * MOVE.size) for i in range(move_count)]
+	return {'time' : finished, 'rows' : rows, 'cols' : cols, 'k' : k, 'result' : result, 'players' : players, 'moves' : moves}
+
+
+########################################################################
+# Class : GameArchive - the archive and index files of one server
+########################################################################
+class GameArchive:
+
+	def __init__(self, path):
+		self.path = path
+		self.index_path = path + ".idx"
+		self.queue = queue.Queue()
+		self.lock = threading.Lock() #guards the index map, by_player and the read handle
+		self.last_time = 0.0 #index times never go backwards, see write_batch()
+		self.archive_file = open(path, "ab")
+		self.index_file = open(self.index_path, "ab")
+		self.reader = open(path, "rb")
+		#a game is only indexed once its record is on disk, a crash between the
+		#two writes leaves an unindexed tail that the next append skips past
+		self.offset = self.archive_file.seek(0, os.SEEK_END)
+		self.index_map = None
+		self.entries = 0
+		self.by_player = {} #client id -> [index entry number, ...]
+		self.map_index()
+		for n in range(self.entries):
+			finished, client_id, offset = INDEX_ENTRY.unpack_from(self.index_map, n * INDEX_ENTRY.size)
+			self.by_player.setdefault(client_id, []).append(n)
+			self.last_time = finished
+		self.writer = threading.Thread(target=self.write_games, daemon=True)
+		self.writer.start()
+
+	#queue a finished game (see encode_game for the dict). Returns at once
+	def append(self, game):
+		self.queue.put(game)
+
+	#wait until every queued game is written
+	def flush(self):
+		self.queue.join()
+
+	def close(self):
+		self.queue.put(None)
+		self.writer.join()
+		with self.lock:
+			if(self.index_map is not None):
+				self.index_map.close()
+				self.index_map = None
+			self.archive_file.close()
+			self.index_file.close()
+			self.reader.close()
+
+	#writer thread : take whatever is queued, up to ARCHIVE_BATCH games,
+	#and write it with one write per file
+	def write_games(self):
+		while True:
+			games = [self.queue.get()]
+			while len(games) < Protocol.ARCHIVE_BATCH:
+				try:
+					games.append(self.queue.get_nowait())
+				except queue.Empty:
+					break
+			stop = None in games
+			batch = [game for game in games if game is not None]
+			try:
+				if(batch):
+					self.write_batch(batch)
+			except Exception as e:
+				#the writer thread must outlive any batch, or flush() waits forever
+				Log.error("archive.write_failed", path=self.path, games=len(batch), error=repr(e))
+			finally:
+				for game in games:
+					self.queue.task_done()
+			if(stop):
+				return
+
+	def write_batch(self, games):
+		records = []
+		entries = []
+		offset = self.offset
+		for game in games:
+			#a record that does not encode is skipped, not the batch with it
+			try:
+				record = encode_game(game)
+				ids = [float(client_id) for client_id, name in game['players']]
+			except Exception as e:
+				Log.error("archive.bad_record", path=self.path, error=repr(e))
+				continue
+			self.last_time = max(self.last_time, game['time'])
+			for client_id in ids:
+				entries.append((self.last_time, client_id, offset))
+			records.append(record)
+			offset += len(record)
+		if(not records):
+			return
+		self.archive_file.write(b"".join(records))
+		self.archive_file.flush()
+		self.index_file.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in entries))
+		self.index_file.flush()
+		self.offset = offset
+		with self.lock:
+			first = self.entries
+			self.map_index()
+			for n, entry in enumerate(entries):
+				self.by_player.setdefault(entry[1], []).append(first + n)
+
+	#map the index file again after it grew. Caller holds self.lock (or is __init__)
+	def map_index(self):
+		size = os.path.getsize(self.index_path)
+		size -= size % INDEX_ENTRY.size #ignore a torn last entry
+		if(self.index_map is not None):
+			self.index_map.close()
+			self.index_map = None
+		self.entries = size // INDEX_ENTRY.size
+		if(size > 0):
+			with open(self.index_path, "rb") as f:
+				self.index_map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+	#(time, client id, offset) of index entry n. Caller holds self.lock
+	def entry(self, n):
+		return INDEX_ENTRY.unpack_from(self.index_map, n * INDEX_ENTRY.size)
+
+	#the game record at offset in the archive file
+	def read_game(self, offset):
+		return self.read_record(offset)[1]
+
+	#(record size, game) at offset in the archive file
+	def read_record(self, offset):
+		with self.lock:
+			self.reader.seek(offset)
+			header = self.reader.read(RECORD.size)
+			if(len(header) < RECORD.size):
+				raise ArchiveError(f"no game record at offset {offset}")
+			size = RECORD.unpack(header)[0]
+			body = self.reader.read(size - RECORD.size)
+			if(len(body) < size - RECORD.size):
+				raise ArchiveError(f"truncated game record at offset {offset}")
+			return size, decode_game(header + body)
+
+	#games a player took part in, oldest first, at most limit
+	def games_by_player(self, client_id, limit=None):
+		with self.lock:
+			entries = self.by_player.get(float(client_id), [])
+			if(limit is not None):
+				entries = entries[-limit:]
+			offsets = [self.entry(n)[2] for n in entries]
+		return [self.read_game(offset) for offset in offsets]
+
+	#games finished in [start, end), oldest first
+	def games_between(self, start, end):
+		with self.lock:
+			first = self.search_time(start)
+			last = self.search_time(end)
+			offsets = []
+			for n in range(first, last):
+				offset = self.entry(n)[2]
+				if(not offsets or offsets[-1] != offset): #one entry per player
+					offsets.append(offset)
+		return [self.read_game(offset) for offset in offsets]
+
+	#number of the first index entry at or after time t. Caller holds self.lock
+	def search_time(self, t):
+		low, high = 0, self.entries
+		while low < high:
+			middle = (low + high) // 2
+			if(self.entry(middle)[0] < t):
+				low = middle + 1
+			else:
+				high = middle
+		return low
+
+	#every game in the archive, oldest first. Reads record by record, the
+	#file is never loaded whole
+	def scan(self):
+		offset = 0
+		while True:
+			try:
+				size, game = self.read_record(offset)
+			except (ArchiveError, struct.error):
+				return
+			yield game
+			offset += size
+
+
+#game dict for GameArchive.append, finished now
+def make_game(rows, cols, k, result, players, moves):
+	return {'time' : time.time(), 'rows' : rows, 'cols' : cols, 'k' : k, 'result' : result, 'players' : players, 'moves' : moves}
@@ -0,0 +1,158 @@
+"""
+AsyncServer.py : asyncio engine for the Tic Tac Toe Server.
+One coroutine per client connection instead of one thread, so a single
+process can hold tens of thousands of mostly idle clients. Commands are
+processed by the same CommandProcessor as the threaded Server.
+Start it with 'python Server.py --mode async'
+"""
+
+import asyncio
+import copy
+import socket
+import Bot
+import Framing
+import Log
+import Spectators
+import Shard
+from Config import Protocol
+from Server import CommandProcessor, ClientConnection
+
+try:
+	import resource
+except ImportError: #not available on windows
+	resource = None
+
+
+########################################################################
+# Class : AsyncConnection - a client connection served by a coroutine.
+# push() only queues bytes on the transport, it never blocks the loop
+########################################################################
+class AsyncConnection(ClientConnection):
+
+	def __init__(self, server, writer):
+		self.writer = writer
+		self.peer = writer.get_extra_info('peername')
+		self.accepted = self.setup_connection(server)
+
+	def push(self, data):
+		if(self.writer.is_closing()):
+			return False
+		self.writer.write(data)
+		return True
+
+	#called on the loop thread (see AsyncServer.reap_idle), handle_connection's read then ends
+	def drop(self):
+		self.writer.close()
+
+	#the transport buffers what the socket does not take, push() never blocks
+	def queue(self, data):
+		return self.push(data)
+
+	def backlog(self):
+		if(self.writer.is_closing()):
+			return None
+		return self.writer.transport.get_write_buffer_size()
+
+
+########################################################################
+# Class : AsyncServer - asyncio TCP server
+# Runs on one event loop thread. The room locks in CommandProcessor are
+# never contended here, commands run one at a time between awaits
+########################################################################
+class AsyncServer(CommandProcessor):
+
+	def __init__(self, host=None, port=None, archive_path=None, nodes=None):
+		self.host = host or Protocol.SERVER_IP
+		self.port = Protocol.SERVER_PORT if port is None else port
+		CommandProcessor.__init__(self, archive_path, nodes, Shard.node_name(self.host, self.port))
+		self.server = None
+		self.sockets = [] #listening sockets served next to host:port, eg: the shared one of Prefork.py
+
+	# start the server, blocks until the loop is stopped
+	def start(self):
+		raise_file_limit()
+		asyncio.run(self.serve_forever())
+
+	async def serve_forever(self):
+		self.fanout = Spectators.LoopFanout(asyncio.get_running_loop())
+		self.server = await asyncio.start_server(self.handle_connection, self.host, self.port, backlog=Protocol.ASYNC_BACKLOG)
+		Log.info("server.started", engine="async", host=self.host, port=self.port)
+		shared = [await asyncio.start_server(self.handle_connection, sock=sock) for sock in self.sockets]
+		reaper = asyncio.create_task(self.reap_idle()) #held so the task is not garbage collected
+		async with self.server:
+			await self.server.serve_forever()
+
+	#coroutine run for every client: read frames, answer them, repeat
+	async def handle_connection(self, reader, writer):
+		connection = AsyncConnection(self, writer)
+		if(not connection.accepted):
+			Log.warning("connection.rejected", peer=connection.peer, reason="max connections")
+			writer.close()
+			return
+		frame_reader = Framing.FrameReader()
+		sock = writer.get_extra_info('socket')
+		if(sock is not None):
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		try:
+			while True:
+				client_data = await reader.read(Protocol.BUFFER_SIZE)
+				if(not client_data):
+					#client closed the connection
+					break
+				frame_reader.feed(client_data)
+				responses = connection.process_frames(frame_reader)
+				if(responses):
+					writer.write(responses)
+					await writer.drain()
+		except (ConnectionError, Framing.FrameError) as e:
+			Log.info("connection.closed", peer=connection.peer, error=e)
+		finally:
+			connection.close_connection()
+			writer.close()
+
+
+	#the bot searches on a worker thread, a move on a large board would
+	#hold up every connection of the loop for Protocol.BOT_TIME_BUDGET.
+	#Its move is played and published once the search is done
+	def play_bot(self, room):
+		mark = room.bot_to_move()
+		if(mark is None or room.bot_pending):
+			return
+		room.bot_pending = True
+		board = copy.copy(room.master_game_state) #the search must not see later changes
+		search = asyncio.get_running_loop().run_in_executor(None, Bot.choose_move, board, mark)
+		search.add_done_callback(lambda done: self.bot_moved(room, board, done))
+
+	#on the loop thread once the search of board is done
+	def bot_moved(self, room, board, search):
+		room.bot_pending = False
+		try:
+			move = search.result()
+		except Exception as e:
+			Log.error("bot.failed", room=room.get_room_id(), error=repr(e))
+			return
+		with room.lock:
+			state = room.master_game_state
+			#the game was reset or left while the bot was thinking
+			if((state.x_mask, state.o_mask) != (board.x_mask, board.o_mask) or room.bot_to_move() is None):
+				return
+			room.play_bot_move(move)
+			self.flush_room(room)
+
+	#evict idle connections, see CommandProcessor.evict_idle()
+	async def reap_idle(self):
+		while True:
+			await asyncio.sleep(Protocol.IDLE_CHECK)
+			self.evict_idle()
+
+
+#every connection is a file descriptor, allow as many as the hard limit
+def raise_file_limit():
+	if(resource is None):
+		return
+	soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+	if(soft < hard):
+		try:
+			resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+		except (ValueError, OSError) as e:
+			Log.warning("file_limit.failed", soft=soft, hard=hard, error=e)
@@ -0,0 +1,127 @@
+"""
+BatchEval.py : score many board positions at once with NumPy.
+The result of every position is one of ONGOING, X_WINS, O_WINS or DRAW,
+the same outcome GameRoom.checkForWin gives for a board (X is checked
+before O, a full board without a line is a draw).
+
+Positions come either as an (N, rows, cols) array of marks (EMPTY, MARK_X,
+MARK_O) or as packed bitboards : two arrays of N masks laid out like
+BitBoard.x_mask/o_mask (cell (row, col) is bit row * cols + col).
+
+eg:
+	results = BatchEval.evaluate_masks(x_masks, o_masks)       #3x3, k=3
+	results = BatchEval.evaluate_boards(boards, k=5)           #(N, 15, 15) boards
+"""
+
+import numpy as np
+import BitBoard as bb
+
+#cell values of an (N, rows, cols) board array
+EMPTY = 0
+MARK_X = 1
+MARK_O = 2
+
+#results
+ONGOING = 0
+X_WINS = 1
+O_WINS = 2
+DRAW = 3
+
+#packed bitboards must fit in one unsigned 64 bit int
+MAX_PACKED_CELLS = 64
+
+
+#(N,) array of results for an (N, rows, cols) array of marks, k in a row wins
+def evaluate_boards(boards, k=bb.K):
+	boards = np.asarray(boards)
+	if(boards.ndim != 3):
+		raise ValueError(f"boards must be (N, rows, cols), got shape {boards.shape}")
+	x_won = has_line(boards == MARK_X, k)
+	o_won = has_line(boards == MARK_O, k)
+	full = (boards != EMPTY).all(axis=(1, 2))
+	return classify(x_won, o_won, full)
+
+#(N,) array of results for packed bitboards, x_masks/o_masks hold N masks
+#of a rows x cols board each
+def evaluate_masks(x_masks, o_masks, rows=bb.ROWS, cols=bb.COLS, k=bb.K):
+	geometry = bb.get_geometry(rows, cols, k)
+	if(geometry.cell_count > MAX_PACKED_CELLS):
+		raise ValueError(f"a {rows}x{cols} board does not fit in {MAX_PACKED_CELLS} bit masks, use evaluate_boards()")
+	x_masks = np.asarray(x_masks, dtype=np.uint64)
+	o_masks = np.asarray(o_masks, dtype=np.uint64)
+	if(geometry.winning is not None):
+		#small boards : one table lookup per position, as BitBoard does
+		table = np.frombuffer(geometry.winning, dtype=np.uint8).astype(bool)
+		x_won = table[x_masks.astype(np.intp)]
+		o_won = table[o_masks.astype(np.intp)]
+	else:
+		x_won = np.zeros(x_masks.shape, dtype=bool)
+		o_won = np.zeros(o_masks.shape, dtype=bool)
+		for win in geometry.win_masks:
+			win = np.uint64(win)
+			x_won |= (x_masks & win) == win
+			o_won |= (o_masks & win) == win
+	full = (x_masks | o_masks) == np.uint64(geometry.full_mask)
+	return classify(x_won, o_won, full)
+
+#(N, rows, cols) bool array of cells -> (N,) bool, True where k cells in a
+#row are set. Each direction is the AND of k shifted views of the board,
+#so the work is O(k) array operations whatever N is
+def has_line(cells, k):
+	n, rows, cols = cells.shape
+	found = np.zeros(n, dtype=bool)
+	for dr, dc in bb.DIRECTIONS:
+		span_r = rows - dr * (k - 1)
+		span_c = cols - abs(dc) * (k - 1)
+		if(span_r <= 0 or span_c <= 0):
+			continue
+		#windows start at column (k - 1) for the anti diagonal so they stay on the board
+		start_c = (k - 1) if dc < 0 else 0
+		line = cells[:, 0:span_r, start_c:start_c + span_c]
+		for i in range(1, k):
+			r = dr * i
+			c = start_c + dc * i
+			line = line & cells[:, r:r + span_r, c:c + span_c]
+		found |= line.any(axis=(1, 2))
+	return found
+
+def classify(x_won, o_won, full):
+	results = np.full(x_won.shape, ONGOING, dtype=np.uint8)
+	results[full] = DRAW
+	results[o_won] = O_WINS
+	results[x_won] = X_WINS
+	return results
+
+#(N, rows, cols) array of marks from packed bitboards
+def masks_to_boards(x_masks, o_masks, rows=bb.ROWS, cols=bb.COLS):
+	bits = np.arange(rows * cols, dtype=np.uint64)
+	x = (np.asarray(x_masks, dtype=np.uint64)[:, None] >> bits) & np.uint64(1)
+	o = (np.asarray(o_masks, dtype=np.uint64)[:, None] >> bits) & np.uint64(1)
+	boards = (x * MARK_X + o * MARK_O).astype(np.uint8)
+	return boards.reshape(-1, rows, cols)
+
+#packed bitboards (x_masks, o_masks) from an (N, rows, cols) array of marks
+def boards_to_masks(boards):
+	boards = np.asarray(boards)
+	n, rows, cols = boards.shape
+	if(rows * cols > MAX_PACKED_CELLS):
+		raise ValueError(f"a {rows}x{cols} board does not fit in {MAX_PACKED_CELLS} bit masks")
+	weights = np.uint64(1) << np.arange(rows * cols, dtype=np.uint64)
+	flat = boards.reshape(n, -1)
+	x_masks = ((flat == MARK_X).astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+	o_masks = ((flat == MARK_O).astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+	return x_masks, o_masks
+
+#the result of one position with the scalar BitBoard path (the reference
+#the batch functions agree with)
+def evaluate_one(x_mask, o_mask, rows=bb.ROWS, cols=bb.COLS, k=bb.K):
+	board = bb.BitBoard(rows, cols, k)
+	board.set_masks(int(x_mask), int(o_mask))
+	mark = board.winner()
+	if(mark == "X"):
+		return X_WINS
+	if(mark == "O"):
+		return O_WINS
+	if(board.is_full()):
+		return DRAW
+	return ONGOING
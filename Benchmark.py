@@ -0,0 +1,214 @@
+"""
+Benchmark.py : micro benchmarks for the server hot paths.
+Run 'python Benchmark.py' and compare the numbers before/after a change.
+"""
+
+import random
+import time
+import BitBoard as bb
+import Bot
+import Codec
+import Util
+from Config import Protocol
+
+########################################################################
+# Board engine : BitBoard vs the pandas DataFrame board the server used
+# before. The DataFrame version below is the old update/checkForWin path
+# (.iloc writes and up to 24 .iloc reads per check)
+########################################################################
+
+#random legal positions as lists of (row, col, mark) plays
+def random_games(count, seed=1):
+	rnd = random.Random(seed)
+	cells = [(r, c) for r in range(bb.ROWS) for c in range(bb.COLS)]
+	games = []
+	for i in range(count):
+		rnd.shuffle(cells)
+		plays = rnd.randint(0, len(cells))
+		games.append([(r, c, "XO"[n % 2]) for n, (r, c) in enumerate(cells[:plays])])
+	return games
+
+def dataframe_check_for_win(df, P1, P2):
+	for x in range(3):
+		for y in range(1):
+			if ( (df.iloc[x,y] == P1) & (df.iloc[x,y+1] == P1) & (df.iloc[x,y+2] == P1)):
+				return P1
+			if ( (df.iloc[x,y] == P2) & (df.iloc[x,y+1] == P2) & (df.iloc[x,y+2] == P2)):
+				return P2
+	for y in range(3):
+		for x in range(1):
+			if ( (df.iloc[x,y] == P1) & (df.iloc[x+1,y] == P1) & (df.iloc[x+2,y] == P1)):
+				return P1
+			if ( (df.iloc[x,y] == P2) & (df.iloc[x+1,y] == P2) & (df.iloc[x+2,y] == P2)):
+				return P2
+	for P in (P1, P2):
+		if ( (df.iloc[0,0] == P) & (df.iloc[1,1] == P) & (df.iloc[2,2] == P)):
+			return P
+		if ( (df.iloc[0,2] == P) & (df.iloc[1,1] == P) & (df.iloc[2,0] == P)):
+			return P
+	return None
+
+def bench_dataframe_board(games):
+	import pandas as pd
+	start = time.perf_counter()
+	for plays in games:
+		df = pd.DataFrame(([[0,0,0],[0,0,0],[0,0,0]]))
+		for r, c, mark in plays:
+			df.iloc[r, c] = mark
+			dataframe_check_for_win(df, "X", "O")
+	return time.perf_counter() - start
+
+def bench_bitboard(games):
+	start = time.perf_counter()
+	for plays in games:
+		board = bb.BitBoard()
+		for r, c, mark in plays:
+			board.place(r, c, mark)
+			board.winner()
+			board.is_full()
+	return time.perf_counter() - start
+
+#print a result line, rate is moves (place + win check) per second
+def report(name, moves, seconds):
+	print(f"{name:<24} {moves:>10} moves {seconds:>9.4f}s {moves / seconds:>14,.0f} moves/s")
+
+def bench_board(count=2000):
+	games = random_games(count)
+	moves = sum(len(g) for g in games)
+	print(f"board engine: {count} games")
+	bit_time = bench_bitboard(games)
+	report("BitBoard", moves, bit_time)
+	try:
+		df_time = bench_dataframe_board(games)
+	except ImportError:
+		print("DataFrame board skipped: pandas is not installed")
+		return
+	report("DataFrame", moves, df_time)
+	print(f"BitBoard speedup: {df_time / bit_time:.0f}x")
+
+
+########################################################################
+# Wire codec : encode + decode of the hot commands with the json path
+# (Util.msg_to_bytes/msg_from_bytes) vs the binary records in Codec
+########################################################################
+
+#(request, (command, result)) pairs as the server sees them
+def hot_messages():
+	client = {'client_id' : 4821.0, 'room_id' : 17}
+	winner = {"id" : "4821.0", "name" : "Player One", "mark" : "X", "is_registered" : "True"}
+	return [
+		(dict(client, COMMAND=Protocol.COMMAND_UPDATE_MODEL, row=1, column=2), (Protocol.COMMAND_UPDATE_MODEL, None)),
+		(dict(client, COMMAND=Protocol.COMMAND_GET_MODEL), (Protocol.COMMAND_GET_MODEL, ("1", "2", "X"))),
+		(dict(client, COMMAND=Protocol.COMMAND_CHECK_FOR_WIN), (Protocol.COMMAND_CHECK_FOR_WIN, winner)),
+		(dict(client, COMMAND=Protocol.COMMAND_CHECK_FOR_READY), (Protocol.COMMAND_CHECK_FOR_READY, "True")),
+		(dict(client, COMMAND=Protocol.COMMAND_GET_STATE, version=41), (Protocol.COMMAND_GET_STATE, None)),
+		(dict(client, COMMAND=Protocol.COMMAND_GET_STATE, version=41),
+			(Protocol.COMMAND_GET_STATE, {'version' : 42, 'ready' : "True", 'winner' : winner, 'last_move' : ("1", "2", "X")})),
+	]
+
+def bench_util(messages, rounds):
+	start = time.perf_counter()
+	for i in range(rounds):
+		for request, (command, result) in messages:
+			Util.msg_from_bytes(Util.msg_to_bytes(request))
+			Util.msg_from_bytes(Util.msg_to_bytes({command : result}))
+	return time.perf_counter() - start
+
+def bench_codec_impl(codec, messages, rounds):
+	start = time.perf_counter()
+	for i in range(rounds):
+		for request, (command, result) in messages:
+			codec.decode_request(codec.encode_request(request))
+			codec.decode_response(codec.encode_response(command, result))
+	return time.perf_counter() - start
+
+def bench_codec(rounds=20000):
+	messages = hot_messages()
+	binary = Codec.get_codec(Codec.BINARY)
+	count = rounds * len(messages)
+	print(f"wire codec: {count} request/response round trips")
+	util_time = bench_util(messages, rounds)
+	binary_time = bench_codec_impl(binary, messages, rounds)
+	print(f"{'Util (json)':<24} {count / util_time:>14,.0f} round trips/s")
+	print(f"{'Codec (binary)':<24} {count / binary_time:>14,.0f} round trips/s")
+	for request, (command, result) in messages:
+		json_size = len(Util.msg_to_bytes(request)) + len(Util.msg_to_bytes({command : result}))
+		binary_size = len(binary.encode_request(request)) + len(binary.encode_response(command, result))
+		print(f"  command {command}: json {json_size} bytes, binary {binary_size} bytes")
+	print(f"binary speedup: {util_time / binary_time:.1f}x")
+
+
+########################################################################
+# Bot : time per move with a cold transposition table (first game) and
+# once the table is warm (every later game)
+########################################################################
+
+def bench_bot_games(games):
+	start = time.perf_counter()
+	moves = 0
+	for plays in games:
+		board = bb.BitBoard()
+		for r, c, mark in plays:
+			board.place(r, c, mark)
+			if(board.winner() is None and not board.is_full()):
+				Bot.choose_move(board, "O" if mark == "X" else "X")
+				moves += 1
+	return moves, time.perf_counter() - start
+
+def bench_bot(count=2000):
+	games = random_games(count)
+	table = Bot.get_rules(bb.DEFAULT).table
+	table.clear()
+	print(f"bot: {count} games")
+	moves, seconds = bench_bot_games(games)
+	print(f"{'cold table':<24} {moves:>10} moves {seconds * 1e6 / moves:>9.1f} us/move ({len(table)} positions)")
+	moves, seconds = bench_bot_games(games)
+	print(f"{'warm table':<24} {moves:>10} moves {seconds * 1e6 / moves:>9.1f} us/move")
+
+
+########################################################################
+# Batch evaluation : winner/draw/ongoing of random positions, one
+# BitBoard at a time vs BatchEval on NumPy arrays
+########################################################################
+
+def bench_batch(count=200000, rows=bb.ROWS, cols=bb.COLS, k=bb.K):
+	try:
+		import numpy as np
+		import BatchEval
+	except ImportError:
+		print("batch evaluation skipped: numpy is not installed")
+		return
+	rng = np.random.default_rng(1)
+	boards = rng.integers(0, 3, size=(count, rows, cols), dtype=np.uint8)
+	x_masks, o_masks = BatchEval.boards_to_masks(boards) if rows * cols <= BatchEval.MAX_PACKED_CELLS else (None, None)
+	print(f"batch evaluation: {count} {rows}x{cols} k={k} positions")
+
+	scalar_count = min(count, 20000)
+	if(x_masks is not None):
+		pairs = list(zip(x_masks[:scalar_count].tolist(), o_masks[:scalar_count].tolist()))
+	else:
+		pairs = [(sum(1 << i for i, v in enumerate(b.flat) if v == BatchEval.MARK_X),
+			sum(1 << i for i, v in enumerate(b.flat) if v == BatchEval.MARK_O)) for b in boards[:scalar_count]]
+	start = time.perf_counter()
+	for x, o in pairs:
+		BatchEval.evaluate_one(x, o, rows, cols, k)
+	scalar_rate = scalar_count / (time.perf_counter() - start)
+	print(f"{'BitBoard (scalar)':<24} {scalar_rate:>14,.0f} positions/s")
+
+	start = time.perf_counter()
+	BatchEval.evaluate_boards(boards, k)
+	board_rate = count / (time.perf_counter() - start)
+	print(f"{'BatchEval boards':<24} {board_rate:>14,.0f} positions/s ({board_rate / scalar_rate:.0f}x)")
+	if(x_masks is not None):
+		start = time.perf_counter()
+		BatchEval.evaluate_masks(x_masks, o_masks, rows, cols, k)
+		mask_rate = count / (time.perf_counter() - start)
+		print(f"{'BatchEval masks':<24} {mask_rate:>14,.0f} positions/s ({mask_rate / scalar_rate:.0f}x)")
+
+
+if __name__ == "__main__":
+	bench_board()
+	bench_codec()
+	bench_bot()
+	bench_batch()
+	bench_batch(20000, 15, 15, 5)
@@ -0,0 +1,199 @@
+"""
+BitBoard.py : compact board engine for the Tic Tac Toe server.
+Boards are rows x cols and a game is won by k marks in a row (3x3, k=3 is
+tic tac toe, 15x15, k=5 is gomoku). The board is two integers, one bitmask
+per mark. Cell (row, col) is bit row * cols + col. A win can only be made
+by the stone just placed, so place() scans the four lines through it
+(O(k)) and remembers the winner, winner() never rescans the board.
+Small boards use a lookup table on the whole mask instead.
+"""
+
+ROWS = 3
+COLS = 3
+K = 3
+CELL_COUNT = ROWS * COLS
+EMPTY = 0
+
+#row/col steps of the four line directions : across, down and both diagonals
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+#boards with at most this many cells get a WINNING table (2^cells entries)
+TABLE_CELLS = 16
+
+
+########################################################################
+# Class : Geometry - the shape and win rule of a board, shared by every
+#         board (and bot search) with the same rows, cols and k
+########################################################################
+class Geometry:
+
+	def __init__(self, rows, cols, k):
+		self.rows = rows
+		self.cols = cols
+		self.k = k
+		self.cell_count = rows * cols
+		self.full_mask = (1 << self.cell_count) - 1
+		#every line of k cells that wins the game, as a bitmask of cells
+		masks = []
+		for r in range(rows):
+			for c in range(cols):
+				for dr, dc in DIRECTIONS:
+					end_r = r + dr * (k - 1)
+					end_c = c + dc * (k - 1)
+					if(0 <= end_r < rows and 0 <= end_c < cols):
+						masks.append(sum(1 << ((r + dr * i) * cols + c + dc * i) for i in range(k)))
+		self.win_masks = tuple(masks)
+		#winning[mask] is 1 when the cells in mask contain a full line.
+		#Built once per geometry so has_won() is one index operation
+		self.winning = None
+		if(self.cell_count <= TABLE_CELLS):
+			self.winning = bytearray(self.full_mask + 1)
+			for mask in range(self.full_mask + 1):
+				for win in self.win_masks:
+					if(mask & win == win):
+						self.winning[mask] = 1
+						break
+
+	#does this mask contain a winning line? Checks every line on big boards,
+	#use wins_at() when the last move is known
+	def has_won(self, mask):
+		if(self.winning is not None):
+			return self.winning[mask] == 1
+		for win in self.win_masks:
+			if(mask & win == win):
+				return True
+		return False
+
+	#does the stone at cell index complete a line of k in mask?
+	def wins_at(self, mask, index):
+		if(self.winning is not None):
+			return self.winning[mask] == 1
+		rows, cols, k = self.rows, self.cols, self.k
+		row, col = divmod(index, cols)
+		for dr, dc in DIRECTIONS:
+			run = 1
+			for step in (1, -1):
+				r = row + dr * step
+				c = col + dc * step
+				while run < k and 0 <= r < rows and 0 <= c < cols and (mask >> (r * cols + c)) & 1:
+					run += 1
+					r += dr * step
+					c += dc * step
+			if(run >= k):
+				return True
+		return False
+
+	def is_valid(self, row, col):
+		return 0 <= row < self.rows and 0 <= col < self.cols
+
+	def cell_bit(self, row, col):
+		return 1 << (row * self.cols + col)
+
+
+GEOMETRIES = {}
+
+#the shared Geometry for a board shape and rule
+def get_geometry(rows=ROWS, cols=COLS, k=K):
+	key = (rows, cols, k)
+	geometry = GEOMETRIES.get(key)
+	if(geometry is None):
+		geometry = GEOMETRIES[key] = Geometry(rows, cols, k)
+	return geometry
+
+#the classic 3x3 board
+DEFAULT = get_geometry(ROWS, COLS, K)
+WIN_MASKS = DEFAULT.win_masks
+FULL_MASK = DEFAULT.full_mask
+WINNING = DEFAULT.winning
+
+
+#return the bit for a cell on a 3x3 board
+def cell_bit(row, col):
+	return 1 << (row * COLS + col)
+
+#does this 3x3 mask contain a winning line?
+def has_won(mask):
+	return WINNING[mask] == 1
+
+
+########################################################################
+# Class : BitBoard - the server side data model of one game.
+#         Drop in replacement for the pandas DataFrame board, marks are
+#         "X" (player 1) and "O" (player 2)
+#
+########################################################################
+class BitBoard:
+
+	def __init__(self, rows=ROWS, cols=COLS, k=K):
+		self.geometry = get_geometry(rows, cols, k)
+		self.rows = rows
+		self.cols = cols
+		self.k = k
+		self.reset()
+
+	#clear the board
+	def reset(self):
+		self.x_mask = 0
+		self.o_mask = 0
+		self.count = 0    #marks on the board
+		self.won = None   #winning mark, set by place()
+
+	#place mark at row/col. Returns False if the cell is taken or off the board
+	def place(self, row, col, mark):
+		if(not self.geometry.is_valid(row, col)):
+			return False
+		index = row * self.cols + col
+		bit = 1 << index
+		if((self.x_mask | self.o_mask) & bit):
+			return False
+		if(mark == "X"):
+			self.x_mask |= bit
+			mask = self.x_mask
+		else:
+			self.o_mask |= bit
+			mask = self.o_mask
+		self.count += 1
+		#only the stone just placed can make a new line
+		if(self.won is None and self.geometry.wins_at(mask, index)):
+			self.won = mark
+		return True
+
+	#set the whole position at once (eg: from a stored game)
+	def set_masks(self, x_mask, o_mask):
+		self.x_mask = x_mask
+		self.o_mask = o_mask
+		self.count = bin(x_mask | o_mask).count("1")
+		self.won = None
+		if(self.geometry.has_won(x_mask)):
+			self.won = "X"
+		elif(self.geometry.has_won(o_mask)):
+			self.won = "O"
+
+	#return the mark at row/col or EMPTY
+	def get(self, row, col):
+		bit = 1 << (row * self.cols + col)
+		if(self.x_mask & bit):
+			return "X"
+		if(self.o_mask & bit):
+			return "O"
+		return EMPTY
+
+	#return the winning mark or None
+	def winner(self):
+		return self.won
+
+	#every cell is taken
+	def is_full(self):
+		return self.count == self.geometry.cell_count
+
+	#board is full and nobody has a line
+	def is_draw(self):
+		return self.is_full() and self.won is None
+
+	#number of marks on the board
+	def move_count(self):
+		return self.count
+
+	#rows of marks, the same layout the DataFrame board used (0 for empty)
+	def to_list(self):
+		return [[self.get(r, c) for c in range(self.cols)] for r in range(self.rows)]
@@ -46,7 +46,6 @@ class Board(tk.Frame):
 		#Some userfriendly messaging and name gathering
 		#print(f"Board.init_Board(): ")
 		self.var_player = StringVar()	
-		self.button_grid = {}
 		self.controller.game_over=False
 		#Flag to optimize refresh of playgrid only once afte game ready
 		self.active_playgrid_updated = False 
@@ -61,10 +60,7 @@ class Board(tk.Frame):
 		self.txt_player_name.grid(row=1, column=1, sticky='NWSE')
 		self.var_player.set(self.helpText)
 
-		#create a 3x3 grid of buttons for active play area
-		self.active_playgrid = self.create_active_playgrid()
-		self.active_playgrid.grid(row=3, column=1)
-		self.update_active_play_grid()
+		self.set_Grid(row_count, col_count)
 	
 		self.goBtn = tk.Button(self, text="  Play ", height=2, width=8, bg='black', fg='green', command=self.get_PlayerName)
 		self.goBtn.grid(row=1, column=2)
@@ -76,12 +72,28 @@ class Board(tk.Frame):
 		self.restartBtn.grid(row=6, column=1, sticky="NWSE")
 	
 
+	#create a row_count x col_count grid of buttons for active play area,
+	#in place of the one shown before
+	def set_Grid(self, row_count, col_count):
+		if(getattr(self, "active_playgrid", None) is not None):
+			self.active_playgrid.destroy()
+		self.row_count = row_count
+		self.col_count = col_count
+		self.button_grid = {}
+		self.active_playgrid = self.create_active_playgrid()
+		self.active_playgrid.grid(row=3, column=1)
+		self.update_active_play_grid()
+
 	def get_PlayerName(self):
 		#print(f"main.get_Players(): P1: {self.controller.player_name}")
 		self.controller.player_name = self.txt_player_name.get()
 		if(not self.controller.isPlayerRegistered):
 			self.controller.register_user(self.controller.player_name)
 			self.controller.isPlayerRegistered = True
+			#the room's rules come with the registration
+			rules = self.controller.rules
+			if((rules['rows'], rules['cols']) != (self.row_count, self.col_count)):
+				self.set_Grid(rules['rows'], rules['cols'])
 		#print(f"get_PlayerName(): {self.txt_player_name.get()}")
 
 		
@@ -103,11 +115,11 @@ class Board(tk.Frame):
 		else:
 			state = "disabled"
 
-		for r in ['0', '1', '2']:
-			row_btns = self.button_grid.get(r)
+		for r in range(self.row_count):
+			row_btns = self.button_grid.get(str(r))
 			if(row_btns):
-				for c in ['0', '1', '2']:
-					this_btn = row_btns.get(c)
+				for c in range(self.col_count):
+					this_btn = row_btns.get(str(c))
 					#print(f"update_board %%%%%%%%%%%% this_btn.type : {type(this_btn)}")
 					if(isinstance(this_btn, tictac_square)):
 						#print(f"update_board %%%%%%%%%%%% {state} btn at: ({r},{c})")
@@ -181,11 +193,11 @@ class Board(tk.Frame):
 							#update the state of the button in UI so all 
 							#users see the current state of the board after
 							#any remote play
-							for r in ['0', '1', '2']:
-								row_btns = self.button_grid.get(r)
+							for r in range(self.row_count):
+								row_btns = self.button_grid.get(str(r))
 								if(row_btns):
-									for c in ['0', '1', '2']:
-										this_btn = row_btns.get(c)
+									for c in range(self.col_count):
+										this_btn = row_btns.get(str(c))
 										#print(f"%%%%%%%%%%%%  found btn: {this_btn}")
 										if(isinstance(this_btn, tictac_square)):
 											id = this_btn.get_id()
@@ -198,6 +210,9 @@ class Board(tk.Frame):
 										
 							#print(f"gameBoard: update_UI(): : {self.controller.server_state}")
 							#print(f"gameBoard: update_UI() exiting")
+						elif key=="redraw_board":
+							#the client took the server's whole board, paint every square again
+							self.redraw_Board()
 						elif key=="check_for_win":
 							if(self.controller.game_over == True):
 								print("GAME OVER")
@@ -213,14 +228,29 @@ class Board(tk.Frame):
 
 
 
+	#paint every square from the client's board, empty squares are playable again
+	def redraw_Board(self):
+		for r in range(self.row_count):
+			row_btns = self.button_grid.get(str(r), {})
+			for c in range(self.col_count):
+				this_btn = row_btns.get(str(c))
+				if(isinstance(this_btn, tictac_square)):
+					mark = self.controller.get_mark(r, c)
+					if(mark):
+						this_btn.set_mark(mark)
+						this_btn["state"] = "disabled"
+					else:
+						this_btn.mark = "88"
+						this_btn["text"] = "___"
+						this_btn["state"] = "normal" if self.controller.in_progress else "disabled"
+
+
 	"""
-	create the active play grid. For TicTacToe this is a 3x3 grid of buttons
-	top row has 3 buttons. 
-	middle row has 3 buttons
-	bottom row has 3 buttons
+	create the active play grid. For TicTacToe this is a 3x3 grid of buttons,
+	one frame per row of the board with a button per column
 
 	This layout is important to coincide with the data model data structure which is 
-	a 3x3 matrix. 
+	a row_count x col_count matrix. 
 
 	"""
 
@@ -229,45 +259,16 @@ class Board(tk.Frame):
 		#Initialize the interactive play area button grid 
 		active_playgrid = tk.Frame(self)
 
-		top_frame = tk.Frame(active_playgrid)
-		top_frame.grid(row=3, column=1)
-
-
-		row_count  = 3
-		col_count = 3	
-
-		x=0
-		row = {}
-		for y in range(col_count):
-			#(0,1)(0,2)(0,3)
-			btn = tictac_square(top_frame, x, y, self.controller)
-			btn.grid(row=3, column=y)
-			row[str(y)] = btn	
-		self.button_grid[str(x)] = row
-
-
-		middle_frame = tk.Frame(active_playgrid)
-		middle_frame.grid(row=4, column=1)
-		x = 1
-		row = {}
-		for y in range(col_count):
-			#(1,0)(1,1)(1,2)
-			btn = tictac_square(middle_frame, x, y, self.controller)
-			btn.grid(row=4, column=y)
-			row[str(y)] = btn	
-		self.button_grid[str(x)] = row
-
-		bottom_frame = tk.Frame(active_playgrid)
-		bottom_frame.grid(row=5, column=1)
-		x=2
-		row = {}
-		for y in range(col_count):
-			#(2,0)(2,1)(2,2)
-			btn = tictac_square(bottom_frame, x, y, self.controller)
-			btn.grid(row=5, column=y)
-			row[str(y)] = btn	
-		self.button_grid[str(x)] = row	
-
+		for x in range(self.row_count):
+			row_frame = tk.Frame(active_playgrid)
+			row_frame.grid(row=3 + x, column=1)
+			row = {}
+			for y in range(self.col_count):
+				#(x,0)(x,1)(x,2)...
+				btn = tictac_square(row_frame, x, y, self.controller)
+				btn.grid(row=3 + x, column=y)
+				row[str(y)] = btn	
+			self.button_grid[str(x)] = row
 
 		return active_playgrid
 
@@ -0,0 +1,247 @@
+"""
+Bot.py : the server's built in opponent.
+Picks a move with negamax and alpha-beta pruning over the BitBoard masks.
+Positions already searched are kept in a transposition table per board
+geometry shared by every game the server hosts, so after the first few
+games a 3x3 move is a dict lookup. Searches are iterative deepening under
+a time budget so the bot answers in bounded time whatever the board size.
+"""
+
+import time
+import BitBoard as bb
+from Config import Protocol
+
+#score of a won position, more empty cells left (a faster win) score higher.
+#Above any evaluate() score
+WIN_SCORE = 1 << 40
+INFINITY = 1 << 50
+
+#transposition table flags : the stored value is exact, a lower bound
+#(the search failed high) or an upper bound (it failed low)
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+#geometry -> transposition table of that board shape
+#(side to move mask, other side mask) -> (depth, flag, value, best move index)
+#depth is the number of plies searched below the position, capped at the
+#number of empty cells, so an entry with depth == empty cells is solved
+TABLES = {}
+
+#candidate moves are the empty cells within NEAR cells of a stone, on
+#3x3 that is every cell
+NEAR = 2
+
+#time checks are done every NODE_CHECK + 1 nodes on boards with at most
+#CHEAP_LINES winning lines (see Rules.check), every node on bigger ones
+NODE_CHECK = 63
+CHEAP_LINES = 64
+
+
+class SearchTimeout(Exception):
+	pass
+
+
+########################################################################
+# Class : Rules - what the search needs to know about a geometry,
+#         computed once per board shape
+########################################################################
+class Rules:
+
+	def __init__(self, geometry):
+		self.geometry = geometry
+		rows, cols = geometry.rows, geometry.cols
+		#cell indexes, the cells on the most lines first (center first)
+		lines = [0] * geometry.cell_count
+		for win in geometry.win_masks:
+			while win:
+				bit = win & -win
+				lines[bit.bit_length() - 1] += 1
+				win ^= bit
+		self.cells = sorted(range(geometry.cell_count), key=lambda i: -lines[i])
+		#near[i] : mask of the cells within NEAR rows/cols of cell i
+		self.near = []
+		for i in range(geometry.cell_count):
+			row, col = divmod(i, cols)
+			mask = 0
+			for r in range(max(0, row - NEAR), min(rows, row + NEAR + 1)):
+				for c in range(max(0, col - NEAR), min(cols, col + NEAR + 1)):
+					mask |= 1 << (r * cols + c)
+			self.near.append(mask)
+		#node counter mask of the time checks : a node costs about one
+		#evaluate(), which walks every winning line
+		self.check = NODE_CHECK if len(geometry.win_masks) <= CHEAP_LINES else 0
+		self.table = {}
+
+RULES = {}
+
+#the Rules of geometry, built on first use. Call it before the bot's first
+#move (see GameRoom.add_bot()) so that move does not pay for them
+def get_rules(geometry):
+	rules = RULES.get(geometry)
+	if(rules is None):
+		rules = RULES[geometry] = Rules(geometry)
+		TABLES[geometry] = rules.table
+	return rules
+
+
+########################################################################
+# Class : Search - state of one move search
+########################################################################
+class Search:
+
+	def __init__(self, rules, deadline):
+		self.rules = rules
+		self.geometry = rules.geometry
+		self.table = rules.table
+		self.deadline = deadline
+		self.check = rules.check
+		self.nodes = 0
+		self.best_move = None #best move at the root of the last search
+
+	def check_time(self):
+		if(time.monotonic() > self.deadline):
+			raise SearchTimeout()
+
+	#score of the position for the side to move (me), opp just moved at last
+	def negamax(self, me, opp, last, depth, alpha, beta, root=False):
+		self.nodes += 1
+		if(self.nodes & self.check == 0):
+			self.check_time()
+		geometry = self.geometry
+		empties = geometry.cell_count - bin(me | opp).count("1")
+		if(last is not None and geometry.wins_at(opp, last)):
+			return -(WIN_SCORE + empties)
+		if(empties == 0):
+			return 0
+		depth = min(depth, empties)
+		if(depth == 0):
+			return evaluate(geometry, me, opp)
+
+		key = (me, opp)
+		entry = self.table.get(key)
+		tt_move = None
+		if(entry is not None):
+			e_depth, flag, value, tt_move = entry
+			if(e_depth >= depth and not root):
+				if(flag == EXACT):
+					return value
+				if(flag == LOWER):
+					alpha = max(alpha, value)
+				else:
+					beta = min(beta, value)
+				if(alpha >= beta):
+					return value
+
+		alpha_start = alpha
+		best = -INFINITY
+		best_move = None
+		moves = ordered_moves(self.rules, me, opp, tt_move)
+		#ordering walks every cell, and each move below costs at least a node
+		if(len(moves) > self.check):
+			self.check_time()
+		for index in moves:
+			if(root):
+				self.check_time()
+			bit = 1 << index
+			if(geometry.wins_at(me | bit, index)):
+				#nothing beats winning now
+				best = WIN_SCORE + empties - 1
+				best_move = index
+				break
+			score = -self.negamax(opp, me | bit, index, depth - 1, -beta, -alpha)
+			if(score > best):
+				best = score
+				best_move = index
+				if(best > alpha):
+					alpha = best
+					if(alpha >= beta):
+						break
+
+		if(best <= alpha_start):
+			flag = UPPER
+		elif(best >= beta):
+			flag = LOWER
+		else:
+			flag = EXACT
+		if(len(self.table) >= Protocol.BOT_TABLE_SIZE):
+			self.table.clear()
+		self.table[key] = (depth, flag, best, best_move)
+		if(root):
+			self.best_move = best_move
+		return best
+
+
+#lines still open for me minus lines still open for the opponent, a line
+#counts more the more stones it already has
+def evaluate(geometry, me, opp):
+	score = 0
+	for win in geometry.win_masks:
+		if(not win & opp):
+			score += 1 << (2 * bin(win & me).count("1"))
+		if(not win & me):
+			score -= 1 << (2 * bin(win & opp).count("1"))
+	return score
+
+#empty cells near a stone, the table's best move first, then moves that
+#win, moves that block a win and the rest in rules.cells order
+def ordered_moves(rules, me, opp, tt_move):
+	geometry = rules.geometry
+	occupied = me | opp
+	if(occupied == 0):
+		return [rules.cells[0]]
+	candidates = 0
+	index = 0
+	stones = occupied
+	while stones:
+		if(stones & 1):
+			candidates |= rules.near[index]
+		stones >>= 1
+		index += 1
+	candidates &= ~occupied
+	if(candidates == 0):
+		candidates = geometry.full_mask & ~occupied
+	first = []
+	rest = []
+	for index in rules.cells:
+		bit = 1 << index
+		if(not candidates & bit or index == tt_move):
+			continue
+		if(geometry.wins_at(me | bit, index) or geometry.wins_at(opp | bit, index)):
+			first.append(index)
+		else:
+			rest.append(index)
+	if(tt_move is not None and candidates & (1 << tt_move)):
+		first.insert(0, tt_move)
+	return first + rest
+
+#(row, col) of the move for mark on board, None if the game is over.
+#Searches one ply deeper at a time until the board is solved or the
+#budget (seconds) runs out and plays the best move of the deepest search
+def choose_move(board, mark, budget=Protocol.BOT_TIME_BUDGET):
+	deadline = time.monotonic() + budget
+	if(mark == "X"):
+		me, opp = board.x_mask, board.o_mask
+	else:
+		me, opp = board.o_mask, board.x_mask
+	rules = get_rules(board.geometry)
+	empties = board.geometry.cell_count - board.move_count()
+	if(empties == 0 or board.winner() is not None):
+		return None
+
+	move = None
+	entry = rules.table.get((me, opp))
+	if(entry is not None and entry[0] >= empties and entry[1] == EXACT):
+		#solved before, by this game or an earlier one
+		move = entry[3]
+	else:
+		search = Search(rules, deadline)
+		for depth in range(1, empties + 1):
+			try:
+				search.negamax(me, opp, None, depth, -INFINITY, INFINITY, root=True)
+			except SearchTimeout:
+				break
+			move = search.best_move
+		if(move is None):
+			move = ordered_moves(rules, me, opp, None)[0]
+	return divmod(move, board.cols)
@@ -3,12 +3,21 @@ import json
 import numpy as np
 from Config import Protocol 
 import queue
+import threading
+import time
+import random
+import collections
 import Player as plyr
 import Util
+import Framing
+import Codec
+import Log
+import Shard
 
 ########################################################################
 # Class : GameNetworkClient is a client proxy that handles all the 
 # server communication and client/server identification via client id
+# It keeps no game state, see GameClient.py for that
 
 # @author: Neelesh Kamkolkar
 ########################################################################		
@@ -24,64 +33,163 @@ All commands are described in Protocol.py
 Eg: Protocol.COMMAND_UPDATE_MODEL
 
 The client shall construct a command and data message as a dict.
-Eg: {'COMMAND' : Protocol.COMMAND_GET_MODEL, 'client_id' : self.client_id}
+Eg: {'COMMAND' : Protocol.COMMAND_GET_MODEL, 'client_id' : self.client_id, 'room_id' : self.room_id}
 Each client command can have additional key/value paris in dict as required by game design 
 
 The client/server use the json serialization to serialize and de-serialize the commands over TCP 
-sockets
+sockets. Each message is sent as a length prefixed frame tagged with a request id (see Framing.py)
+so several requests can be in flight at once (see pipeline())
+
+The socket itself is owned by a ServerConnection (below): calls have a deadline, a
+dropped connection is re-established in the background and the session (codec,
+registration, subscription) is replayed on it before any other call goes out
 
 """
 class GameNetworkClient:
 	
 
-	def __init__(self, controller):
-		self.client_id = -1
-		self.server_host = None
-		self.port = 0
-		self.controller = controller 
+	def __init__(self, host=None, port=None, client_id=-1):
+		self.client_id = client_id
+		self.room_id = Protocol.DEFAULT_ROOM_ID #room (game) this client plays in
+		self.server_host = host
+		self.port = port
+		self.connection = None #ServerConnection, see start()
+		self.state_version = None #version of the last state read with get_state()
+		self.lobby_name = None #name we entered the lobby with, see enter_lobby()
 
 	def start(self):
 		#print("GameNetworkClient.start(): starting client...")
-		if (self.client_id == -1):
+		if (self.connection is None):
 			#self.server_host = socket.gethostname() #assign to server host
-			self.server_host = Protocol.SERVER_IP # connect to this server
-			self.port = Protocol.SERVER_PORT 	  # on this port
-			self.client_id = np.floor(np.random.rand()*10000) #Unique ID for client
-			self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			self.client_socket.connect((self.server_host, self.port))
+			self.server_host = self.server_host or Protocol.SERVER_IP # connect to this server
+			self.port = self.port or Protocol.SERVER_PORT 	  # on this port
+			if (self.client_id == -1):
+				self.client_id = np.floor(np.random.rand()*10000) #Unique ID for client
+			self.connection = ServerConnection(self.server_host, self.port)
+			self.connection.start()
 
 
 	#write server model state with X/O and the corresponding row/column where 
 	#the user placed their marker.
 	def update_model(self, player_marker, row, column):
 		#print(f"update_model: player_marker: {player_marker} : row : {row} : column : {column}")
-		server_command = {'COMMAND' : Protocol.COMMAND_UPDATE_MODEL, 'client_id' : self.client_id, 'player_marker' : player_marker, 'row' : row , 'column' : column}
+		server_command = {'COMMAND' : Protocol.COMMAND_UPDATE_MODEL, 'client_id' : self.client_id, 'room_id' : self.room_id, 'player_marker' : player_marker, 'row' : row , 'column' : column}
 		self.proxy_server_call(server_command)
 	
 	# read the server model state 
 	def get_model(self):
 		#print(f"Client.py: get_model()")
-		server_command = {'COMMAND' : Protocol.COMMAND_GET_MODEL, 'client_id' : self.client_id}
+		server_command = {'COMMAND' : Protocol.COMMAND_GET_MODEL, 'client_id' : self.client_id, 'room_id' : self.room_id}
 		result = self.proxy_server_call(server_command)
-		result = self.msg_from_bytes(result)
-		result = result.get(str(Protocol.COMMAND_GET_MODEL))
-		print(f"Client received model change event: {result}")
+		result = self.get_result(result, Protocol.COMMAND_GET_MODEL)
+		if(Log.enabled(Log.DEBUG)):
+			Log.debug("client.model", room=self.room_id, model=result)
 		return result
 
+	# create a new room on the server and return its id. The client stays
+	# in its current room until it joins the new one
+	# rows, cols, k : board and marks in a row to win, the server default (3x3, k=3) when None
+	def create_room(self, rows=None, cols=None, k=None):
+		server_command = {'COMMAND' : Protocol.COMMAND_CREATE_ROOM, 'client_id' : self.client_id, 'room_id' : self.room_id}
+		for key, value in (('rows', rows), ('cols', cols), ('k', k)):
+			if(value is not None):
+				server_command[key] = value
+		res = self.proxy_server_call(server_command)
+		return self.get_result(res, Protocol.COMMAND_CREATE_ROOM)
+
+	# board of the current room : {'rows' : rows, 'cols' : cols, 'k' : marks in a row to win}
+	def get_rules(self):
+		server_command = {'COMMAND' : Protocol.COMMAND_GET_RULES, 'client_id' : self.client_id, 'room_id' : self.room_id}
+		return self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_GET_RULES)
+
+	#the best count players after the first start, see Rating.py
+	def get_leaderboard(self, count=10, start=0):
+		server_command = {'COMMAND' : Protocol.COMMAND_GET_LEADERBOARD, 'client_id' : self.client_id, 'count' : count, 'start' : start}
+		return self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_GET_LEADERBOARD)
+
+	#rating and rank of a player, this client when player_id is None
+	def get_rank(self, player_id=None):
+		player_id = self.client_id if player_id is None else player_id
+		server_command = {'COMMAND' : Protocol.COMMAND_GET_RANK, 'client_id' : self.client_id, 'player_id' : player_id}
+		return self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_GET_RANK)
+
+	#wait for an opponent in the server's lobby instead of joining a room,
+	#returns the lobby status, see Lobby.status()
+	def enter_lobby(self, player_name, rows=None, cols=None, k=None):
+		server_command = {'COMMAND' : Protocol.COMMAND_ENTER_LOBBY, 'client_id' : self.client_id, 'player_name' : player_name}
+		for key, value in (('rows', rows), ('cols', cols), ('k', k)):
+			if(value is not None):
+				server_command[key] = value
+		self.lobby_name = player_name
+		return self.lobby_matched(self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_ENTER_LOBBY))
+
+	def leave_lobby(self):
+		server_command = {'COMMAND' : Protocol.COMMAND_LEAVE_LOBBY, 'client_id' : self.client_id}
+		return self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_LEAVE_LOBBY)
+
+	def lobby_status(self):
+		server_command = {'COMMAND' : Protocol.COMMAND_LOBBY_STATUS, 'client_id' : self.client_id}
+		return self.lobby_matched(self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_LOBBY_STATUS))
+
+	#the server's metrics, see Metrics.py
+	def get_server_stats(self):
+		server_command = {'COMMAND' : Protocol.COMMAND_STATS, 'client_id' : self.client_id}
+		return self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_STATS)
+
+	def get_lobby_stats(self):
+		server_command = {'COMMAND' : Protocol.COMMAND_LOBBY_STATS, 'client_id' : self.client_id}
+		return self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_LOBBY_STATS)
+
+	#once the lobby paired us, send every later command to the room it
+	#seated us in, and rejoin that room after a reconnect
+	def lobby_matched(self, status):
+		if(status is not None and status.get('state') == "matched" and status['room_id'] != self.room_id):
+			self.room_id = status['room_id']
+			self.connection.forget(Protocol.COMMAND_SUBSCRIBE)
+			self.connection.remember(Protocol.COMMAND_REGISTER_USER, {'COMMAND' : Protocol.COMMAND_JOIN_ROOM,
+				'client_id' : self.client_id, 'room_id' : self.room_id, 'player_name' : self.lobby_name})
+		return status
+
+	# join a room as a player. All later commands are sent to this room.
+	# returns the player mark assigned by the server ("" if the room is full)
+	# opponent=Protocol.OPPONENT_BOT seats the server's bot as the other player
+	def join_room(self, room_id, player_name, opponent=None):
+		self.room_id = room_id
+		server_command = {'COMMAND' : Protocol.COMMAND_JOIN_ROOM, 'client_id' : self.client_id, 'room_id' : self.room_id, 'player_name': player_name}
+		if(opponent is not None):
+			server_command['opponent'] = opponent
+		self.connection.forget(Protocol.COMMAND_SUBSCRIBE) #subscriptions are per room
+		self.connection.remember(Protocol.COMMAND_REGISTER_USER, server_command)
+		res = self.proxy_server_call(server_command)
+		return self.get_result(res, Protocol.COMMAND_JOIN_ROOM)
+
+	# leave the current room and go back to the default room
+	def leave_room(self):
+		server_command = {'COMMAND' : Protocol.COMMAND_LEAVE_ROOM, 'client_id' : self.client_id, 'room_id' : self.room_id}
+		self.connection.forget(Protocol.COMMAND_REGISTER_USER)
+		self.connection.forget(Protocol.COMMAND_SUBSCRIBE)
+		self.proxy_server_call(server_command)
+		self.room_id = Protocol.DEFAULT_ROOM_ID
+
 	# un_register a user (implemented but not used)
 	def un_register_user(self, player_name, player_marker):
-		server_command = {'COMMAND' : Protocol.COMMAND_UN_REGISTER_USER, 'client_id' : self.client_id, 'player_marker' : player_marker, 'player_name':player_name}
+		server_command = {'COMMAND' : Protocol.COMMAND_UN_REGISTER_USER, 'client_id' : self.client_id, 'room_id' : self.room_id, 'player_marker' : player_marker, 'player_name':player_name}
+		self.connection.forget(Protocol.COMMAND_REGISTER_USER)
 		self.proxy_server_call(server_command)
 	
 	# register a player (user) with the server given the name the player chooses in the UI 
-	def register_user(self, player_name):
+	# opponent=Protocol.OPPONENT_BOT seats the server's bot as the other player
+	def register_user(self, player_name, opponent=None):
 		#print(f"Client.py: register_user(): name: {player_name}")
-		server_command = {'COMMAND' : Protocol.COMMAND_REGISTER_USER, 'client_id' : self.client_id, 'player_name': player_name}
+		server_command = {'COMMAND' : Protocol.COMMAND_REGISTER_USER, 'client_id' : self.client_id, 'room_id' : self.room_id, 'player_name': player_name}
+		if(opponent is not None):
+			server_command['opponent'] = opponent
 		#print(f"Client.py: register_user(): CALLING SERVER")
+		#replayed after a reconnect, the server keeps a known client_id in its seat
+		self.connection.remember(Protocol.COMMAND_REGISTER_USER, server_command)
 		res = self.proxy_server_call(server_command)
 		#print(f"Client.py: register_user(): result = {res} res.type: {type(res)}")
-		res = self.msg_from_bytes(res)
-		res = res.get(str(Protocol.COMMAND_REGISTER_USER))
+		res = self.get_result(res, Protocol.COMMAND_REGISTER_USER)
 		#print(f"Client.py: register_user(): {res}:{type(res)}")
 		return res
 
@@ -89,117 +197,161 @@ class GameNetworkClient:
 	# calls reset on server so any server reset reinitialization can happen. 
 	def reset(self):
 		#print("client.py.reset: start")
-		server_command = {'COMMAND' : Protocol.COMMAND_RESET, 'client_id' : self.client_id}
+		server_command = {'COMMAND' : Protocol.COMMAND_RESET, 'client_id' : self.client_id, 'room_id' : self.room_id}
 		self.proxy_server_call(server_command)
+		self.connection.clear_events() #drop events left over from the last game
 
 
 	#check if there is a winner 
-	#in case where there is no winner, construct an empty player instance 
+	#in case where there is no winner, the server constructs an empty player instance 
 	#so the client can process the special instance. 
 	#This is needed so the network protocol is preserved and no special casing is needed 
 	#on the client/server network layer
-	#The client should handle the "no winner" situation by processing the special instance 
-	#of player (see below)
+	#returns the winning player dict, eg: {"id": "9366.0", "name": "NK", "mark": "X", "is_registered": "True"}
+	#or when there is no winner yet {'id': '000', 'name': 'No Winner', 'mark': '--', 'is_registered': 'False'}
+	#(see GameClient.set_winner())
 	def check_for_win(self):
 		#print("client.py.check_for_win: start")
-		server_command = {'COMMAND' : Protocol.COMMAND_CHECK_FOR_WIN, 'client_id' : self.client_id}
+		server_command = {'COMMAND' : Protocol.COMMAND_CHECK_FOR_WIN, 'client_id' : self.client_id, 'room_id' : self.room_id}
 		winner = self.proxy_server_call(server_command)		
-		#print(f"client.py: check_for_winner() : winner is : {winner}")
-		#winner is  b'{"4": {"id": "2083.0", "name": "DFDFDF", "mark": "X", "is_registered": "True"}}'
-		win_result = self.msg_from_bytes(winner)
-		
-		# winning_player is : b'{"id": "9366.0", "name": "NK", "mark": "X", "is_registered": "True"}'
-		winning_player = win_result.get(str(Protocol.COMMAND_CHECK_FOR_WIN))
-		
-		#print(f"winner: {winning_player} type : {type(winning_player)}")
-		
-		if(winning_player is not None and isinstance(winning_player, dict)):
-			#print(f"*************winning player is : {winning_player}")
-			## if no winner yet, server constructs a dummy player
-			## {'id': '000', 'name': 'No Winner', 'mark': '--', 'is_registered': 'False'}
-			if(winning_player['is_registered'] == 'True'):	
-				winner_name = winning_player["name"]
-				self.controller.game_over = True
-				self.controller.in_progress = False
-			else: 
-				winner_name = "No Winner Yet"
-			
-		self.controller.winner = winner_name
-		return self.controller.winner
-
-	#is the game over? 
-	def is_game_over(self):
-		return self.controller.game_over
+		#winner is  {"4": {"id": "2083.0", "name": "DFDFDF", "mark": "X", "is_registered": "True"}}
+		return self.get_result(winner, Protocol.COMMAND_CHECK_FOR_WIN)
 
 	#Implemented (but not used yet)
 	#TODO: Simplify and abstract a player turn to hide update model calls 
 	#Also can be used to prevent players from playing multiple turns (TODO)
 	def next_turn(self, next_player):
 		#print("client.py.next_turn: start")
-		server_command = {'COMMAND' : Protocol.COMMAND_NEXT_TURN, 'client_id' : self.client_id, 'player_name' : next_player}
+		server_command = {'COMMAND' : Protocol.COMMAND_NEXT_TURN, 'client_id' : self.client_id, 'room_id' : self.room_id, 'player_name' : next_player}
 		self.proxy_server_call(server_command)			
 
+	#readiness, winner and last move in one round trip. Returns the state dict
+	#{'version', 'ready', 'winner', 'last_move'} or None if nothing changed since
+	#the last call (see Protocol.COMMAND_GET_STATE)
+	def get_state(self):
+		server_command = {'COMMAND' : Protocol.COMMAND_GET_STATE, 'client_id' : self.client_id, 'room_id' : self.room_id, 'version' : self.state_version}
+		state = self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_GET_STATE)
+		if(isinstance(state, dict)):
+			self.state_version = state['version']
+			return state
+		return None
+
+	#moves played after move sequence number seq, see GameRoom.get_moves_since()
+	#{'seq' : last seq, 'moves' : [[seq, row, col, mark], ...]} or, when the server no
+	#longer has those moves, {'seq' : last seq, 'moves' : None, 'board' : rows of marks}
+	def get_moves_since(self, seq):
+		server_command = {'COMMAND' : Protocol.COMMAND_GET_MOVES_SINCE, 'client_id' : self.client_id, 'room_id' : self.room_id, 'seq' : seq}
+		return self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_GET_MOVES_SINCE)
+
 	#check if two players are registered. 
 	def check_for_ready(self):
 		#print("client.py.check_for_ready: start")
 		status = "None"
-		server_command = {'COMMAND' : Protocol.COMMAND_CHECK_FOR_READY, 'client_id' : self.client_id}
+		server_command = {'COMMAND' : Protocol.COMMAND_CHECK_FOR_READY, 'client_id' : self.client_id, 'room_id' : self.room_id}
 		res = self.proxy_server_call(server_command)			
 		#print(f"client.py: check_for_ready: {res}")
-		#convert bytes to boolean
-		#res = self.msg_from_bytes(res)
-		if(res is not None and res != b''):
-			res = Util.msg_from_bytes(res)
-			#print(f"client.py: check_for_ready: CONVERTED FROM BYTES {res}  : {type(res)}")
-			status = res.get(str(Protocol.COMMAND_CHECK_FOR_READY)) #json converts to int. use str
-			#print(status)
+		if(res is not None):
+			status = self.get_result(res, Protocol.COMMAND_CHECK_FOR_READY)
 		return (status)
 
 
 	#supporting function to proxy a command to the server from the client
 	#per protocol, expects a dict with command and client_id always present. 
 	#rest can be custom. 
-	def proxy_server_call(self, data_dict):
-		status = None
-		#print("Client.py: proxy_server_call()...entering")
-		try: 
-			#self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			#self.client_socket.connect((self.server_host, self.port))
-			#data_dict_encoded = json.dumps(data_dict).encode('utf-8')
-			data_dict_encoded = Util.msg_to_bytes(data_dict)
-			#print(f"proxy_server_call.data_dict_encoded: {data_dict_encoded}")
-			res = self.client_socket.sendall(data_dict_encoded)
-			#print(f"proxy_server_call.sendall.result {res}")
+	#returns the decoded response dict {"<COMMAND>" : result} or None on a network
+	#error or when no answer arrived within timeout (Protocol.CALL_TIMEOUT by default)
+	def proxy_server_call(self, data_dict, timeout=None):
+		return self.pipeline([data_dict], timeout)[0]
 
-			try:
-				status = self.client_socket.recv(4096)
-			except Exception as e: #TODO : Manage exceptions 
-				#print(f"Client.py: trying to read from server errored: {status}")	
-				raise e
-				
-		
-			if(status is not None):
-				##print("Client.py: status call return : {status}")
-				status = json.loads(status).decode('utf-8')
-			else: 
-				#print("Read socket returned nothing")
-				status = "NONE"
-
-			#print(f"proxy_server_call.recv() {status}")
-
-		except:
-			#print(f"exception network error: client id: {self.client_id} socket : {self.client_socket}")
-			#recreate connection?
-			pass
-		
-		#print("Client.py:proxy_server_call()...exiting")
-		return status 
+	#send several commands back to back without waiting for each response,
+	#then collect the responses. Returns the decoded responses in the
+	#same order as data_dicts, None for any that did not get an answer
+	#Commands for a room of another node (sharded servers, see Shard.py)
+	#are sent again to that node, this client then stays on it
+	def pipeline(self, data_dicts, timeout=None):
+		results = self.connection.pipeline(data_dicts, timeout)
+		for i in range(Protocol.MAX_REDIRECTS):
+			redirected = [n for n, res in enumerate(results) if res is not None and Protocol.REDIRECT in res]
+			if(not redirected):
+				break
+			self.follow_redirect(results[redirected[0]][Protocol.REDIRECT]['node'])
+			for n, res in zip(redirected, self.connection.pipeline([data_dicts[n] for n in redirected], timeout)):
+				results[n] = res
+		return results
+
+	#move to the node "host:port". The codec, the session and the stats go
+	#along, remembered commands of rooms on other nodes just get redirects
+	def follow_redirect(self, node):
+		host, port = Shard.parse_node(node)
+		if((host, port) == (self.server_host, self.port)):
+			return
+		Log.info("client.redirected", client=self.client_id, node=node, room=self.room_id)
+		self.connection = self.connection.move_to(host, port)
+		self.server_host, self.port = host, port
+
+	#"host:port" of the node owning room_id, None when the server is not
+	#sharded. Any node answers
+	def locate_room(self, room_id):
+		server_command = {'COMMAND' : Protocol.COMMAND_LOCATE_ROOM, 'client_id' : self.client_id, 'room_id' : room_id}
+		return self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_LOCATE_ROOM)
+
+	#pick the wire codec for this connection (Codec.JSON or Codec.BINARY)
+	#returns True if the server switched to it. Send it on its own, not in a pipeline
+	def set_codec(self, name):
+		return self.connection.set_codec(name)
+
+	#ask the server to push the events of our room (EVENT_READY, EVENT_MOVE,
+	#EVENT_WIN) on this connection. Read them with get_event()
+	def subscribe(self):
+		server_command = {'COMMAND' : Protocol.COMMAND_SUBSCRIBE, 'client_id' : self.client_id, 'room_id' : self.room_id}
+		self.connection.remember(Protocol.COMMAND_SUBSCRIBE, server_command)
+		return self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_SUBSCRIBE)
+
+	def unsubscribe(self):
+		server_command = {'COMMAND' : Protocol.COMMAND_UNSUBSCRIBE, 'client_id' : self.client_id, 'room_id' : self.room_id}
+		self.connection.forget(Protocol.COMMAND_SUBSCRIBE)
+		return self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_UNSUBSCRIBE)
+
+	# watch a room without playing : its events are pushed like after
+	# subscribe(), see get_event(). Returns the room's snapshot
+	# {'rows', 'cols', 'k', 'seq', 'ready', 'board', 'winner'} or None.
+	# A spectator that falls behind gets an EVENT_SNAPSHOT instead of the
+	# events it missed
+	def spectate(self, room_id):
+		server_command = {'COMMAND' : Protocol.COMMAND_SPECTATE, 'client_id' : self.client_id, 'room_id' : room_id}
+		self.connection.remember((Protocol.COMMAND_SPECTATE, room_id), server_command)
+		res = self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_SPECTATE)
+		return res if isinstance(res, dict) else None
+
+	def unspectate(self, room_id):
+		server_command = {'COMMAND' : Protocol.COMMAND_UNSPECTATE, 'client_id' : self.client_id, 'room_id' : room_id}
+		self.connection.forget((Protocol.COMMAND_SPECTATE, room_id))
+		return self.get_result(self.proxy_server_call(server_command), Protocol.COMMAND_UNSPECTATE)
+
+	#next event pushed by the server or None if none arrived within timeout
+	#eg: {'EVENT': 'move', 'room_id': 0, 'data': ['0', '2', 'X']}
+	def get_event(self, timeout=None):
+		return self.connection.get_event(timeout)
+
+	#latency percentiles (ms), error and timeout counts per command, see ServerConnection.get_stats()
+	def get_stats(self):
+		return self.connection.get_stats()
+
+	#pull the result of command out of a decoded response
+	def get_result(self, response, command):
+		if(response is None):
+			return None
+		return response.get(str(command))
 
 	#function
 	#return client_id - a unique client side id for each client
 	def get_client_id(self):
 		return self.client_id
 
+	#return the id of the room this client plays in
+	def get_room_id(self):
+		return self.room_id
+
 	#getter for server host
 	def get_server_host(self):
 		return self.server_host
@@ -226,3 +378,387 @@ class GameNetworkClient:
 	def msg_to_bytes(self, msg):
 		return json.dumps(msg).encode('utf-8')	
 
+
+########################################################################
+# Class : ServerConnection - connection manager used by GameNetworkClient
+#
+# - every call has a deadline (Protocol.CALL_TIMEOUT by default) so a slow
+#   or restarting server never blocks the caller (eg: the Tk thread) for long
+# - when the connection drops it reconnects in the background with jittered
+#   exponential backoff, calls made meanwhile wait for it up to their deadline
+# - after a reconnect the codec and the session (the commands passed to
+#   remember(), eg: register and subscribe) are replayed before any other
+#   call goes out
+# - a connection with nothing to send pings the server every
+#   Protocol.HEARTBEAT_INTERVAL so the server does not evict it as idle,
+#   a ping left unanswered drops the connection and reconnects
+# - latency, error and timeout counts are kept per command, see get_stats()
+########################################################################
+class ServerConnection:
+
+	def __init__(self, host, port, timeout=Protocol.CALL_TIMEOUT):
+		self.host = host
+		self.port = port
+		self.timeout = timeout
+		self.codec_name = Codec.JSON #codec to negotiate on every connect
+		self.codec = Codec.get_codec(Codec.JSON)
+		self.sock = None
+		self.ready = False #connected and the session replayed
+		self.closed = False
+		self.reconnecting = False
+		self.state = threading.Condition() #guards sock/ready/reconnecting
+		self.send_lock = threading.Lock()
+		self.request_id = 0 #id of the last request sent, see Framing.py
+		self.pending = {} #request id -> PendingCall waiting for its response
+		self.pending_lock = threading.Lock()
+		self.events = queue.Queue() #events pushed by the server
+		self.session = {} #key -> command replayed after a reconnect
+		self.stats = {} #command -> CommandStats
+		self.stats_lock = threading.Lock()
+		self.last_sent = time.monotonic() #when the last request went out, see heartbeat()
+
+	#connect now, if the server is not there keep trying in the background
+	def start(self):
+		threading.Thread(target=self.heartbeat, daemon=True).start()
+		try:
+			self.connect()
+		except OSError as e:
+			Log.warning("client.connect_failed", host=self.host, port=self.port, error=e)
+			self.start_reconnect()
+
+	#heartbeat thread : ping when nothing was sent for HEARTBEAT_INTERVAL.
+	#No answer means the server or the network is gone, drop the socket and
+	#let the reader thread start the reconnect
+	def heartbeat(self):
+		while not self.closed:
+			wait = self.last_sent + Protocol.HEARTBEAT_INTERVAL - time.monotonic()
+			if(wait > 0):
+				time.sleep(wait)
+				continue
+			with self.state:
+				sock = self.sock if self.ready else None
+			if(sock is None):
+				time.sleep(Protocol.HEARTBEAT_INTERVAL)
+				continue
+			if(self.call({'COMMAND' : Protocol.COMMAND_PING}) is None and not self.closed):
+				Log.warning("client.heartbeat_lost", host=self.host, port=self.port)
+				close_socket(sock)
+
+	#a connection to host:port (another node, see Shard.py) that carries on
+	#this one's codec, session and stats. This one is closed
+	def move_to(self, host, port):
+		connection = ServerConnection(host, port, self.timeout)
+		connection.codec_name = self.codec_name
+		connection.session = dict(self.session)
+		connection.stats, connection.stats_lock = self.stats, self.stats_lock
+		connection.start()
+		self.close()
+		return connection
+
+	#stop for good, no more reconnects
+	def close(self):
+		with self.state:
+			self.closed = True
+			sock = self.sock
+			self.state.notify_all()
+		if(sock is not None):
+			close_socket(sock)
+
+	#open the socket, start its reader thread, replay codec and session
+	def connect(self):
+		sock = socket.create_connection((self.host, self.port), timeout=Protocol.CONNECT_TIMEOUT)
+		sock.settimeout(None)
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		with self.state:
+			self.sock = sock
+			self.codec = Codec.get_codec(Codec.JSON)
+		#one thread reads everything the server sends and hands responses
+		#to the waiting callers and pushed events to self.events
+		threading.Thread(target=self.read_from_server, args=(sock,), daemon=True).start()
+
+		deadline = time.monotonic() + self.timeout
+		handshake = []
+		if(self.codec_name != Codec.JSON):
+			handshake.append({'COMMAND' : Protocol.COMMAND_SET_CODEC, 'codec' : self.codec_name})
+		for command in handshake + list(self.session.values()):
+			#one at a time, the codec switch must land before the next request is encoded
+			if(self.send_calls([command], deadline)[0] is None):
+				with self.state:
+					self.sock = None
+				close_socket(sock)
+				raise ConnectionError("session replay failed")
+		with self.state:
+			self.ready = True
+			self.state.notify_all()
+
+	def start_reconnect(self):
+		with self.state:
+			if(self.reconnecting or self.closed):
+				return
+			self.reconnecting = True
+		threading.Thread(target=self.reconnect, daemon=True).start()
+
+	#retry until connected with jittered exponential backoff. The jitter keeps
+	#clients dropped by the same server restart from all coming back at once
+	def reconnect(self):
+		attempt = 0
+		while True:
+			with self.state:
+				if(self.closed or self.sock is not None):
+					self.reconnecting = False
+					return
+			try:
+				self.connect()
+				Log.info("client.reconnected", host=self.host, port=self.port)
+			except OSError as e:
+				delay = min(Protocol.RECONNECT_BACKOFF_MAX, Protocol.RECONNECT_BACKOFF_BASE * (2 ** attempt))
+				attempt += 1
+				time.sleep(random.uniform(delay / 2, delay))
+
+	#reader thread : route every frame from the server. Request id 0 is a
+	#pushed event, anything else answers the PendingCall with that id
+	def read_from_server(self, sock):
+		reader = Framing.FrameReader()
+		try:
+			while True:
+				frame = reader.read_frame(sock)
+				if(frame is None):
+					if(not self.closed):
+						Log.info("client.closed_by_server", host=self.host, port=self.port)
+					break
+				request_id, payload = frame
+				if(request_id == Protocol.PUSH_REQUEST_ID):
+					self.events.put(self.codec.decode_event(payload))
+					continue
+				with self.pending_lock:
+					call = self.pending.pop(request_id, None)
+				if(call is None):
+					continue #the caller gave up waiting
+				call.result = self.codec.decode_response(payload)
+				if(call.command.get('COMMAND') == Protocol.COMMAND_SET_CODEC):
+					#switch before reading the next frame, the server already did
+					codec = Codec.get_codec(call.result.get(str(Protocol.COMMAND_SET_CODEC)))
+					if(codec is not None):
+						self.codec = codec
+				call.done.set()
+		except (OSError, ValueError, Framing.FrameError) as e:
+			if(not self.closed):
+				Log.warning("client.network_error", host=self.host, port=self.port, error=e)
+		self.connection_lost(sock)
+
+	def connection_lost(self, sock):
+		close_socket(sock)
+		with self.state:
+			if(self.sock is not sock):
+				return
+			self.sock = None
+			self.ready = False
+		self.fail_pending()
+		self.start_reconnect()
+
+	#wake every caller still waiting for a response, their result is None
+	def fail_pending(self):
+		with self.pending_lock:
+			calls = list(self.pending.values())
+			self.pending.clear()
+		for call in calls:
+			call.done.set()
+
+	#send one command, returns the decoded response or None
+	def call(self, command, timeout=None):
+		return self.pipeline([command], timeout)[0]
+
+	#send several commands back to back without waiting for each response,
+	#then collect the responses. Returns the decoded responses in the
+	#same order as commands, None for any that did not get an answer in time
+	def pipeline(self, commands, timeout=None):
+		deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+		if(not self.wait_ready(deadline)):
+			for command in commands:
+				self.record(command, 0.0, CommandStats.ERROR)
+			return [None for command in commands]
+		return self.send_calls(commands, deadline)
+
+	#wait until connected, False if the deadline passed first
+	def wait_ready(self, deadline):
+		with self.state:
+			while not self.ready:
+				remaining = deadline - time.monotonic()
+				if(self.closed or remaining <= 0):
+					return False
+				self.state.wait(remaining)
+			return True
+
+	#send the calls and wait for their responses. Calls the server turned
+	#away with a busy reply are sent again after its retry_after while the
+	#deadline allows, see RateLimit.py
+	def send_calls(self, commands, deadline):
+		calls = [PendingCall(c) for c in commands]
+		start = time.monotonic()
+		sending = calls
+		while sending:
+			self.send_frames(sending)
+			busy = []
+			for call in sending:
+				call.done.wait(max(0.0, deadline - time.monotonic()))
+				if(not call.done.is_set()):
+					with self.pending_lock:
+						self.pending.pop(call.request_id, None)
+					self.record(call.command, time.monotonic() - start, CommandStats.TIMEOUT)
+				elif(call.result is None):
+					self.record(call.command, time.monotonic() - start, CommandStats.ERROR)
+				elif(Protocol.BUSY in call.result):
+					busy.append(call)
+				else:
+					self.record(call.command, time.monotonic() - start, CommandStats.OK)
+			sending = self.retry_busy(busy, deadline)
+		return [call.result for call in calls]
+
+	#wait out the longest retry_after of the calls the server turned away.
+	#Returns the calls to send again, [] when the deadline would pass first
+	#(their result stays the busy reply)
+	def retry_busy(self, calls, deadline):
+		if(not calls):
+			return []
+		retry_after = 0.0
+		for call in calls:
+			self.record(call.command, 0.0, CommandStats.BUSY)
+			busy = call.result[Protocol.BUSY]
+			if(isinstance(busy, dict)):
+				retry_after = max(retry_after, busy.get('retry_after') or 0.0)
+		if(time.monotonic() + retry_after >= deadline):
+			return []
+		time.sleep(retry_after)
+		for call in calls:
+			call.result = None
+			call.done.clear()
+		return calls
+
+	def send_frames(self, calls):
+		self.last_sent = time.monotonic()
+		try:
+			with self.send_lock:
+				frames = []
+				for call in calls:
+					call.request_id = self.next_request_id()
+					with self.pending_lock:
+						self.pending[call.request_id] = call
+					frames.append(Framing.encode_frame(call.request_id, self.codec.encode_request(call.command)))
+				self.sock.sendall(b"".join(frames))
+		except (OSError, AttributeError) as e:
+			#AttributeError : the socket went away while we were encoding
+			Log.warning("client.send_failed", host=self.host, port=self.port, error=e)
+
+	#request ids tag each request so responses can be matched to it. 0 is reserved
+	def next_request_id(self):
+		self.request_id = (self.request_id % 0xFFFFFFFF) + 1
+		return self.request_id
+
+	#pick the wire codec (Codec.JSON or Codec.BINARY), now and after every reconnect
+	#returns True if the server switched to it. Send it on its own, not in a pipeline
+	def set_codec(self, name):
+		res = self.call({'COMMAND' : Protocol.COMMAND_SET_CODEC, 'codec' : name})
+		if(res is None or res.get(str(Protocol.COMMAND_SET_CODEC)) != name):
+			return False
+		self.codec_name = name
+		return True
+
+	#replay command after every reconnect. A later command with the same key replaces it
+	def remember(self, key, command):
+		self.session[key] = command
+
+	def forget(self, key):
+		self.session.pop(key, None)
+
+	#next event pushed by the server or None if none arrived within timeout
+	def get_event(self, timeout=None):
+		try:
+			return self.events.get(timeout=timeout)
+		except queue.Empty:
+			return None
+
+	def clear_events(self):
+		self.events = queue.Queue()
+
+	def record(self, command, seconds, outcome):
+		name = Util.command_name(command.get('COMMAND'))
+		with self.stats_lock:
+			stats = self.stats.get(name)
+			if(stats is None):
+				stats = self.stats[name] = CommandStats()
+			stats.record(seconds, outcome)
+
+	#{command name : {'count', 'errors', 'timeouts', 'busy', 'p50', 'p95', 'p99', 'max'}} latencies in ms
+	def get_stats(self):
+		with self.stats_lock:
+			return {name : stats.summary() for name, stats in self.stats.items()}
+
+
+########################################################################
+# Class : CommandStats - call counts and recent latencies of one command
+########################################################################
+class CommandStats:
+
+	OK = 0
+	ERROR = 1
+	TIMEOUT = 2
+	BUSY = 3 #turned away by the server, the call was sent again or gave up
+
+	#samples=None keeps every latency (eg: to merge all connections of a load test)
+	def __init__(self, samples=Protocol.LATENCY_SAMPLES):
+		self.count = 0
+		self.errors = 0
+		self.timeouts = 0
+		self.busy = 0
+		self.latencies = collections.deque(maxlen=samples)
+
+	def record(self, seconds, outcome):
+		self.count += 1
+		if(outcome == CommandStats.ERROR):
+			self.errors += 1
+		elif(outcome == CommandStats.TIMEOUT):
+			self.timeouts += 1
+		elif(outcome == CommandStats.BUSY):
+			self.busy += 1
+		else:
+			self.latencies.append(seconds)
+
+	def merge(self, other):
+		self.count += other.count
+		self.errors += other.errors
+		self.timeouts += other.timeouts
+		self.busy += other.busy
+		self.latencies.extend(other.latencies)
+
+	def summary(self):
+		ordered = sorted(self.latencies)
+		return {'count' : self.count, 'errors' : self.errors, 'timeouts' : self.timeouts, 'busy' : self.busy,
+			'p50' : percentile(ordered, 50), 'p95' : percentile(ordered, 95), 'p99' : percentile(ordered, 99),
+			'max' : ordered[-1] * 1000 if ordered else 0.0}
+
+
+#p-th percentile in ms of an ordered list of latencies in seconds
+def percentile(ordered, p):
+	if(not ordered):
+		return 0.0
+	return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000
+
+def close_socket(sock):
+	try:
+		sock.shutdown(socket.SHUT_RDWR)
+	except OSError:
+		pass
+	sock.close()
+
+
+########################################################################
+# Class : PendingCall - a request sent to the server waiting for its 
+# response. The reader thread fills in result and sets done
+########################################################################
+class PendingCall:
+
+	def __init__(self, command):
+		self.command = command
+		self.request_id = 0
+		self.result = None
+		self.done = threading.Event()
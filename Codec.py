@@ -0,0 +1,177 @@
+import struct
+import Util
+from Config import Protocol
+
+########################################################################
+# Codec : serializes protocol messages into frame payloads.
+#
+# Two codecs are available, picked per connection with
+# Protocol.COMMAND_SET_CODEC (a connection always starts with json):
+#
+#   JsonCodec   - the original format, a json dict
+#                 request  : {'COMMAND' : cmd, 'client_id' : id, ...}
+#                 response : {cmd : result}
+#   BinaryCodec - fixed layout struct records for the hot commands
+#                 (update model, get model, check for win, check for
+#                 ready, get state). Any other message is sent as json behind a
+#                 JSON_TAG byte, so every command still works.
+#
+# Both codecs decode to the same dicts, so callers never need to know
+# which one a connection uses.
+########################################################################
+
+JSON = "json"
+BINARY = "binary"
+
+#first byte of a binary payload that carries json instead of a record
+JSON_TAG = 0xFF
+
+#request records : command, client_id, room_id [, row, column]
+REQUEST = struct.Struct("!BdI")
+MOVE_REQUEST = struct.Struct("!BdIhh")
+STATE_REQUEST = struct.Struct("!BdII")  # get state : + version the client has (0 = none)
+
+#response records, all start with the command byte
+STATUS_RESPONSE = struct.Struct("!BH")  # update model : text length (0 = no text) + utf-8 text
+MODEL_RESPONSE = struct.Struct("!Bhh")  # get model : row, col + utf-8 mark
+READY_RESPONSE = struct.Struct("!B?")   # check for ready
+WIN_RESPONSE = struct.Struct("!B?BBB")  # check for win : is_registered, id/name/mark lengths + utf-8 strings
+#get state : version, ready, last move row/col, winner is_registered, lengths of
+#last move mark and winner id/name/mark + utf-8 strings. Not modified is the command byte alone
+STATE_RESPONSE = struct.Struct("!BI?hh?BBBB")
+
+
+class JsonCodec:
+	name = JSON
+
+	def encode_request(self, msg):
+		return Util.msg_to_bytes(msg)
+
+	def decode_request(self, payload):
+		return Util.msg_from_bytes(payload)
+
+	def encode_response(self, command, result):
+		return Util.msg_to_bytes({command : result})
+
+	#json turns the command key into a string, eg: {"6": ["0", "1", "X"]}
+	def decode_response(self, payload):
+		return Util.msg_from_bytes(payload)
+
+	#server push events, {'EVENT' : ..., 'room_id' : ..., 'data' : ...}
+	def encode_event(self, event):
+		return Util.msg_to_bytes(event)
+
+	def decode_event(self, payload):
+		return self.decode_response(payload)
+
+
+class BinaryCodec(JsonCodec):
+	name = BINARY
+
+	#player_marker is not sent with a binary move, the server reads the mark from the room
+	def encode_request(self, msg):
+		command = msg.get('COMMAND')
+		try:
+			if(command == Protocol.COMMAND_GET_STATE and len(msg) <= 4):
+				return STATE_REQUEST.pack(command, msg['client_id'], msg.get('room_id', Protocol.DEFAULT_ROOM_ID), msg.get('version') or 0)
+			if(command == Protocol.COMMAND_UPDATE_MODEL):
+				return MOVE_REQUEST.pack(command, msg['client_id'], msg.get('room_id', Protocol.DEFAULT_ROOM_ID), msg['row'], msg['column'])
+			if(command in (Protocol.COMMAND_GET_MODEL, Protocol.COMMAND_CHECK_FOR_WIN, Protocol.COMMAND_CHECK_FOR_READY)
+					and len(msg) <= 3):
+				return REQUEST.pack(command, msg['client_id'], msg.get('room_id', Protocol.DEFAULT_ROOM_ID))
+		except (KeyError, TypeError, struct.error):
+			pass
+		return self.encode_json(msg)
+
+	def decode_request(self, payload):
+		tag = payload[0]
+		if(tag == JSON_TAG):
+			return Util.msg_from_bytes(payload[1:])
+		if(tag == Protocol.COMMAND_UPDATE_MODEL):
+			command, client_id, room_id, row, column = MOVE_REQUEST.unpack(payload)
+			return {'COMMAND' : command, 'client_id' : client_id, 'room_id' : room_id, 'row' : row, 'column' : column}
+		if(tag == Protocol.COMMAND_GET_STATE):
+			command, client_id, room_id, version = STATE_REQUEST.unpack(payload)
+			return {'COMMAND' : command, 'client_id' : client_id, 'room_id' : room_id, 'version' : version}
+		command, client_id, room_id = REQUEST.unpack(payload)
+		return {'COMMAND' : command, 'client_id' : client_id, 'room_id' : room_id}
+
+	def encode_response(self, command, result):
+		try:
+			if(command == Protocol.COMMAND_UPDATE_MODEL and (result is None or isinstance(result, str))):
+				text = (result or "").encode('utf-8')
+				return STATUS_RESPONSE.pack(command, len(text)) + text
+			if(command == Protocol.COMMAND_GET_MODEL and isinstance(result, (tuple, list)) and len(result) == 3):
+				return MODEL_RESPONSE.pack(command, int(result[0]), int(result[1])) + str(result[2]).encode('utf-8')
+			if(command == Protocol.COMMAND_CHECK_FOR_READY and result in ("True", "False")):
+				return READY_RESPONSE.pack(command, result == "True")
+			if(command == Protocol.COMMAND_CHECK_FOR_WIN and isinstance(result, dict)):
+				id = result['id'].encode('utf-8')
+				name = result['name'].encode('utf-8')
+				mark = result['mark'].encode('utf-8')
+				return WIN_RESPONSE.pack(command, result['is_registered'] == "True", len(id), len(name), len(mark)) + id + name + mark
+			if(command == Protocol.COMMAND_GET_STATE and result is None):
+				return bytes((command,))
+			if(command == Protocol.COMMAND_GET_STATE and isinstance(result, dict)):
+				row, col, last_mark = result['last_move']
+				last_mark = last_mark.encode('utf-8')
+				winner = result['winner']
+				id = winner['id'].encode('utf-8')
+				name = winner['name'].encode('utf-8')
+				mark = winner['mark'].encode('utf-8')
+				return STATE_RESPONSE.pack(command, result['version'], result['ready'] == "True", int(row), int(col),
+					winner['is_registered'] == "True", len(last_mark), len(id), len(name), len(mark)) + last_mark + id + name + mark
+		except (KeyError, ValueError, struct.error):
+			pass
+		return self.encode_json({command : result})
+
+	#decode to the same dict the json codec would have produced
+	def decode_response(self, payload):
+		tag = payload[0]
+		if(tag == JSON_TAG):
+			return Util.msg_from_bytes(payload[1:])
+		if(tag == Protocol.COMMAND_UPDATE_MODEL):
+			command, length = STATUS_RESPONSE.unpack_from(payload)
+			text = payload[STATUS_RESPONSE.size:].decode('utf-8')
+			return {str(command) : text if length else None}
+		if(tag == Protocol.COMMAND_GET_MODEL):
+			command, row, col = MODEL_RESPONSE.unpack_from(payload)
+			return {str(command) : [str(row), str(col), payload[MODEL_RESPONSE.size:].decode('utf-8')]}
+		if(tag == Protocol.COMMAND_CHECK_FOR_READY):
+			command, ready = READY_RESPONSE.unpack(payload)
+			return {str(command) : str(ready)}
+		if(tag == Protocol.COMMAND_CHECK_FOR_WIN):
+			command, registered, id_len, name_len, mark_len = WIN_RESPONSE.unpack_from(payload)
+			winner = unpack_player(payload[WIN_RESPONSE.size:], registered, id_len, name_len, mark_len)
+			return {str(command) : winner}
+		if(tag == Protocol.COMMAND_GET_STATE):
+			if(len(payload) == 1):
+				return {str(tag) : None}
+			command, version, ready, row, col, registered, last_len, id_len, name_len, mark_len = STATE_RESPONSE.unpack_from(payload)
+			fields = payload[STATE_RESPONSE.size:]
+			last_mark = fields[:last_len].decode('utf-8')
+			winner = unpack_player(fields[last_len:], registered, id_len, name_len, mark_len)
+			return {str(command) : {'version' : version, 'ready' : str(ready), 'winner' : winner, 'last_move' : [str(row), str(col), last_mark]}}
+		raise ValueError(f"unknown binary record tag {tag}")
+
+	#events are rare compared to polls, they go as json
+	def encode_event(self, event):
+		return self.encode_json(event)
+
+	def encode_json(self, msg):
+		return bytes((JSON_TAG,)) + Util.msg_to_bytes(msg)
+
+
+#player dict (Player.to_string()) from the strings that follow a record
+def unpack_player(fields, registered, id_len, name_len, mark_len):
+	id = fields[:id_len].decode('utf-8')
+	name = fields[id_len:id_len + name_len].decode('utf-8')
+	mark = fields[id_len + name_len:id_len + name_len + mark_len].decode('utf-8')
+	return {"id" : id, "name" : name, "mark" : mark, "is_registered" : str(registered)}
+
+
+CODECS = {JSON : JsonCodec(), BINARY : BinaryCodec()}
+
+#return the codec for a name, None if there isn't one
+def get_codec(name):
+	return CODECS.get(name)
@@ -15,10 +15,167 @@ class Protocol:
 	COMMAND_NEXT_TURN = 5
 	COMMAND_GET_MODEL = 6
 	COMMAND_CHECK_FOR_READY = 7 
+	COMMAND_CREATE_ROOM = 8
+	COMMAND_JOIN_ROOM = 9
+	COMMAND_LEAVE_ROOM = 10
+	COMMAND_SET_CODEC = 11 # {'codec' : 'json' | 'binary'}, applies to the rest of the connection
+	COMMAND_SUBSCRIBE = 12
+	COMMAND_UNSUBSCRIBE = 13
+	COMMAND_GET_STATE = 14 # {'version' : last version seen}, see below
+	COMMAND_GET_MOVES_SINCE = 15 # {'seq' : last move seq seen}, see GameRoom.get_moves_since()
+	COMMAND_GET_RULES = 16 # board of the room : {'rows' : rows, 'cols' : cols, 'k' : marks in a row to win}
+	COMMAND_GET_LEADERBOARD = 17 # {'count' : n, 'start' : players to skip}, see Rating.py
+	COMMAND_GET_RANK = 18 # {'player_id' : client id}, the rating and rank of one player
+	COMMAND_ENTER_LOBBY = 19 # {'player_name' : name} + optional 'rows', 'cols', 'k', see Lobby.py
+	COMMAND_LEAVE_LOBBY = 20
+	COMMAND_LOBBY_STATUS = 21 # waiting, matched (room id and mark) or none, see Lobby.status()
+	COMMAND_LOBBY_STATS = 22 # queue depth and time to match percentiles
+	COMMAND_STATS = 23 # server metrics : counters, gauges and latency histograms per command, see Metrics.py
+	COMMAND_PING = 24 # heartbeat, answers "PONG"
+	COMMAND_SPECTATE = 25 # watch the room : its events are pushed, the result is the room's snapshot, see Spectators.py
+	COMMAND_UNSPECTATE = 26
+	COMMAND_LOCATE_ROOM = 27 # {'room_id' : id} -> "host:port" of the node owning the room, None when not sharded, see Shard.py
+	COMMAND_RECORD_GAME = 28 # node to node : {'game' : archive record} of a game finished on another node, see Shard.py
+
+	#Server push : after COMMAND_SUBSCRIBE the server sends the room's events
+	#on the same connection as frames with request id PUSH_REQUEST_ID
+	#{'EVENT' : <EVENT_*>, 'room_id' : id, 'data' : <event data>}
+	PUSH_REQUEST_ID = 0
+	EVENT_READY = "ready"  # data : "True"
+	EVENT_MOVE = "move"    # data : (row, col, mark) same as COMMAND_GET_MODEL, 'seq' : move sequence number
+	EVENT_WIN = "win"      # data : winning player, same as COMMAND_CHECK_FOR_WIN
+	EVENT_MATCHED = "matched" # data : lobby status of a paired player, pushed to the connection that entered the lobby
+	EVENT_SNAPSHOT = "snapshot" # data : the room, same as the COMMAND_SPECTATE result. Sent to a spectator that skipped events
+	#COMMAND_SPECTATE result : {'rows', 'cols', 'k', 'seq' : last move seq, 'ready' : "True"|"False",
+	#'board' : rows x cols marks, 'winner' : <player>}
+
+	#Spectators (see Spectators.py)
+	MAX_SPECTATORS = 20000 #per room
+	SPECTATOR_MAX_BACKLOG = 64 * 1024 #bytes queued on a spectator before it skips events
+	SPECTATOR_LAG_TIMEOUT = 10.0 #seconds a spectator may skip events before it is dropped
+	SPECTATOR_WRITE_WAIT = 0.02 #seconds between retries of spectators whose socket is full
+	FANOUT_SLICE = 256 #spectators written between two commands by the asyncio engine
+	FANOUT_DELAY = 0.05 #seconds events wait for more of their room, a spectator gets them in one write
+
+	#COMMAND_GET_STATE result : None (not modified) when 'version' is the
+	#current version of the room, otherwise
+	#{'version' : n, 'ready' : "True"|"False", 'winner' : <player>, 'last_move' : (row, col, mark)}
+
+	#Rooms : every command carries a 'room_id' next to 'client_id'
+	#commands without one are sent to the default room
+	DEFAULT_ROOM_ID = 0
+	MAX_ROOMS = 20000
+	MOVE_LOG_SIZE = 64 #moves kept per room for COMMAND_GET_MOVES_SINCE
+	#COMMAND_CREATE_ROOM takes optional 'rows', 'cols' and 'k' (marks in a row
+	#to win), eg: 15, 15, 5 for gomoku. The default is a 3x3 board with k=3
+	MAX_BOARD_SIDE = 32
 	
 	SERVER_IP = "10.0.0.117"
 	SERVER_PORT = 12345
 	BUFFER_SIZE = 4096
+	MAX_FRAME_SIZE = 1 << 20 #largest payload accepted in one frame (see Framing.py)
+
+	#Server engine : "threaded" (one thread per client) or "async" (asyncio,
+	#one coroutine per client, see AsyncServer.py). 'python Server.py --mode async'
+	SERVER_MODE = "threaded"
+	ASYNC_BACKLOG = 4096 #pending connections queued by the listening socket
+
+	#Connections (see Connections.py), times in seconds
+	MAX_CONNECTIONS = 50000 #more are closed as soon as they are accepted
+	IDLE_TIMEOUT = 60.0 #connections that send nothing for this long are closed
+	IDLE_CHECK = 5.0 #seconds between idle checks
+	HEARTBEAT_INTERVAL = 15.0 #a client with nothing to send pings this often
+
+	#Rate limits (see RateLimit.py) : every connection and every player has a
+	#token bucket, a command costs RATE_COSTS tokens (1 when not listed)
+	RATE_LIMIT = 50.0 #tokens a second
+	RATE_BURST = 100.0
+	RATE_COSTS = {
+		COMMAND_PING : 0.1,
+		COMMAND_CHECK_FOR_READY : 0.5, #polls are cheaper than moves
+		COMMAND_CHECK_FOR_WIN : 0.5,
+		COMMAND_GET_MODEL : 0.5,
+		COMMAND_GET_STATE : 0.5,
+		COMMAND_GET_MOVES_SINCE : 0.5,
+		COMMAND_LOBBY_STATUS : 0.5,
+		COMMAND_CREATE_ROOM : 5.0,
+		COMMAND_ENTER_LOBBY : 2.0,
+		COMMAND_SPECTATE : 2.0,
+		COMMAND_GET_LEADERBOARD : 2.0,
+		COMMAND_STATS : 5.0,
+	}
+	#Admission control : requests are turned away while more than
+	#ADMIT_MAX_IN_FLIGHT are processed at once or the average processing
+	#time is over ADMIT_MAX_LATENCY seconds
+	ADMIT_MAX_IN_FLIGHT = 256
+	ADMIT_MAX_LATENCY = 0.25
+	ADMIT_RETRY_AFTER = 0.1 #seconds a shed client is told to wait
+	#A request turned away is answered {BUSY : {'reason' : "rate" | "overload", 'retry_after' : seconds}}
+	BUSY = "BUSY"
+
+	#Sharding (see Shard.py) : nodes "host:port" sharing the rooms, [] for one
+	#server. A room command sent to the wrong node is answered
+	#{REDIRECT : {'node' : "host:port", 'room_id' : id}}
+	SHARD_NODES = []
+	SHARD_VNODES = 160 #ring points per node
+	REDIRECT = "REDIRECT"
+	MAX_REDIRECTS = 3 #redirects a client follows for one call
+	RECORD_QUEUE_SIZE = 10000 #finished games waiting to be sent to the node keeping the ratings
+	RECORD_RETRY = 1.0 #seconds before a failed send to that node is tried again
+
+	#Worker processes sharing the server port (see Prefork.py), 1 for one
+	#process. Worker i also listens on worker port + i, by default the first
+	#port after the server port and the workers' metrics ports
+	PREFORK_WORKERS = 1
+	PREFORK_START_GRACE = 5.0 #a worker exiting sooner than this after its start failed to start
+	PREFORK_MAX_FAILURES = 5 #failed starts in a row of one worker before the server gives up
+
+	#Server bot : COMMAND_REGISTER_USER / COMMAND_JOIN_ROOM with 'opponent' : OPPONENT_BOT
+	#seats the server's bot as the second player, it moves right after each human move
+	OPPONENT_BOT = "bot"
+	BOT_NAME = "Bot"
+	BOT_CLIENT_ID = -2
+	BOT_TIME_BUDGET = 0.05 #seconds the bot may search for one move
+	BOT_TABLE_SIZE = 1 << 20 #positions kept in the bot's transposition table (see Bot.py)
+
+	#Client connection (see Client.ServerConnection), times in seconds
+	CONNECT_TIMEOUT = 2.0
+	CALL_TIMEOUT = 2.0 #default deadline of one call, connecting included
+	RECONNECT_BACKOFF_BASE = 0.1 #first retry delay, doubled on every failure
+	RECONNECT_BACKOFF_MAX = 5.0
+	LATENCY_SAMPLES = 1024 #latencies kept per command for the percentiles
+
+	#Game archive : every finished game is appended to ARCHIVE_PATH (index in
+	#ARCHIVE_PATH + ".idx") by a background writer, see Archive.py.
+	#'python Server.py --archive ""' turns it off
+	ARCHIVE_PATH = "games.archive"
+	ARCHIVE_BATCH = 256 #most games written at once
+
+	#Ratings : Elo, updated when a game is decided (see Rating.py). Results are
+	#{'rank', 'client_id', 'name', 'rating', 'wins', 'losses', 'draws'} dicts
+	RATING_START = 1500.0
+	RATING_K = 32.0 #most points a single game can move a rating
+	LEADERBOARD_MAX = 100 #most players in one COMMAND_GET_LEADERBOARD reply
+
+	#Lobby : players are paired within a rating window that widens while they wait
+	LOBBY_WINDOW = 50.0 #rating points at first
+	LOBBY_WINDOW_GROWTH = 25.0 #points more per second waited
+	LOBBY_WINDOW_MAX = 1000.0
+	LOBBY_SWEEP = 0.5 #seconds between checks of the widened windows
+	LOBBY_TIMEOUT = 60.0 #players without a lobby command for this long leave the lobby
+	LOBBY_POLL = 0.5 #seconds between COMMAND_LOBBY_STATUS calls of a waiting client
+
+	#Metrics : text endpoint for scrapers, 'python Server.py --metrics-port 0' turns it off
+	METRICS_HOST = "127.0.0.1"
+	METRICS_PORT = 12346
+
+	#Logging (see Log.py) : level "debug", "info", "warning", "error" or "off".
+	#'python Server.py --log-level debug' logs every command
+	LOG_LEVEL = "info"
+	LOG_QUEUE_SIZE = 65536 #events waiting for the writer, more are dropped
+	LOG_BATCH = 512 #most events written at once
+	LOG_SAMPLE = {} #event -> keep 1 of n, eg: {"command" : 100}
+	LOG_RATE = {"*" : 1000} #event -> most events a second, "*" for any event not listed
 
 	def __init__():
 		pass
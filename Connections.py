@@ -0,0 +1,81 @@
+"""
+Connections.py : registry of the client connections of one server.
+
+Connections are kept in a dict keyed by a connection id handed out on
+add(), so adding and removing one is O(1) whatever the number of clients.
+Every frame a client sends stamps its connection (see touch()), clients
+that send nothing for Protocol.IDLE_TIMEOUT seconds are evicted by the
+engine's reaper (see idle()). Idle but live clients keep their connection
+with COMMAND_PING, Client.ServerConnection sends one every
+Protocol.HEARTBEAT_INTERVAL seconds it has nothing else to send.
+"""
+
+import threading
+import time
+from Config import Protocol
+
+
+########################################################################
+# Class : ConnectionRegistry - open connections and their counts
+########################################################################
+class ConnectionRegistry:
+
+	def __init__(self, max_connections=Protocol.MAX_CONNECTIONS):
+		self.max_connections = max_connections
+		self.lock = threading.Lock()
+		self.connections = {} #connection id -> connection
+		self.next_id = 1
+		self.accepted = 0 #connections registered since the server started
+		self.rejected = 0 #turned away at max_connections
+		self.evicted = 0  #dropped for being idle
+		self.peak = 0
+
+	#register a connection, returns its id or None when the server is full
+	def add(self, connection):
+		now = time.monotonic()
+		with self.lock:
+			if(len(self.connections) >= self.max_connections):
+				self.rejected += 1
+				return None
+			conn_id = self.next_id
+			self.next_id += 1
+			connection.conn_id = conn_id
+			connection.last_seen = now
+			self.connections[conn_id] = connection
+			self.accepted += 1
+			self.peak = max(self.peak, len(self.connections))
+			return conn_id
+
+	def remove(self, conn_id):
+		with self.lock:
+			self.connections.pop(conn_id, None)
+
+	def get(self, conn_id):
+		return self.connections.get(conn_id)
+
+	def __len__(self):
+		return len(self.connections)
+
+	#the connections nothing was heard from for timeout seconds. They stay
+	#registered until the engine closed them and they remove themselves
+	def idle(self, timeout=Protocol.IDLE_TIMEOUT):
+		cutoff = time.monotonic() - timeout
+		with self.lock:
+			connections = list(self.connections.values())
+		found = [c for c in connections if c.last_seen < cutoff]
+		if(found):
+			with self.lock:
+				self.evicted += len(found)
+		return found
+
+	#live counts for the metrics
+	def get_stats(self):
+		with self.lock:
+			return {'connections' : len(self.connections), 'connections_peak' : self.peak,
+				'connections_total' : self.accepted, 'connections_rejected' : self.rejected,
+				'connections_evicted' : self.evicted, 'connections_max' : self.max_connections}
+
+
+#stamp a connection with the time a frame arrived on it
+def touch(connection):
+	connection.last_seen = time.monotonic()
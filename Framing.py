@@ -0,0 +1,67 @@
+import struct
+from Config import Protocol
+
+########################################################################
+# Framing : wire format shared by client and server.
+#
+# Every message on the TCP stream is a frame:
+#   [payload length : 4 bytes][request id : 4 bytes][payload]
+# both header fields are unsigned big endian ints. The payload is the
+# serialized command/result (see Util). The server answers a request
+# with a frame carrying the same request id so a client can have many
+# requests in flight on one socket and match up the responses.
+########################################################################
+
+HEADER = struct.Struct("!II")
+HEADER_SIZE = HEADER.size
+
+class FrameError(Exception):
+	pass
+
+#Wrap a payload in a frame
+def encode_frame(request_id, payload):
+	return HEADER.pack(len(payload), request_id) + payload
+
+
+########################################################################
+# Class : FrameReader - reassembles frames from a TCP byte stream.
+# recv() can return part of a frame or several frames at once, feed()
+# whatever arrived and take the complete frames out with frames()
+########################################################################
+class FrameReader:
+
+	def __init__(self, max_frame_size=Protocol.MAX_FRAME_SIZE):
+		self.buffer = bytearray()
+		self.max_frame_size = max_frame_size
+
+	def feed(self, data):
+		self.buffer += data
+
+	#yield (request_id, payload) for every complete frame in the buffer
+	def frames(self):
+		start = 0
+		buffer = self.buffer
+		try:
+			while len(buffer) - start >= HEADER_SIZE:
+				length, request_id = HEADER.unpack_from(buffer, start)
+				if(length > self.max_frame_size):
+					raise FrameError(f"frame of {length} bytes is over the {self.max_frame_size} byte limit")
+				end = start + HEADER_SIZE + length
+				if(len(buffer) < end):
+					break
+				payload = bytes(buffer[start + HEADER_SIZE:end])
+				start = end
+				yield request_id, payload
+		finally:
+			del buffer[:start]
+
+	#read from sock until one frame is complete. Returns (request_id, payload)
+	#or None when the peer closed the connection
+	def read_frame(self, sock):
+		while True:
+			for frame in self.frames():
+				return frame
+			data = sock.recv(Protocol.BUFFER_SIZE)
+			if(not data):
+				return None
+			self.feed(data)
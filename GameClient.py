@@ -0,0 +1,276 @@
+"""
+GameClient.py : headless Tic Tac Toe client.
+Holds the game state of one player and follows the game through the events
+the server pushes. It needs no tkinter, so bots, load tests and scripts can
+run many of them in one process. The Tk GUI (main.GameController and
+Board.Board) is one front end built on top of it.
+
+eg:
+	client = GameClient(host, port)
+	client.start()
+	client.register_user("bot")
+	client.process_event(timeout=1.0)   #or client.start_events() for a thread
+	client.play(1, 1)
+"""
+
+import threading
+import time
+from Config import Protocol
+import Client as NC
+import Log
+
+
+########################################################################
+# Class : GameClient - one player's view of a game on the server.
+#
+# Front ends override the on_ready/on_move/on_win hooks, they are called
+# from whichever thread processes the events (process_event() or the
+# thread started by start_events())
+########################################################################
+class GameClient:
+
+	def __init__(self, host=None, port=None, client_id=-1):
+		self.player_turn = True  #Is it my turn?
+		self.player_name = None  #The name the player registered with
+		self.player_mark = ""    #The player mark. Defaults assigned in server. Read on client side
+		self.winner = "NO_ONE"   #Who is the winner of this game?
+		self.in_progress = False #Is the game ready to be played or are we waiting for players to arrive?
+		self.game_over = False   #Is the game over?
+		self.isPlayerRegistered = False
+		self.move_seq = 0 #sequence number of the last move applied
+		self.board = {}   #(row, col) -> mark of every move applied
+		self.rules = {'rows' : 3, 'cols' : 3, 'k' : 3} #board of the room we play in, see join_room()
+		self.running = 0
+		self.iothread = None
+		self.game_server = NC.GameNetworkClient(host, port, client_id)
+
+	#connect to the server, see GameNetworkClient.start()
+	def start(self):
+		self.game_server.start()
+
+	#stop the event thread and close the connection for good
+	def stop(self):
+		self.stop_events()
+		if(self.game_server.connection is not None):
+			self.game_server.connection.close()
+
+	"""
+	Front end hooks, the defaults do nothing
+	"""
+	#two players are seated, moves can be played
+	def on_ready(self):
+		pass
+
+	#a move was played in the game, row/col are ints
+	def on_move(self, row, col, mark):
+		pass
+
+	#the game is decided, winner is the winner's name ("Draw" for a draw)
+	def on_win(self, winner):
+		pass
+
+	#the board was replaced by the server's (see sync_moves()), redraw all
+	#of it from get_mark(), cells may have been emptied
+	def on_board(self):
+		pass
+
+	#register with the server in the current room. Returns the player mark
+	#("" if the game already has two players)
+	#opponent=Protocol.OPPONENT_BOT to play against the server's bot
+	def register_user(self, name, opponent=None):
+		self.player_name = name
+		res = self.game_server.check_for_ready()
+		if(res == 'False'):
+			self.player_mark = self.game_server.register_user(name, opponent) or ""
+			Log.info("player.registered", name=name, mark=self.player_mark)
+			self.player_turn = True
+			self.isPlayerRegistered = self.player_mark != ""
+			if(self.isPlayerRegistered):
+				self.rules = self.game_server.get_rules() or self.rules
+		else:
+			Log.warning("player.register_failed", name=name, reason="game in progress")
+		return self.player_mark
+
+	#create a room on the server, returns its id. Use join_room() to play in it
+	#rows x cols board, k marks in a row to win (the server's 3x3, k=3 when None)
+	def create_room(self, rows=None, cols=None, k=None):
+		return self.game_server.create_room(rows, cols, k)
+
+	#join a room as a player, returns the player mark ("" if the room is full)
+	def join_room(self, room_id, name, opponent=None):
+		self.player_name = name
+		self.board = {}
+		self.move_seq = 0
+		self.player_mark = self.game_server.join_room(room_id, name, opponent) or ""
+		self.isPlayerRegistered = self.player_mark != ""
+		if(self.isPlayerRegistered):
+			self.rules = self.game_server.get_rules() or self.rules
+		return self.player_mark
+
+	#wait in the server's lobby until it pairs us with an opponent of a
+	#similar rating and seats us both in a new room. Returns the player
+	#mark, "" when no match was found within timeout seconds
+	def find_match(self, name, rows=None, cols=None, k=None, timeout=None):
+		self.player_name = name
+		self.board = {}
+		self.move_seq = 0
+		deadline = None if timeout is None else time.monotonic() + timeout
+		status = self.game_server.enter_lobby(name, rows, cols, k)
+		while status is not None and status.get('state') == "waiting":
+			if(deadline is not None and time.monotonic() > deadline):
+				self.game_server.leave_lobby()
+				return ""
+			#the match is pushed as soon as it is made, the polls keep our
+			#place in the lobby and let our rating window widen
+			event = self.game_server.get_event(Protocol.LOBBY_POLL)
+			if(event is not None and event['EVENT'] == Protocol.EVENT_MATCHED):
+				status = self.game_server.lobby_matched(event['data'])
+			else:
+				status = self.game_server.lobby_status()
+		if(status is None or status.get('state') != "matched"):
+			Log.warning("lobby.no_match", name=name, status=status)
+			return ""
+		self.player_mark = status['mark']
+		self.isPlayerRegistered = self.player_mark != ""
+		self.rules = status['rules']
+		Log.info("lobby.matched", name=name, opponent=status['opponent'], room=status['room_id'], mark=self.player_mark)
+		return self.player_mark
+
+	def leave_room(self):
+		self.game_server.leave_room()
+		self.isPlayerRegistered = False
+		self.in_progress = False
+
+	#play our mark at row, col. The move shows up as an EVENT_MOVE once the
+	#server accepted it
+	def play(self, row, col):
+		if(not self.in_progress):
+			Log.info("game.waiting", reason="move before both players joined")
+			return False
+		self.game_server.update_model(self.player_mark, row, col)
+		return True
+
+	#ask the server for the winner, see set_winner()
+	def check_for_win(self):
+		return self.set_winner(self.game_server.check_for_win())
+
+	#update the game state from a winning player dict (the result of
+	#COMMAND_CHECK_FOR_WIN or the data of an EVENT_WIN)
+	def set_winner(self, winning_player):
+		winner_name = "No Winner Yet"
+		## if no winner yet, server constructs a dummy player
+		## {'id': '000', 'name': 'No Winner', 'mark': '--', 'is_registered': 'False'}
+		if(isinstance(winning_player, dict) and winning_player['is_registered'] == 'True'):
+			winner_name = winning_player["name"]
+			self.game_over = True
+			self.in_progress = False
+		self.winner = winner_name
+		return self.winner
+
+	def is_game_over(self):
+		return self.game_over
+
+	def get_player_mark(self):
+		return self.player_mark
+
+	#mark at row, col ("" if empty) as far as this client has seen
+	def get_mark(self, row, col):
+		return self.board.get((row, col), "")
+
+	#forget the finished game and reset it on the server
+	def reset(self):
+		self.player_turn = True
+		self.player_name = None
+		self.isPlayerRegistered = False
+		self.winner = "NO_ONE"
+		self.in_progress = False
+		self.game_over = False
+		self.move_seq = 0
+		self.board = {}
+		self.game_server.reset()
+
+	"""
+	Events : subscribe to the room and apply what the server pushes
+	"""
+	#subscribe first, then catch up with anything that happened before
+	def subscribe(self):
+		self.game_server.subscribe()
+		state = self.game_server.get_state()
+		if(state is not None and state['ready'] == 'True'):
+			Log.info("game.started")
+			self.set_ready()
+			self.sync_moves()
+			if(state['winner']['is_registered'] == 'True'):
+				self.on_win(self.set_winner(state['winner']))
+		else:
+			Log.info("game.waiting")
+
+	#wait up to timeout for one pushed event and apply it. Returns the event or None
+	def process_event(self, timeout=None):
+		event = self.game_server.get_event(timeout)
+		if(event is None):
+			return None
+		if(event['EVENT'] == Protocol.EVENT_READY):
+			Log.info("game.started")
+			self.set_ready()
+		elif(event['EVENT'] == Protocol.EVENT_MOVE):
+			seq = event.get('seq', self.move_seq + 1)
+			if(seq == self.move_seq + 1):
+				self.move_seq = seq
+				row, col, mark = event['data']
+				self.apply_move(int(row), int(col), mark)
+			elif(seq > self.move_seq):
+				#we missed moves, fetch exactly the ones we don't have
+				self.sync_moves()
+		elif(event['EVENT'] == Protocol.EVENT_WIN):
+			self.on_win(self.set_winner(event['data']))
+		return event
+
+	"""
+	processMessages: while the player doesn't quit, wait for the events the
+	server pushes for our game (players ready, moves, winner) and apply them
+	"""
+	def processMessages(self):
+		self.subscribe()
+		while self.running:
+			self.process_event(timeout=0.5)
+
+	#process the events on a thread of their own
+	def start_events(self):
+		self.running = 1
+		self.iothread = threading.Thread(target=self.processMessages, daemon=True)
+		self.iothread.start()
+
+	def stop_events(self):
+		self.running = 0
+		if(self.iothread is not None and self.iothread is not threading.current_thread()):
+			self.iothread.join()
+		self.iothread = None
+
+	#bring the board up to date with the moves played since self.move_seq
+	def sync_moves(self):
+		res = self.game_server.get_moves_since(self.move_seq)
+		if(res is None):
+			return
+		if(res['moves'] is None):
+			#the server no longer has the moves we missed, take the whole board
+			#in place of ours, which may have marks the server no longer has
+			self.board = {}
+			for r, row in enumerate(res['board']):
+				for c, mark in enumerate(row):
+					if(mark):
+						self.board[(r, c)] = mark
+			self.move_seq = res['seq']
+			self.on_board()
+			return
+		for seq, r, c, mark in res['moves']:
+			self.apply_move(r, c, mark)
+		self.move_seq = res['seq']
+
+	def set_ready(self):
+		self.in_progress = True
+		self.on_ready()
+
+	def apply_move(self, row, col, mark):
+		self.board[(row, col)] = mark
+		self.on_move(row, col, mark)
@@ -0,0 +1,360 @@
+"""
+GameRoom.py : A single game (room) hosted by the Tic Tac Toe Server.
+Each room owns its board, players, turn state and last model change event
+so one server process can host many games side by side.
+"""
+
+import threading
+import collections
+import Player as plyr
+from Config import Protocol
+import BitBoard as bb
+from BitBoard import BitBoard
+import Bot
+import Archive
+import Rating
+import Spectators
+import Log
+
+#Results of checkForWin when nobody has won. These are shared instances so
+#polls don't build a new Player each time. DRAW is flagged as registered
+#so clients treat it like a winner and end the game
+NO_WINNER = plyr.Player("No Winner", "--", "000", False)
+DRAW = plyr.Player("Draw", "--", "000", True)
+#the winner of a mark whose player left the room since, the game stays won
+LEFT_WINNERS = {mark : plyr.Player("Left", mark, "000", True) for mark in ("X", "O")}
+
+########################################################################
+# Class : ModelChangeEvent - shared across client server to update
+#         which row/column/player the player chose for his/her turn
+#
+# Light weight model udpate event only sends whats changed last play
+#
+########################################################################
+class ModelChangeEvent:
+
+	def __init__(self, arow, acol, amark):
+		self.row = arow
+		self.col = acol
+		self.mark = amark
+
+	def get_row(self):
+		return self.row
+
+	def get_col(self):
+		return self.col
+
+	def get_mark(self):
+		return self.mark
+
+	def get_event(self):
+		return (self.row, self.col, self.mark)
+
+	def to_string(self):
+		return (str(self.row), str(self.col),str(self.mark))
+
+
+########################################################################
+# Class : GameRoom - the state of one game. The server keeps a registry
+#         of rooms keyed by room id, every command carries the room id
+#         next to the client_id and is applied to that room only.
+#
+#         All commands for a room are run while holding the room lock,
+#         so players in different rooms never contend with each other.
+#
+########################################################################
+class GameRoom:
+
+	#rows x cols board, k marks in a row win
+	def __init__(self, room_id, rows=bb.ROWS, cols=bb.COLS, k=bb.K):
+		self.room_id = room_id
+		self.rows = rows
+		self.cols = cols
+		self.k = k
+		self.lock = threading.Lock()
+		self.subscribers = set() #connections that get this room's events pushed to them
+		self.audience = Spectators.Audience(room_id) #spectators, they get the events through the server's fan-out
+		self.events = []         #events raised by the command being processed, see take_events()
+		self.version = 0         #bumped on every change of the game state, see get_state()
+		#every accepted move gets the next sequence number. The last
+		#Protocol.MOVE_LOG_SIZE moves of the current game are kept in
+		#move_log as (seq, row, col, mark) records, see get_moves_since()
+		self.move_seq = 0
+		self.move_log = collections.deque(maxlen=Protocol.MOVE_LOG_SIZE)
+		self.history = []  #(row, col) of every move of the current game, for the archive
+		self.finished = [] #records of games that ended, see take_finished()
+		self.bot_pending = False #a bot move is searched off the event loop, see AsyncServer.play_bot()
+		self.reset()
+
+	def get_room_id(self):
+		return self.room_id
+
+	#Is any player seated in this room?
+	def is_empty(self):
+		return len(self.player_list) == 0
+
+	#Reset the play state
+	def reset(self):
+		#a game reset or left before it was decided is archived as abandoned
+		if(self.history):
+			self.record_game(Archive.ABANDONED)
+		self.master_game_state = BitBoard(self.rows, self.cols, self.k) # one bitmask per mark
+		self.player_1 = None  # first player
+		self.player_2 = None  # second player
+		self.whose_turn = None  #which players turn is it?
+		self.previous_turn = None #who played the previous turn?
+		self.winner = None
+		self.this_turn = None
+		self.registered_player_count = 0 # number of registered players
+		self.begin_game = False
+		#initialize the model_event as a special event client
+		#so can handle early calls to get model state before player registreation
+		#client can be smarter to avoid this special case handling
+		self.model_event = ModelChangeEvent(-1,-1,"")
+		self.player_list = []
+		self.bot_player = None #the server's bot when it is seated, see add_bot()
+		self.version += 1
+		#moves at or before log_start belong to an earlier game
+		self.log_start = self.move_seq
+		self.move_log.clear()
+
+	#seat a player in this room. The first player gets "X" and the second "O"
+	#return the mark of the player or "" when the room is full
+	def register_player(self, client_data):
+		mark = ""
+		#a client registering again (eg: replaying its session after a
+		#reconnect) keeps its seat and mark
+		for p in self.player_list:
+			if (p.get_id() == client_data['client_id']):
+				Log.debug("player.reregistered", room=self.room_id, client=p.get_id(), name=p.get_name())
+				return p.get_mark()
+		#the newcomer takes the free seat, X first. A seat freed by a player
+		#who left is given again with its mark
+		if(self.player_1 is None):
+			self.player_1 = plyr.Player(client_data['player_name'],"X",client_data['client_id'],True)
+			player = self.player_1
+		elif(self.player_2 is None):
+			self.player_2 = plyr.Player(client_data['player_name'],"O",client_data['client_id'],True)
+			player = self.player_2
+		else:
+			Log.debug("player.rejected", room=self.room_id, client=client_data['client_id'], reason="room full")
+			return mark
+		player.register_player()
+		self.player_list.append(player)
+		self.registered_player_count += 1
+		self.version += 1
+		mark = player.get_mark()
+		Log.debug("player.registered", room=self.room_id, client=client_data['client_id'], mark=mark)
+		if(self.player_1 is not None and self.player_2 is not None):
+			#two players are seated, the game can begin
+			self.begin_game = True
+			self.publish(Protocol.EVENT_READY, str(self.begin_game))
+		return mark
+
+	#remove a player from this room. A game that loses a player is over,
+	#so the remaining state is reset once the room is empty
+	def un_register_player(self, client_data):
+		for p in list(self.player_list):
+			if (p.get_id() == client_data['client_id']):
+				Log.debug("player.unregistered", room=self.room_id, client=p.get_id(), name=p.get_name())
+				p.un_register_player()
+				self.player_list.remove(p)
+				self.registered_player_count -= 1 #decrement registered user count by 1
+				self.version += 1
+				#free the seat, the game waits for someone to take it
+				if(p is self.player_1):
+					self.player_1 = None
+				elif(p is self.player_2):
+					self.player_2 = None
+				self.begin_game = False
+		#the bot does not play on alone
+		if(self.is_empty() or self.player_list == [self.bot_player]):
+			self.reset()
+
+	#seat the server's bot as the second player of a room with one player
+	#return the bot's mark or "" when the room does not have exactly one player
+	def add_bot(self):
+		if(len(self.player_list) != 1):
+			return ""
+		mark = self.register_player({'client_id' : Protocol.BOT_CLIENT_ID, 'player_name' : Protocol.BOT_NAME})
+		Bot.get_rules(self.master_game_state.geometry) #outside the budget of its first move
+		self.bot_player = self.player_1 if mark == "X" else self.player_2
+		return mark
+
+	#the bot's mark when it is the bot's turn, else None
+	def bot_to_move(self):
+		if(self.bot_player is None or self.previous_turn is None or self.previous_turn is self.bot_player):
+			return None
+		return self.bot_player.get_mark()
+
+	#let the bot answer the human's move. Does nothing if there is no bot,
+	#it is not the bot's turn or the game is decided
+	def play_bot(self):
+		mark = self.bot_to_move()
+		if(mark is not None):
+			self.play_bot_move(Bot.choose_move(self.master_game_state, mark))
+
+	#play the bot's move, (row, col) or None when the game is over
+	def play_bot_move(self, move):
+		if(move is not None):
+			self.update_data_model({'client_id' : self.bot_player.get_id(), 'row' : move[0], 'column' : move[1]})
+
+	# check if game is ready to begin
+	# precondition is two players have to register
+	def check_for_ready(self):
+		##if we have 2 registerd players, the clients can begin the game
+		if (len(self.player_list) == 2):
+			self.begin_game = True
+		return str(self.begin_game)
+
+	def next_turn(self, command_details):
+		id = 0000
+		if command_details is not None:
+			self.this_turn = command_details['client_id']
+			id = self.this_turn
+		return id
+
+	#board shape and win rule of this room
+	def get_rules(self):
+		return {'rows' : self.rows, 'cols' : self.cols, 'k' : self.k}
+
+	# Return row, col and mark in a model change event
+	def get_model(self):
+		return self.model_event
+
+	#update server side data model - single version of truth
+	def update_data_model(self, new_data):
+
+		if(self.begin_game == False):
+			return
+
+		if not type(new_data) == dict:
+			Log.warning("move.malformed", room=self.room_id, type=type(new_data).__name__)
+			return
+
+		#only the seated players move
+		if(self.player_1 is not None and new_data['client_id'] == self.player_1.get_id()):
+			self.whose_turn = self.player_1
+		elif(self.player_2 is not None and new_data['client_id'] == self.player_2.get_id()):
+			self.whose_turn = self.player_2
+		else:
+			if(Log.enabled(Log.DEBUG)):
+				Log.debug("move.rejected", room=self.room_id, client=new_data['client_id'], reason="not seated")
+			return
+
+		#turns go by seat, a player taking over a freed seat keeps its turn
+		if((self.previous_turn is not None) and (self.previous_turn.get_mark() == self.whose_turn.get_mark())):
+			#same player is trying to play again, ignore it.
+			if(Log.enabled(Log.DEBUG)):
+				Log.debug("move.rejected", room=self.room_id, client=self.previous_turn.get_id(), reason="out of turn")
+			return
+
+		if(self.checkForWin() is not NO_WINNER):
+			if(Log.enabled(Log.DEBUG)):
+				Log.debug("move.rejected", room=self.room_id, client=self.whose_turn.get_id(), reason="game over")
+			return
+
+		#update the board, a taken cell keeps its mark
+		if(not self.master_game_state.place(new_data['row'], new_data['column'], self.whose_turn.get_mark())):
+			if(Log.enabled(Log.DEBUG)):
+				Log.debug("move.rejected", room=self.room_id, client=self.whose_turn.get_id(), row=new_data['row'], col=new_data['column'], reason="taken cell")
+			return
+
+		#create a model event based on changes
+		self.model_event = ModelChangeEvent(new_data['row'], new_data['column'], self.whose_turn.get_mark())
+		self.history.append((new_data['row'], new_data['column']))
+
+		self.previous_turn = self.whose_turn
+		self.version += 1
+		self.move_seq += 1
+		self.move_log.append((self.move_seq, new_data['row'], new_data['column'], self.whose_turn.get_mark()))
+		if(Log.enabled(Log.DEBUG)):
+			Log.debug("move", room=self.room_id, seq=self.move_seq, row=new_data['row'], col=new_data['column'], mark=self.whose_turn.get_mark())
+
+		self.publish(Protocol.EVENT_MOVE, self.model_event.to_string(), self.move_seq)
+		result = self.checkForWin()
+		if(result is not NO_WINNER):
+			self.publish(Protocol.EVENT_WIN, result.to_string())
+			if(result is DRAW):
+				self.record_game(Archive.DRAW)
+			else:
+				self.record_game(Archive.X_WINS if result.get_mark() == "X" else Archive.O_WINS)
+
+	#readiness, winner and last move in one reply. Returns None when the
+	#client already has the current version (nothing changed since)
+	def get_state(self, client_version=None):
+		if(client_version == self.version):
+			return None
+		if(self.begin_game):
+			winner = self.checkForWin()
+		else:
+			winner = NO_WINNER
+		return {'version' : self.version, 'ready' : str(self.begin_game), 'winner' : winner.to_string(), 'last_move' : self.model_event.to_string()}
+
+	#the moves played after seq, so a client that missed some gets exactly
+	#those. Returns {'seq' : last seq, 'moves' : [[seq, row, col, mark], ...]}
+	#If the moves after seq are no longer in the log (an older game or more
+	#than MOVE_LOG_SIZE moves behind) 'moves' is None and 'board' holds the
+	#whole board to resync from
+	def get_moves_since(self, seq):
+		first_logged = self.move_log[0][0] if self.move_log else self.move_seq + 1
+		if(seq < self.log_start or (seq + 1 < first_logged and seq < self.move_seq)):
+			return {'seq' : self.move_seq, 'moves' : None, 'board' : self.master_game_state.to_list()}
+		moves = [list(m) for m in self.move_log if m[0] > seq]
+		return {'seq' : self.move_seq, 'moves' : moves}
+
+	#the whole room for a spectator, see Protocol.COMMAND_SPECTATE
+	def get_snapshot(self):
+		winner = self.checkForWin() if self.begin_game else NO_WINNER
+		return {'rows' : self.rows, 'cols' : self.cols, 'k' : self.k, 'seq' : self.move_seq, 'ready' : str(self.begin_game),
+			'board' : self.master_game_state.to_list(), 'winner' : winner.to_string()}
+
+	#queue an event for the room's subscribers. The server sends the queued
+	#events once the command that raised them is done
+	#seq is the sequence number of a move event
+	def publish(self, event, data, seq=None):
+		if(self.subscribers or self.audience.spectators):
+			msg = {'EVENT' : event, 'room_id' : self.room_id, 'data' : data}
+			if(seq is not None):
+				msg['seq'] = seq
+			self.events.append(msg)
+
+	#return and clear the queued events
+	def take_events(self):
+		events = self.events
+		self.events = []
+		return events
+
+	#queue the record of the current game for the archive and start a new
+	#history, the moves after a decided game are ignored anyway
+	def record_game(self, result):
+		#ids and names go in the record as numbers and text, whatever the
+		#client registered with (see Archive.encode_game)
+		players = []
+		for p in (self.player_1, self.player_2):
+			client_id = Rating.player_id(p.get_id()) if p is not None else None
+			players.append((-1 if client_id is None else client_id, str(p.get_name()) if p is not None else ""))
+		self.finished.append(Archive.make_game(self.rows, self.cols, self.k, result, players, self.history))
+		Log.debug("game.finished", room=self.room_id, result=result, moves=len(self.history))
+		self.history = []
+
+	#return and clear the records of the games that ended, like take_events()
+	def take_finished(self):
+		finished = self.finished
+		self.finished = []
+		return finished
+
+	# Check if we have Tic Tac Toe
+	# Return the winning player (LEFT_WINNERS when that seat is empty now),
+	# DRAW when the board is full or NO_WINNER
+	def checkForWin(self):
+		mark = self.master_game_state.winner()
+		if(mark is not None):
+			if(self.player_1 is not None and mark == self.player_1.get_mark()):
+				return self.player_1
+			if(self.player_2 is not None and mark == self.player_2.get_mark()):
+				return self.player_2
+			return LEFT_WINNERS[mark]
+		if(self.master_game_state.is_full()):
+			return DRAW
+		return NO_WINNER
@@ -0,0 +1,235 @@
+"""
+LoadGen.py : headless load generator for the Tic Tac Toe Server.
+Plays N concurrent games against a running server with the real protocol
+commands: two players per game create and join a room, take turns moving
+and poll the room with COMMAND_GET_STATE while waiting for the other
+player's move. At the end it prints throughput and the latency
+percentiles, error and timeout counts per command.
+
+eg: python LoadGen.py --host 127.0.0.1 --games 500 --duration 60 --think 0.2 --poll 0.05
+
+One process can't load a multi-process server (see Prefork.py), --processes
+splits the games over that many generator processes and merges their stats.
+"""
+
+import argparse
+import random
+import threading
+import time
+from Config import Protocol
+import Client
+import Codec
+import Util
+import Shard
+import multiprocessing
+
+#a waiting player gives up on a move it has not seen after this many seconds
+MOVE_WAIT = 10.0
+
+
+########################################################################
+# Class : SimPlayer - one simulated player with its own server connection
+########################################################################
+class SimPlayer:
+
+	def __init__(self, host, port, client_id, name):
+		self.client_id = client_id
+		self.name = name
+		self.room_id = Protocol.DEFAULT_ROOM_ID
+		self.version = None #version of the last state read with get_state()
+		self.server_errors = {} #command name -> count of "ERROR: ..." replies
+		self.connection = Client.ServerConnection(host, port)
+
+	def start(self, codec):
+		self.connection.start()
+		if(codec != Codec.JSON):
+			self.connection.set_codec(codec)
+
+	#send a command for this player, returns its result or None. Follows
+	#the redirects of sharded or multi-process servers (see Shard.py)
+	def call(self, command, **fields):
+		server_command = dict(fields, COMMAND=command, client_id=self.client_id, room_id=self.room_id)
+		response = self.connection.call(server_command)
+		for i in range(Protocol.MAX_REDIRECTS):
+			if(response is None or Protocol.REDIRECT not in response):
+				break
+			host, port = Shard.parse_node(response[Protocol.REDIRECT]['node'])
+			self.connection = self.connection.move_to(host, port)
+			response = self.connection.call(server_command)
+		result = None if response is None else response.get(str(command))
+		if(isinstance(result, str) and result.startswith("ERROR")):
+			name = Util.command_name(command)
+			self.server_errors[name] = self.server_errors.get(name, 0) + 1
+		return result
+
+	#the room state if it changed since the last call, else None
+	def get_state(self):
+		state = self.call(Protocol.COMMAND_GET_STATE, version=self.version)
+		if(isinstance(state, dict)):
+			self.version = state['version']
+			return state
+		return None
+
+	def close(self):
+		self.connection.close()
+
+
+########################################################################
+# Class : SimGame - drives the two players of one game after the other
+# in a loop until the load test stops
+########################################################################
+class SimGame(threading.Thread):
+
+	def __init__(self, index, options, stop):
+		threading.Thread.__init__(self, daemon=True)
+		self.options = options
+		self.stop = stop
+		self.rnd = random.Random(index)
+		self.players = [SimPlayer(options.host, options.port, index * 2 + 1, f"sim{index}x"),
+						SimPlayer(options.host, options.port, index * 2 + 2, f"sim{index}o")]
+		self.delay = options.ramp * index / max(1, options.games) #stagger the start
+		self.games = 0 #games played to the end
+		self.stalled = 0 #games abandoned, see play()
+
+	def run(self):
+		if(self.stop.wait(self.delay)):
+			return
+		for player in self.players:
+			player.start(self.options.codec)
+		while not self.stop.is_set():
+			if(self.play()):
+				self.games += 1
+			else:
+				self.stalled += 1
+				self.stop.wait(Protocol.RECONNECT_BACKOFF_BASE)
+		for player in self.players:
+			player.close()
+
+	#one game from room creation to the last move. False if it could not be
+	#set up or a move was never seen by the other player
+	def play(self):
+		p1, p2 = self.players
+		p1.room_id = Protocol.DEFAULT_ROOM_ID
+		room_id = p1.call(Protocol.COMMAND_CREATE_ROOM)
+		if(not isinstance(room_id, int)):
+			return False
+		marks = []
+		for player in self.players:
+			player.room_id = room_id
+			player.version = None
+			marks.append(player.call(Protocol.COMMAND_JOIN_ROOM, player_name=player.name))
+		try:
+			if(marks != ["X", "O"]):
+				return False
+			cells = [(r, c) for r in range(3) for c in range(3)]
+			self.rnd.shuffle(cells)
+			for turn, (row, col) in enumerate(cells):
+				if(self.stop.is_set()):
+					return False
+				mover = self.players[turn % 2]
+				waiter = self.players[(turn + 1) % 2]
+				self.think()
+				mover.call(Protocol.COMMAND_UPDATE_MODEL, player_marker=marks[turn % 2], row=row, column=col)
+				state = self.wait_for_move(waiter, [str(row), str(col), marks[turn % 2]])
+				if(state is None):
+					return False
+				if(state['winner']['is_registered'] == "True"):
+					break
+			return True
+		finally:
+			for player in self.players:
+				player.call(Protocol.COMMAND_LEAVE_ROOM)
+
+	#poll every options.poll seconds until the move shows up as the last move
+	def wait_for_move(self, player, move):
+		deadline = time.monotonic() + MOVE_WAIT
+		while time.monotonic() < deadline and not self.stop.is_set():
+			state = player.get_state()
+			if(state is not None and state['last_move'] == move):
+				return state
+			self.stop.wait(self.options.poll)
+		return None
+
+	def think(self):
+		if(self.options.think > 0):
+			self.stop.wait(self.rnd.uniform(0.5, 1.5) * self.options.think)
+
+
+#merge the stats of every connection, samples are all kept for the percentiles
+def collect_stats(sims):
+	totals = {}
+	server_errors = {}
+	for sim in sims:
+		for player in sim.players:
+			connection = player.connection
+			with connection.stats_lock:
+				for name, stats in connection.stats.items():
+					totals.setdefault(name, Client.CommandStats(samples=None)).merge(stats)
+			for name, count in player.server_errors.items():
+				server_errors[name] = server_errors.get(name, 0) + count
+	return totals, server_errors
+
+#play games first .. first + count - 1 for options.duration seconds.
+#Returns (stats per command, server errors per command, games, stalled)
+def run_games(options, first, count):
+	stop = threading.Event()
+	sims = [SimGame(i, options, stop) for i in range(first, first + count)]
+	for sim in sims:
+		sim.start()
+	try:
+		stop.wait(options.duration)
+	except KeyboardInterrupt:
+		pass
+	stop.set()
+	for sim in sims:
+		sim.join(Protocol.CALL_TIMEOUT * 2)
+	totals, server_errors = collect_stats(sims)
+	return totals, server_errors, sum(sim.games for sim in sims), sum(sim.stalled for sim in sims)
+
+#the results of run_games() of several processes as one
+def merge_results(results):
+	totals = {}
+	server_errors = {}
+	for process_totals, process_errors, games, stalled in results:
+		for name, stats in process_totals.items():
+			totals.setdefault(name, Client.CommandStats(samples=None)).merge(stats)
+		for name, count in process_errors.items():
+			server_errors[name] = server_errors.get(name, 0) + count
+	return totals, server_errors, sum(r[2] for r in results), sum(r[3] for r in results)
+
+def report(concurrent, results, elapsed):
+	totals, server_errors, games, stalled = results
+	calls = sum(stats.count for stats in totals.values())
+	print(f"{concurrent} concurrent games, {elapsed:.1f}s")
+	print(f"games finished {games} ({games / elapsed:,.1f}/s), abandoned {stalled}")
+	print(f"calls {calls} ({calls / elapsed:,.0f}/s)")
+	print(f"{'command':<18} {'count':>9} {'errors':>7} {'timeouts':>8} {'busy':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+	for name in sorted(totals):
+		s = totals[name].summary()
+		errors = s['errors'] + server_errors.get(name, 0)
+		print(f"{name:<18} {s['count']:>9} {errors:>7} {s['timeouts']:>8} {s['busy']:>7} {s['p50']:>8.2f} {s['p95']:>8.2f} {s['p99']:>8.2f} {s['max']:>8.2f}")
+
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description="Tic Tac Toe load generator")
+	parser.add_argument("--host", default=Protocol.SERVER_IP)
+	parser.add_argument("--port", type=int, default=Protocol.SERVER_PORT)
+	parser.add_argument("--games", type=int, default=100, help="concurrent games, two players (connections) each")
+	parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+	parser.add_argument("--think", type=float, default=0.1, help="mean seconds a player thinks before moving")
+	parser.add_argument("--poll", type=float, default=0.05, help="seconds between state polls while waiting")
+	parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which the games are started")
+	parser.add_argument("--codec", choices=list(Codec.CODECS), default=Codec.JSON)
+	parser.add_argument("--processes", type=int, default=1, help="generator processes the games are split over")
+	options = parser.parse_args()
+
+	start = time.monotonic()
+	if(options.processes > 1):
+		share = -(-options.games // options.processes)
+		parts = [(options, first, min(share, options.games - first)) for first in range(0, options.games, share)]
+		with multiprocessing.Pool(len(parts)) as pool:
+			results = merge_results(pool.starmap(run_games, parts))
+	else:
+		results = run_games(options, 0, options.games)
+	report(options.games, results, time.monotonic() - start)
@@ -0,0 +1,252 @@
+"""
+Lobby.py : matchmaking. Players enter the lobby instead of picking a room,
+the lobby pairs them and seats each pair in a new room of its own, the
+player who waited longer plays X.
+
+Players are paired with someone of a close rating (see Rating.py). The
+window starts at Protocol.LOBBY_WINDOW rating points and widens by
+Protocol.LOBBY_WINDOW_GROWTH points every second a player waits, so nobody
+waits forever for a perfect match. Waiting players of one board rule are
+kept in a Rating.RankTree ordered by rating : a player entering is checked
+against the two waiting players next to its rating, O(log n). A player
+left waiting is due again when its window reaches its nearest neighbour's
+rating, kept in a heap of due times. The sweep, run by whichever lobby
+command comes in next at most every Protocol.LOBBY_SWEEP seconds, only
+checks the players that came due, O(log n) each, and drops the players
+gone quiet the same way.
+"""
+
+import collections
+import heapq
+import itertools
+import threading
+import time
+import Framing
+import Rating
+import Log
+from Config import Protocol
+
+WAITING = "waiting"
+MATCHED = "matched"
+NONE = "none"
+
+
+########################################################################
+# Class : Waiting - a player in the lobby
+########################################################################
+class Waiting:
+
+	__slots__ = ("client_id", "name", "rating", "rules", "since", "seen", "connection")
+
+	def __init__(self, client_id, name, rating, rules, connection, now):
+		self.client_id = client_id
+		self.name = name
+		self.rating = rating
+		self.rules = rules #(rows, cols, k) of the game the player wants
+		self.since = now   #entered the lobby
+		self.seen = now    #last lobby command, players gone for LOBBY_TIMEOUT are dropped
+		self.connection = connection #gets EVENT_MATCHED pushed, may be None
+
+	#lobby order : rating, the longer waiting player first
+	def key(self):
+		return (self.rating, self.since, self.client_id)
+
+	#rating points this player accepts between it and an opponent
+	def window(self, now):
+		return min(Protocol.LOBBY_WINDOW_MAX, Protocol.LOBBY_WINDOW + Protocol.LOBBY_WINDOW_GROWTH * (now - self.since))
+
+
+########################################################################
+# Class : Lobby - the matchmaking queue of one server. processor is the
+#         CommandProcessor that owns the rooms
+########################################################################
+class Lobby:
+
+	def __init__(self, processor):
+		self.processor = processor
+		self.lock = threading.Lock()
+		self.queues = {}   #(rows, cols, k) -> RankTree of Waiting
+		self.waiting = {}  #client id -> Waiting
+		self.matches = {}  #client id -> (time, status) of a player paired recently
+		self.matched = 0   #players paired since the server started
+		self.match_times = collections.deque(maxlen=Protocol.LATENCY_SAMPLES) #seconds waited by the last players paired
+		self.match_order = collections.deque() #(time, client id) of self.matches, oldest first
+		self.due = []     #heap of (time, n, Waiting) : when a window reaches the nearest rating
+		self.expiry = []  #heap of (time, n, Waiting) : when a player may have gone quiet
+		self.count = itertools.count() #n, keeps heap entries from comparing players
+		self.last_sweep = time.monotonic()
+
+	#put a player in the lobby, or pair it at once. Returns its status
+	def enter(self, client_id, name, rating, rules, connection=None):
+		now = time.monotonic()
+		with self.lock:
+			if(client_id not in self.waiting):
+				self.matches.pop(client_id, None)
+				player = Waiting(client_id, name, rating, tuple(rules), connection, now)
+				queue = self.queues.setdefault(player.rules, Rating.RankTree())
+				opponent = self.find_opponent(queue, player, now)
+				if(opponent is not None):
+					self.remove(opponent)
+					pairs = [(opponent, player)]
+				else:
+					self.add(queue, player, now)
+					pairs = []
+			else:
+				pairs = []
+			pairs += self.sweep(now)
+		self.start_games(pairs)
+		return self.status(client_id)
+
+	def leave(self, client_id):
+		with self.lock:
+			player = self.waiting.get(client_id)
+			if(player is not None):
+				self.remove(player)
+			self.matches.pop(client_id, None)
+		return "True"
+
+	#{'state' : WAITING, 'waited' : s, 'window' : points, 'queue_depth' : n},
+	#{'state' : MATCHED, 'room_id' : id, 'mark' : mark, 'opponent' : name, 'rules' : {...}}
+	#or {'state' : NONE} for a player that is not in the lobby
+	def status(self, client_id):
+		now = time.monotonic()
+		with self.lock:
+			pairs = self.sweep(now)
+		self.start_games(pairs)
+		with self.lock:
+			player = self.waiting.get(client_id)
+			if(player is not None):
+				player.seen = now
+				return {'state' : WAITING, 'waited' : round(now - player.since, 3), 'window' : round(player.window(now), 1),
+					'queue_depth' : len(self.waiting)}
+			match = self.matches.get(client_id)
+			if(match is not None):
+				return match[1]
+			return {'state' : NONE}
+
+	#queue depth and time to match percentiles (ms)
+	def get_stats(self):
+		with self.lock:
+			samples = sorted(self.match_times)
+			depth = {"x".join(str(n) for n in rules) : len(queue) for rules, queue in self.queues.items() if len(queue)}
+			stats = {'waiting' : len(self.waiting), 'queues' : depth, 'matched' : self.matched}
+		for name, p in (('p50', 50), ('p95', 95), ('p99', 99)):
+			stats[name] = round(samples[min(len(samples) - 1, len(samples) * p // 100)] * 1000.0, 1) if samples else None
+		stats['max'] = round(samples[-1] * 1000.0, 1) if samples else None
+		return stats
+
+	#the waiting player next to player's rating within either one's window, or None.
+	#Caller holds self.lock
+	def find_opponent(self, queue, player, now):
+		best = None
+		for other in self.neighbours(queue, player):
+			gap = abs(other.rating - player.rating)
+			if(gap <= max(player.window(now), other.window(now)) and (best is None or gap < abs(best.rating - player.rating))):
+				best = other
+		return best
+
+	#the waiting players next to player's rating, player may be waiting or not.
+	#Caller holds self.lock
+	def neighbours(self, queue, player):
+		position = queue.position(player.key())
+		if(position < len(queue) and queue.at(position) is player):
+			after = position + 1
+		else:
+			after = position
+		return [queue.at(index) for index in (position - 1, after) if 0 <= index < len(queue)]
+
+	#put a player in the lobby, it and its neighbours, who have a new
+	#nearest rating, are due when their windows reach it. Caller holds self.lock
+	def add(self, queue, player, now):
+		queue.insert(player)
+		self.waiting[player.client_id] = player
+		heapq.heappush(self.expiry, (player.seen + Protocol.LOBBY_TIMEOUT, next(self.count), player))
+		for other in [player] + self.neighbours(queue, player):
+			self.schedule(queue, other, now)
+
+	#push the time player's window reaches the rating of its nearest
+	#neighbour, nothing if it never does. Caller holds self.lock
+	def schedule(self, queue, player, now):
+		gaps = [abs(other.rating - player.rating) for other in self.neighbours(queue, player)]
+		if(not gaps or min(gaps) > Protocol.LOBBY_WINDOW_MAX or Protocol.LOBBY_WINDOW_GROWTH <= 0):
+			return
+		due = player.since + (min(gaps) - Protocol.LOBBY_WINDOW) / Protocol.LOBBY_WINDOW_GROWTH
+		heapq.heappush(self.due, (max(due, now + Protocol.LOBBY_SWEEP), next(self.count), player))
+
+	#take a player out of the lobby, its heap entries are skipped once they
+	#come due. Caller holds self.lock
+	def remove(self, player):
+		self.queues[player.rules].remove(player)
+		del self.waiting[player.client_id]
+
+	def is_waiting(self, player):
+		return self.waiting.get(player.client_id) is player
+
+	#pair the waiting players whose windows widened enough since they
+	#entered and drop the players gone quiet. Returns the pairs, caller
+	#holds self.lock and starts their games once it is released
+	def sweep(self, now):
+		if(now - self.last_sweep < Protocol.LOBBY_SWEEP):
+			return []
+		self.last_sweep = now
+		while self.expiry and self.expiry[0][0] <= now:
+			player = heapq.heappop(self.expiry)[2]
+			if(not self.is_waiting(player)):
+				continue
+			if(now - player.seen > Protocol.LOBBY_TIMEOUT):
+				Log.info("lobby.dropped", client=player.client_id, idle=round(now - player.seen))
+				self.remove(player)
+			else:
+				heapq.heappush(self.expiry, (player.seen + Protocol.LOBBY_TIMEOUT, next(self.count), player))
+		pairs = []
+		while self.due and self.due[0][0] <= now:
+			player = heapq.heappop(self.due)[2]
+			if(not self.is_waiting(player)):
+				continue
+			queue = self.queues[player.rules]
+			opponent = self.find_opponent(queue, player, now)
+			if(opponent is None):
+				self.schedule(queue, player, now)
+				continue
+			self.remove(player)
+			self.remove(opponent)
+			pairs.append((player, opponent))
+		while self.match_order and now - self.match_order[0][0] > Protocol.LOBBY_TIMEOUT:
+			matched, client_id = self.match_order.popleft()
+			match = self.matches.get(client_id)
+			if(match is not None and match[0] == matched):
+				del self.matches[client_id]
+		return pairs
+
+	#seat every pair in a new room and tell both players. Caller does not hold self.lock
+	def start_games(self, pairs):
+		for a, b in pairs:
+			if(b.since < a.since):
+				a, b = b, a
+			rows, cols, k = a.rules
+			room_id = self.processor.create_room(rows, cols, k)
+			now = time.monotonic()
+			if(room_id is None):
+				#no room left, both go back to the lobby
+				with self.lock:
+					for player in (a, b):
+						self.add(self.queues[player.rules], player, now)
+				continue
+			room = self.processor.rooms[room_id]
+			statuses = []
+			with room.lock:
+				for player, opponent in ((a, b), (b, a)):
+					mark = room.register_player({'client_id' : player.client_id, 'player_name' : player.name})
+					statuses.append({'state' : MATCHED, 'room_id' : room_id, 'mark' : mark, 'opponent' : opponent.name,
+						'rules' : {'rows' : rows, 'cols' : cols, 'k' : k}})
+			Log.debug("lobby.matched", room=room_id, x=a.client_id, x_rating=round(a.rating), o=b.client_id, o_rating=round(b.rating))
+			with self.lock:
+				for player, status in zip((a, b), statuses):
+					self.matches[player.client_id] = (now, status)
+					self.match_order.append((now, player.client_id))
+					self.match_times.append(now - player.since)
+					self.matched += 1
+			for player, status in zip((a, b), statuses):
+				if(player.connection is not None):
+					event = {'EVENT' : Protocol.EVENT_MATCHED, 'room_id' : room_id, 'data' : status}
+					player.connection.push(Framing.encode_frame(Protocol.PUSH_REQUEST_ID, player.connection.codec.encode_event(event)))
@@ -0,0 +1,179 @@
+"""
+Log.py : leveled, structured logging that stays off the request path.
+
+An event is a level, an event name and key=value fields :
+	Log.info("room.created", room=3, rows=15, cols=15, k=5)
+The caller only checks the level, the sampling and the rate cap of the
+event and queues a tuple, a background thread formats and writes the
+events in batches. Below the configured level a call costs one compare.
+
+Per event name (see Protocol.LOG_SAMPLE and Protocol.LOG_RATE)
+  sampling  : keep 1 event of every n
+  rate cap  : keep at most n events a second, the number dropped is
+              logged as a "log.suppressed" event once the second is over
+Events that find the queue full are dropped and counted the same way.
+Sampling and rate counters are not locked, under contention they are
+approximate, never wrong by more than a few events.
+
+eg: python Server.py --log-level debug
+"""
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from Config import Protocol
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVELS = {"debug" : DEBUG, "info" : INFO, "warning" : WARNING, "error" : ERROR, "off" : OFF}
+LEVEL_NAMES = {value : name.upper() for name, value in LEVELS.items()}
+
+
+########################################################################
+# Class : Logger - filters events and queues them for the writer thread
+########################################################################
+class Logger:
+
+	def __init__(self, level=INFO, stream=None, sample=None, rate=None, format="text"):
+		self.level = level
+		self.stream = stream
+		self.sample = dict(sample or {}) #event -> keep 1 of n
+		self.rate = dict(rate or {})     #event -> most events a second, "*" for every other event
+		self.format = format
+		self.seen = {}       #event -> events seen, for the sampling
+		self.window = {}     #event -> [second, events kept this second, events dropped this second]
+		self.dropped = 0     #events lost to a full queue since the last report
+		self.queue = queue.Queue(maxsize=Protocol.LOG_QUEUE_SIZE)
+		self.writer = None
+		self.writer_lock = threading.Lock()
+
+	def enabled(self, level):
+		return level >= self.level
+
+	#queue an event if its level, sampling and rate cap let it through
+	def log(self, level, event, fields):
+		if(level < self.level):
+			return
+		every = self.sample.get(event)
+		if(every is not None and every > 1):
+			seen = self.seen.get(event, 0) + 1
+			self.seen[event] = seen
+			if(seen % every != 1):
+				return
+		now = time.time()
+		limit = self.rate.get(event, self.rate.get("*"))
+		if(limit is not None):
+			second = int(now)
+			window = self.window.get(event)
+			if(window is None or window[0] != second):
+				if(window is not None and window[2]):
+					self.put((now, WARNING, "log.suppressed", {'event' : event, 'count' : window[2]}))
+				window = self.window[event] = [second, 0, 0]
+			if(window[1] >= limit):
+				window[2] += 1
+				return
+			window[1] += 1
+		self.put((now, level, event, fields))
+
+	def put(self, record):
+		if(self.writer is None):
+			self.start()
+		try:
+			self.queue.put_nowait(record)
+		except queue.Full:
+			self.dropped += 1
+
+	def start(self):
+		with self.writer_lock:
+			if(self.writer is None):
+				self.writer = threading.Thread(target=self.write_events, daemon=True)
+				self.writer.start()
+
+	#wait until every queued event is written
+	def flush(self):
+		if(self.writer is not None):
+			self.queue.join()
+
+	#writer thread : format whatever is queued and write it at once
+	def write_events(self):
+		while True:
+			records = [self.queue.get()]
+			while len(records) < Protocol.LOG_BATCH:
+				try:
+					records.append(self.queue.get_nowait())
+				except queue.Empty:
+					break
+			queued = len(records)
+			if(self.dropped):
+				dropped, self.dropped = self.dropped, 0
+				records.append((time.time(), WARNING, "log.dropped", {'count' : dropped}))
+			stream = self.stream or sys.stdout
+			try:
+				stream.write("".join(self.format_event(*record) for record in records))
+				stream.flush()
+			except (OSError, ValueError) as e:
+				sys.stderr.write(f"Log: could not write {len(records)} events: {e}\n")
+			finally:
+				for i in range(queued):
+					self.queue.task_done()
+
+	def format_event(self, when, level, event, fields):
+		stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(when)) + f".{int(when * 1000) % 1000:03d}"
+		if(self.format == "json"):
+			return json.dumps(dict(fields, time=stamp, level=LEVEL_NAMES.get(level, str(level)), event=event), default=str) + "\n"
+		text = " ".join(f"{key}={value}" for key, value in fields.items())
+		return f"{stamp} {LEVEL_NAMES.get(level, str(level)):<7} {event} {text}\n"
+
+
+LOGGER = Logger(LEVELS.get(Protocol.LOG_LEVEL, INFO), sample=Protocol.LOG_SAMPLE, rate=Protocol.LOG_RATE)
+
+def debug(event, **fields):
+	LOGGER.log(DEBUG, event, fields)
+
+def info(event, **fields):
+	LOGGER.log(INFO, event, fields)
+
+def warning(event, **fields):
+	LOGGER.log(WARNING, event, fields)
+
+def error(event, **fields):
+	LOGGER.log(ERROR, event, fields)
+
+#is level logged at all? Use it to skip building costly fields
+def enabled(level):
+	return level >= LOGGER.level
+
+def flush():
+	LOGGER.flush()
+
+#a forked child (see Prefork.py) has no writer thread, start it over with
+#an empty queue
+def reset_after_fork():
+	LOGGER.queue = queue.Queue(maxsize=Protocol.LOG_QUEUE_SIZE)
+	LOGGER.writer = None
+	LOGGER.writer_lock = threading.Lock()
+	LOGGER.dropped = 0
+
+if(hasattr(os, "register_at_fork")):
+	os.register_at_fork(after_in_child=reset_after_fork)
+
+#change the settings of the process' logger, None keeps a setting.
+#level is a name from LEVELS or a number
+def configure(level=None, sample=None, rate=None, stream=None, format=None):
+	if(level is not None):
+		LOGGER.level = LEVELS[level] if isinstance(level, str) else level
+	if(sample is not None):
+		LOGGER.sample = dict(sample)
+	if(rate is not None):
+		LOGGER.rate = dict(rate)
+	if(stream is not None):
+		LOGGER.stream = stream
+	if(format is not None):
+		LOGGER.format = format
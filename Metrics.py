@@ -0,0 +1,191 @@
+"""
+Metrics.py : counters, gauges and latency histograms of the server.
+
+Every command gets a request count, an error count, an in flight gauge and
+three latency histograms : decode (request payload to dict), process (the
+command itself, room lock included) and encode (result to response
+payload). Histograms have fixed power of two buckets of microseconds, so
+recording a latency is a bit_length() and a few additions under a lock
+per command, cheap enough to leave on.
+
+Read them with COMMAND_STATS or over http from the local text endpoint :
+	python Server.py --metrics-port 12346
+	curl http://127.0.0.1:12346/metrics
+"""
+
+import http.server
+import threading
+import time
+import Util
+import Log
+from Config import Protocol
+
+#bucket i counts latencies below 2^i microseconds, the last one the rest (> 16s)
+BUCKETS = 25
+
+#command keys of the requests that could not be decoded and of commands
+#the protocol does not have
+MALFORMED = "MALFORMED"
+UNKNOWN = "UNKNOWN"
+
+
+########################################################################
+# Class : Histogram - latencies in power of two microsecond buckets
+########################################################################
+class Histogram:
+
+	__slots__ = ("counts", "total", "max")
+
+	def __init__(self):
+		self.counts = [0] * BUCKETS
+		self.total = 0.0 #seconds
+		self.max = 0.0
+
+	#caller holds the lock of the owning CommandMetrics
+	def record(self, seconds):
+		self.counts[min(BUCKETS - 1, int(seconds * 1000000.0).bit_length())] += 1
+		self.total += seconds
+		if(seconds > self.max):
+			self.max = seconds
+
+	#upper bound (ms) of the bucket holding the p-th percentile
+	def percentile(self, p):
+		count = sum(self.counts)
+		if(count == 0):
+			return None
+		rank = count * p / 100.0
+		seen = 0
+		for i, n in enumerate(self.counts):
+			seen += n
+			if(seen >= rank):
+				return round(min((1 << i) / 1000.0, self.max * 1000.0), 3)
+		return round(self.max * 1000.0, 3)
+
+	def summary(self):
+		count = sum(self.counts)
+		return {'count' : count, 'mean' : round(self.total / count * 1000.0, 3) if count else None,
+			'p50' : self.percentile(50), 'p95' : self.percentile(95), 'p99' : self.percentile(99),
+			'max' : round(self.max * 1000.0, 3)}
+
+
+########################################################################
+# Class : CommandMetrics - counters and histograms of one command
+########################################################################
+class CommandMetrics:
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.requests = 0
+		self.errors = 0
+		self.busy = 0 #turned away by the rate limits or admission control
+		self.in_flight = 0
+		self.decode = Histogram()
+		self.process = Histogram()
+		self.encode = Histogram()
+
+	def start(self):
+		with self.lock:
+			self.in_flight += 1
+
+	#one request done, times in seconds
+	def done(self, decode, process, encode, error):
+		with self.lock:
+			self.in_flight -= 1
+			self.requests += 1
+			if(error):
+				self.errors += 1
+			self.decode.record(decode)
+			self.process.record(process)
+			self.encode.record(encode)
+
+	#one request turned away before it was processed
+	def rejected(self, decode):
+		with self.lock:
+			self.in_flight -= 1
+			self.requests += 1
+			self.busy += 1
+			self.decode.record(decode)
+
+	def summary(self):
+		with self.lock:
+			return {'requests' : self.requests, 'errors' : self.errors, 'busy' : self.busy, 'in_flight' : self.in_flight,
+				'decode' : self.decode.summary(), 'process' : self.process.summary(), 'encode' : self.encode.summary()}
+
+
+########################################################################
+# Class : ServerMetrics - the metrics of one server
+########################################################################
+class ServerMetrics:
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.commands = {} #command -> CommandMetrics
+		self.started = time.time()
+
+	#metrics of a command. Commands outside the protocol share UNKNOWN so
+	#clients can't grow the table
+	def get_command(self, command):
+		if(type(command) is not int or command not in Util.COMMAND_NAMES):
+			command = UNKNOWN if command != MALFORMED else MALFORMED
+		metrics = self.commands.get(command)
+		if(metrics is None):
+			with self.lock:
+				metrics = self.commands.setdefault(command, CommandMetrics())
+		return metrics
+
+	#everything as a dict, gauges is a dict of the values only the server
+	#knows (connections, rooms, games active ...)
+	def snapshot(self, gauges=None):
+		with self.lock:
+			commands = list(self.commands.items())
+			stats = {'uptime' : round(time.time() - self.started, 1)}
+		stats.update(gauges or {})
+		stats['commands'] = {Util.command_name(command) : metrics.summary() for command, metrics in sorted(commands, key=lambda item: str(item[0]))}
+		return stats
+
+
+#snapshot as "name{labels} value" lines, one metric per line
+def to_text(stats):
+	lines = []
+	for name, value in stats.items():
+		if(name != 'commands' and value is not None):
+			lines.append(f"tictactoe_{name} {value}")
+	for command, summary in stats['commands'].items():
+		for name in ('requests', 'errors', 'busy', 'in_flight'):
+			lines.append(f'tictactoe_command_{name}{{command="{command}"}} {summary[name]}')
+		for stage in ('decode', 'process', 'encode'):
+			for name, value in summary[stage].items():
+				if(value is not None):
+					lines.append(f'tictactoe_command_{stage}_ms{{command="{command}",stat="{name}"}} {value}')
+	return "\n".join(lines) + "\n"
+
+
+########################################################################
+# Class : MetricsHandler - GET /metrics on the local text endpoint
+########################################################################
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		if(self.path.split("?")[0] not in ("/", "/metrics")):
+			self.send_error(404)
+			return
+		body = to_text(self.server.processor.get_stats()).encode('utf-8')
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	#scrapes are not worth a line each on the server's output
+	def log_message(self, format, *args):
+		pass
+
+#serve processor.get_stats() as text on host:port from a daemon thread.
+#Returns the http server
+def start_http(processor, port, host=Protocol.METRICS_HOST):
+	server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+	server.daemon_threads = True
+	server.processor = processor
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	Log.info("metrics.started", url=f"http://{host}:{server.server_address[1]}/metrics")
+	return server
@@ -0,0 +1,144 @@
+"""
+Prefork.py : multi-process server mode, one worker process per core.
+
+The parent binds the public port and forks Protocol.PREFORK_WORKERS
+workers that all accept on it (the listening socket is inherited). Every
+worker also listens on a private port, worker_port + its index, and the
+workers are the nodes of a shard ring (see Shard.py) : a room is only ever
+touched by the worker owning its id, a room command that lands on another
+worker is answered with a redirect to the owner's private port and the
+client moves there. The lobby lives on one worker, it creates its rooms
+there. That worker also keeps the archive and the ratings, the others send
+it their finished games.
+
+Each worker has its own metrics endpoint (metrics port + index). The
+parent only restarts the workers that exit and stops them all on SIGINT
+or SIGTERM. A worker that fails to start (eg: its port is taken) is
+restarted after a delay doubling at every failure, after
+Protocol.PREFORK_MAX_FAILURES failures in a row the server stops. Needs
+fork(), so not on windows.
+
+eg: python Server.py --workers 4 --host 127.0.0.1 --port 12345
+"""
+
+import os
+import signal
+import socket
+import threading
+import time
+import Log
+import Metrics
+import Shard
+from Config import Protocol
+
+#seconds before a worker that exited is started again, doubled for every
+#failed start in a row up to RESPAWN_MAX_DELAY
+RESPAWN_DELAY = 1.0
+RESPAWN_MAX_DELAY = 30.0
+
+
+#threaded engine : hand the connections accepted on the shared socket to
+#the worker's server, like the ones of its private port
+def accept_shared(server, listener):
+	while True:
+		try:
+			request, client_address = listener.accept()
+		except OSError as e:
+			Log.warning("prefork.accept_failed", error=e)
+			time.sleep(0.1)
+			continue
+		server.process_request(request, client_address)
+
+#body of worker index, never returns
+def run_worker(index, listener, options):
+	import Server
+	import AsyncServer
+	nodes = [Shard.node_name(options.host, options.worker_port + i) for i in range(options.workers)]
+	port = options.worker_port + index
+	archive = options.archive or None #only opened by the worker holding the lobby
+	Log.info("prefork.worker", worker=index, pid=os.getpid(), port=port)
+	if(options.mode == "async"):
+		server = AsyncServer.AsyncServer(options.host, port, archive, nodes)
+		server.sockets.append(listener)
+	else:
+		server = Server.Server(options.host, port, archive, nodes)
+		threading.Thread(target=accept_shared, args=(server, listener), daemon=True).start()
+	if(options.metrics_port):
+		Metrics.start_http(server, options.metrics_port + index)
+	if(options.mode == "async"):
+		server.start()
+	else:
+		server.serve_forever()
+
+
+########################################################################
+# Class : Prefork - the parent process, forks and watches the workers
+########################################################################
+class Prefork:
+
+	#options : the parsed command line of Server.py
+	def __init__(self, options):
+		self.options = options
+		self.listener = socket.create_server((options.host, options.port), backlog=Protocol.ASYNC_BACKLOG)
+		self.workers = {}  #pid -> worker index
+		self.started = {}  #worker index -> when it was last started
+		self.failures = {} #worker index -> failed starts in a row
+		self.stopping = False
+
+	def spawn(self, index):
+		pid = os.fork()
+		if(pid == 0):
+			signal.signal(signal.SIGINT, signal.SIG_DFL)
+			signal.signal(signal.SIGTERM, signal.SIG_DFL)
+			try:
+				run_worker(index, self.listener, self.options)
+			except BaseException as e:
+				Log.error("prefork.worker_failed", worker=index, error=repr(e))
+				Log.flush()
+			finally:
+				os._exit(1)
+		self.workers[pid] = index
+		self.started[index] = time.monotonic()
+
+	def stop(self, signum, frame):
+		self.stopping = True
+		for pid in list(self.workers):
+			try:
+				os.kill(pid, signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+
+	#fork the workers and wait on them, returns once they all stopped :
+	#True when they were told to, False when one kept failing to start
+	def run(self):
+		signal.signal(signal.SIGINT, self.stop)
+		signal.signal(signal.SIGTERM, self.stop)
+		for index in range(self.options.workers):
+			self.spawn(index)
+		Log.info("prefork.started", workers=self.options.workers, host=self.options.host, port=self.options.port,
+			worker_ports=f"{self.options.worker_port}-{self.options.worker_port + self.options.workers - 1}")
+		while self.workers:
+			try:
+				pid, status = os.wait()
+			except ChildProcessError:
+				break
+			except InterruptedError:
+				continue
+			index = self.workers.pop(pid, None)
+			if(index is None or self.stopping):
+				continue
+			if(time.monotonic() - self.started[index] < Protocol.PREFORK_START_GRACE):
+				self.failures[index] = self.failures.get(index, 0) + 1
+			else:
+				self.failures[index] = 0
+			if(self.failures[index] >= Protocol.PREFORK_MAX_FAILURES):
+				Log.error("prefork.gave_up", worker=index, failures=self.failures[index])
+				self.stop(None, None)
+				continue
+			delay = min(RESPAWN_MAX_DELAY, RESPAWN_DELAY * 2 ** self.failures[index])
+			Log.warning("prefork.worker_exited", worker=index, pid=pid, status=status, restart_in=delay)
+			time.sleep(delay)
+			if(not self.stopping):
+				self.spawn(index)
+		self.listener.close()
+		return not self.failures or max(self.failures.values()) < Protocol.PREFORK_MAX_FAILURES
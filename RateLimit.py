@@ -0,0 +1,141 @@
+"""
+RateLimit.py : rate limits and admission control of the server.
+
+Every request is charged against two token buckets, one of its connection
+and one of its player (client id), before it is processed. Commands cost
+Protocol.RATE_COSTS tokens (1 when not listed) so polls can be made
+cheaper than moves. A bucket refills at Protocol.RATE_LIMIT tokens a
+second up to Protocol.RATE_BURST.
+
+Admission control sheds load server wide : when more than
+Protocol.ADMIT_MAX_IN_FLIGHT commands are being processed at once or the
+recent processing time (an exponentially weighted average) is above
+Protocol.ADMIT_MAX_LATENCY, requests are turned away before they take a
+room lock.
+
+A request turned away is answered with {Protocol.BUSY : {'reason' : ...,
+'retry_after' : seconds}} instead of {command : result}.
+Client.ServerConnection waits retry_after and sends it again while its
+deadline allows.
+"""
+
+import threading
+import time
+from Config import Protocol
+
+#reasons of a busy reply
+RATE = "rate"         #the connection or player is over its rate
+OVERLOAD = "overload" #the server is shedding load
+
+#weight of the last processing time in the average admission control reads
+LATENCY_WEIGHT = 0.05
+
+
+########################################################################
+# Class : TokenBucket - rate / burst token bucket
+########################################################################
+class TokenBucket:
+
+	__slots__ = ("rate", "burst", "tokens", "stamp")
+
+	def __init__(self, rate, burst, now):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.stamp = now
+
+	def refill(self, now):
+		self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+		self.stamp = now
+
+	#take cost tokens. Returns 0.0 when they were there, else the seconds
+	#until they will be (nothing is taken then)
+	def take(self, cost, now):
+		self.refill(now)
+		if(self.tokens >= cost):
+			self.tokens -= cost
+			return 0.0
+		return (cost - self.tokens) / self.rate
+
+
+########################################################################
+# Class : RateLimiter - the per connection and per player buckets
+########################################################################
+class RateLimiter:
+
+	def __init__(self, rate=Protocol.RATE_LIMIT, burst=Protocol.RATE_BURST, costs=Protocol.RATE_COSTS):
+		self.rate = rate
+		self.burst = burst
+		self.costs = costs
+		self.lock = threading.Lock()
+		self.players = {} #client id -> TokenBucket
+
+	#charge a request. Returns None when it may go ahead, else the seconds
+	#to wait before sending it again. A connection's requests are processed
+	#one at a time, so only the player buckets need the lock
+	def check(self, connection, client_id, command):
+		cost = self.costs.get(command, 1.0)
+		now = time.monotonic()
+		bucket = connection.rate_bucket
+		if(bucket is None):
+			bucket = connection.rate_bucket = TokenBucket(self.rate, self.burst, now)
+		wait = bucket.take(cost, now)
+		if(wait == 0.0 and client_id is not None):
+			with self.lock:
+				player = self.players.get(client_id)
+				if(player is None):
+					player = self.players[client_id] = TokenBucket(self.rate, self.burst, now)
+				wait = player.take(cost, now)
+			if(wait):
+				bucket.tokens += cost #give the connection its tokens back
+		return wait or None
+
+	#forget the player buckets that refilled, a new bucket would be the same
+	def prune(self):
+		now = time.monotonic()
+		with self.lock:
+			for client_id, bucket in list(self.players.items()):
+				bucket.refill(now)
+				if(bucket.tokens >= bucket.burst):
+					del self.players[client_id]
+
+
+########################################################################
+# Class : Admission - server wide load shedding
+########################################################################
+class Admission:
+
+	def __init__(self, max_in_flight=Protocol.ADMIT_MAX_IN_FLIGHT, max_latency=Protocol.ADMIT_MAX_LATENCY):
+		self.max_in_flight = max_in_flight
+		self.max_latency = max_latency
+		self.lock = threading.Lock()
+		self.in_flight = 0
+		self.latency = 0.0 #seconds, weighted average of the recent processing times
+		self.shed = 0
+
+	#let a command in. Returns None when admitted (call leave() once it is
+	#done), else the seconds to wait before sending it again
+	def enter(self):
+		with self.lock:
+			if(self.in_flight >= self.max_in_flight or self.latency > self.max_latency):
+				self.shed += 1
+				#while shedding nothing new is measured, let the average decay
+				#so the server takes a little work again after a while
+				self.latency *= 1.0 - LATENCY_WEIGHT
+				return Protocol.ADMIT_RETRY_AFTER
+			self.in_flight += 1
+			return None
+
+	def leave(self, seconds):
+		with self.lock:
+			self.in_flight -= 1
+			self.latency += (seconds - self.latency) * LATENCY_WEIGHT
+
+	def get_stats(self):
+		with self.lock:
+			return {'in_flight' : self.in_flight, 'latency_ms' : round(self.latency * 1000.0, 3), 'shed' : self.shed}
+
+
+#the reply to a request turned away
+def busy(reason, retry_after):
+	return {'reason' : reason, 'retry_after' : round(retry_after, 3)}
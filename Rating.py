@@ -0,0 +1,297 @@
+"""
+Rating.py : Elo ratings of every player the server has seen and the
+leaderboard. A rating changes only when a game is decided (see
+GameRoom.record_game), by the usual Elo update against the opponent.
+
+The leaderboard is a RankTree ordered by (rating high to low, client id) :
+a treap where every node knows the size of its subtree, so a player's
+rank, the n-th player and an insert or removal on a rating change are all
+O(log n). The top n players are an in order walk of the first n nodes, no
+request ever sorts the players. The lobby (Lobby.py) keeps its waiting
+players in one too.
+"""
+
+import random
+import threading
+import Archive
+from Config import Protocol
+
+#Elo : expected score of a against b is 1 / (1 + 10^((b - a) / SCALE))
+SCALE = 400.0
+
+
+#client ids are RankTree keys, so they must all compare with each other :
+#whole numbers only. Returns client_id as an int (clients may send 42.0),
+#None when it is not a whole number
+def player_id(client_id):
+	if(isinstance(client_id, bool)):
+		return None
+	if(isinstance(client_id, int)):
+		return client_id
+	if(isinstance(client_id, float) and client_id.is_integer()):
+		return int(client_id)
+	return None
+
+
+########################################################################
+# Class : PlayerRating - rating and record of one player
+########################################################################
+class PlayerRating:
+
+	__slots__ = ("client_id", "name", "rating", "wins", "losses", "draws")
+
+	def __init__(self, client_id, name, rating=Protocol.RATING_START):
+		self.client_id = client_id
+		self.name = name
+		self.rating = rating
+		self.wins = 0
+		self.losses = 0
+		self.draws = 0
+
+	def games(self):
+		return self.wins + self.losses + self.draws
+
+	#leaderboard order : best rating first, client id breaks ties
+	def key(self):
+		return (-self.rating, self.client_id)
+
+	def to_string(self):
+		return {'client_id' : self.client_id, 'name' : self.name, 'rating' : round(self.rating, 1),
+			'wins' : self.wins, 'losses' : self.losses, 'draws' : self.draws}
+
+
+class Node:
+
+	__slots__ = ("key", "item", "priority", "size", "left", "right")
+
+	def __init__(self, item):
+		self.key = item.key()
+		self.item = item
+		self.priority = random.random()
+		self.size = 1
+		self.left = None
+		self.right = None
+
+
+def size(node):
+	return node.size if node is not None else 0
+
+def update(node):
+	node.size = 1 + size(node.left) + size(node.right)
+
+#split a treap into the nodes with key < key and the rest
+def split(node, key):
+	if(node is None):
+		return None, None
+	if(node.key < key):
+		left, right = split(node.right, key)
+		node.right = left
+		update(node)
+		return node, right
+	left, right = split(node.left, key)
+	node.left = right
+	update(node)
+	return left, node
+
+#join two treaps, every key of left is below every key of right
+def merge(left, right):
+	if(left is None):
+		return right
+	if(right is None):
+		return left
+	if(left.priority > right.priority):
+		left.right = merge(left.right, right)
+		update(left)
+		return left
+	right.left = merge(left, right.left)
+	update(right)
+	return right
+
+
+########################################################################
+# Class : RankTree - order statistics treap of items ordered by their
+#         key(). An item's key must not change while it is in the tree
+########################################################################
+class RankTree:
+
+	def __init__(self):
+		self.root = None
+
+	def __len__(self):
+		return size(self.root)
+
+	def insert(self, item):
+		node = Node(item)
+		left, right = split(self.root, node.key)
+		self.root = merge(merge(left, node), right)
+
+	#remove the node of item, its key must be the one it was inserted with
+	def remove(self, item):
+		key = item.key()
+		left, right = split(self.root, key)
+		#right starts with the node of key, drop its smallest node
+		removed, right = split_first(right)
+		self.root = merge(left, right)
+
+	#1 based rank of the item whose key is key, None if there is none
+	def rank(self, key):
+		rank = 1
+		node = self.root
+		while node is not None:
+			if(node.key < key):
+				rank += size(node.left) + 1
+				node = node.right
+			elif(node.key == key):
+				return rank + size(node.left)
+			else:
+				node = node.left
+		return None
+
+	#number of items with a key below key (where key would be inserted)
+	def position(self, key):
+		position = 0
+		node = self.root
+		while node is not None:
+			if(node.key < key):
+				position += size(node.left) + 1
+				node = node.right
+			else:
+				node = node.left
+		return position
+
+	#the item at 0 based position index
+	def at(self, index):
+		node = self.root
+		while node is not None:
+			left = size(node.left)
+			if(index < left):
+				node = node.left
+			elif(index == left):
+				return node.item
+			else:
+				index -= left + 1
+				node = node.right
+		raise IndexError(index)
+
+	#items ranked start + 1 .. start + count, smallest key first
+	def top(self, count, start=0):
+		found = []
+		stack = []
+		node = self.root
+		skip = start
+		#walk down to the start-th node, remembering the path for the in order walk
+		while node is not None:
+			if(skip < size(node.left)):
+				stack.append(node)
+				node = node.left
+			elif(skip == size(node.left)):
+				stack.append(node)
+				node = None
+			else:
+				skip -= size(node.left) + 1
+				node = node.right
+		while stack and len(found) < count:
+			node = stack.pop()
+			found.append(node.item)
+			node = node.right
+			while node is not None:
+				stack.append(node)
+				node = node.left
+		return found
+
+#split off the smallest node of a treap, returns (that node, the rest)
+def split_first(node):
+	if(node is None):
+		return None, None
+	if(node.left is None):
+		rest = node.right
+		node.right = None
+		update(node)
+		return node, rest
+	first, node.left = split_first(node.left)
+	update(node)
+	return first, node
+
+
+########################################################################
+# Class : RatingTable - ratings of every player and the leaderboard,
+#         shared by every room of the server
+########################################################################
+class RatingTable:
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.players = {} #client id -> PlayerRating
+		self.leaderboard = RankTree()
+
+	#the rating of a player, RATING_START for a player who never finished a game
+	def get_rating(self, client_id):
+		with self.lock:
+			player = self.players.get(client_id)
+			return player.rating if player is not None else Protocol.RATING_START
+
+	def get_player(self, client_id, name):
+		player = self.players.get(client_id)
+		if(player is None):
+			player = self.players[client_id] = PlayerRating(client_id, name)
+			self.leaderboard.insert(player)
+		elif(name):
+			player.name = name
+		return player
+
+	#update the ratings of the two players of a decided game, game is an
+	#archive record (see Archive.encode_game). Abandoned games, games a
+	#player played against itself and games of a player whose id is not a
+	#whole number are not rated
+	def record_game(self, game):
+		if(game['result'] == Archive.ABANDONED):
+			return
+		(x_id, x_name), (o_id, o_name) = game['players']
+		x_id, o_id = player_id(x_id), player_id(o_id)
+		if(x_id is None or o_id is None or x_id == o_id):
+			return
+		score = {Archive.X_WINS : 1.0, Archive.O_WINS : 0.0, Archive.DRAW : 0.5}[game['result']]
+		with self.lock:
+			x = self.get_player(x_id, x_name)
+			o = self.get_player(o_id, o_name)
+			expected = 1.0 / (1.0 + 10 ** ((o.rating - x.rating) / SCALE))
+			change = Protocol.RATING_K * (score - expected)
+			#a rating is part of the leaderboard key, so take the node out and put it back
+			for player, delta in ((x, change), (o, -change)):
+				self.leaderboard.remove(player)
+				player.rating += delta
+				self.leaderboard.insert(player)
+			if(score == 1.0):
+				x.wins += 1
+				o.losses += 1
+			elif(score == 0.0):
+				x.losses += 1
+				o.wins += 1
+			else:
+				x.draws += 1
+				o.draws += 1
+
+	#rate every game of an archive scan, oldest first
+	def replay(self, games):
+		count = 0
+		for game in games:
+			self.record_game(game)
+			count += 1
+		return count
+
+	#players ranked start + 1 .. start + count as dicts with their 'rank'
+	def get_leaderboard(self, count, start=0):
+		count = max(0, min(count, Protocol.LEADERBOARD_MAX))
+		start = max(0, start)
+		with self.lock:
+			players = self.leaderboard.top(count, start)
+			return [dict(p.to_string(), rank=start + n + 1) for n, p in enumerate(players)]
+
+	#the rating, record and rank of a player, None for a player who never
+	#finished a game. client_id is a player_id()
+	def get_rank(self, client_id):
+		with self.lock:
+			player = self.players.get(client_id)
+			if(player is None):
+				return None
+			return dict(player.to_string(), rank=self.leaderboard.rank(player.key()), players=len(self.leaderboard))
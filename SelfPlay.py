@@ -0,0 +1,248 @@
+"""
+SelfPlay.py : offline self-play and round robin tournaments between bot
+strategies. Games are played in process with the same rules the server
+applies in GameRoom.update_data_model (players alternate, a move on a taken
+or off board cell is ignored, no moves once the game is decided), spread
+over a multiprocessing pool. Results stream back as each batch finishes.
+
+eg: python SelfPlay.py --games 100000 --strategies random greedy search
+    python SelfPlay.py --games 20000 --scaling        #games/s for 1..N processes
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import time
+import BitBoard as bb
+import Bot
+
+#games per task handed to a worker process
+BATCH_SIZE = 1000
+
+#a player whose moves are ignored this many times in a row forfeits the game
+MAX_IGNORED_MOVES = 3
+
+#results of one game
+X_WINS = "X"
+O_WINS = "O"
+DRAW = "draw"
+
+
+"""
+Strategies : function(board, mark, rnd, options) -> (row, col)
+board is a BitBoard, mark the mark to play, rnd a random.Random
+"""
+
+#any empty cell
+def random_strategy(board, mark, rnd, options):
+	free = [i for i in range(board.geometry.cell_count) if not (board.x_mask | board.o_mask) >> i & 1]
+	return divmod(rnd.choice(free), board.cols)
+
+#win if possible, else block the opponent's win, else a random cell among
+#the ones on the most open lines
+def greedy_strategy(board, mark, rnd, options):
+	geometry = board.geometry
+	me, opp = (board.x_mask, board.o_mask) if mark == "X" else (board.o_mask, board.x_mask)
+	occupied = me | opp
+	free = [i for i in Bot.get_rules(geometry).cells if not occupied >> i & 1]
+	for mask in (me, opp):
+		for index in free:
+			if(geometry.wins_at(mask | (1 << index), index)):
+				return divmod(index, board.cols)
+	best = []
+	best_score = -1
+	for index in free:
+		score = sum(1 for win in geometry.win_masks if win >> index & 1 and not win & opp)
+		if(score > best_score):
+			best = [index]
+			best_score = score
+		elif(score == best_score):
+			best.append(index)
+	return divmod(rnd.choice(best), board.cols)
+
+#the server's bot (Bot.py) with the tournament's time budget
+def search_strategy(board, mark, rnd, options):
+	return Bot.choose_move(board, mark, options['budget'])
+
+STRATEGIES = {
+	"random" : random_strategy,
+	"greedy" : greedy_strategy,
+	"search" : search_strategy,
+}
+
+
+########################################################################
+# Class : MatchStats - results of the games between one X and one O
+# strategy. Workers fill one per batch, the parent merges them
+########################################################################
+class MatchStats:
+
+	def __init__(self, x_name, o_name):
+		self.x_name = x_name
+		self.o_name = o_name
+		self.games = 0
+		self.results = {X_WINS : 0, O_WINS : 0, DRAW : 0}
+		self.forfeits = 0
+		self.moves = 0
+		#X's first move cell -> {result : count}
+		self.openings = {}
+
+	def add(self, result, first_move, moves, forfeit):
+		self.games += 1
+		self.results[result] += 1
+		self.moves += moves
+		if(forfeit):
+			self.forfeits += 1
+		opening = self.openings.get(first_move)
+		if(opening is None):
+			opening = self.openings[first_move] = {X_WINS : 0, O_WINS : 0, DRAW : 0}
+		opening[result] += 1
+
+	def merge(self, other):
+		self.games += other.games
+		self.forfeits += other.forfeits
+		self.moves += other.moves
+		for result, count in other.results.items():
+			self.results[result] += count
+		for cell, results in other.openings.items():
+			opening = self.openings.setdefault(cell, {X_WINS : 0, O_WINS : 0, DRAW : 0})
+			for result, count in results.items():
+				opening[result] += count
+
+	def rate(self, result):
+		return self.results[result] / self.games if self.games else 0.0
+
+
+#play one game, returns (result, X's first move, moves played, forfeit)
+def play_game(x_strategy, o_strategy, rnd, options):
+	board = bb.BitBoard(options['rows'], options['cols'], options['k'])
+	players = ((x_strategy, "X"), (o_strategy, "O"))
+	turn = 0
+	first_move = None
+	while board.winner() is None and not board.is_full():
+		strategy, mark = players[turn % 2]
+		ignored = 0
+		while True:
+			row, col = strategy(board, mark, rnd, options)
+			if(board.place(row, col, mark)):
+				break
+			#the server ignores a move on a taken cell, the player has to play again
+			ignored += 1
+			if(ignored >= MAX_IGNORED_MOVES):
+				return (O_WINS if mark == "X" else X_WINS), first_move, turn, True
+		if(first_move is None):
+			first_move = (row, col)
+		turn += 1
+	winner = board.winner()
+	if(winner == "X"):
+		return X_WINS, first_move, turn, False
+	if(winner == "O"):
+		return O_WINS, first_move, turn, False
+	return DRAW, first_move, turn, False
+
+#worker : play a batch of games between two strategies
+def run_batch(task):
+	x_name, o_name, games, seed, options = task
+	rnd = random.Random(seed)
+	x_strategy = STRATEGIES[x_name]
+	o_strategy = STRATEGIES[o_name]
+	stats = MatchStats(x_name, o_name)
+	for i in range(games):
+		stats.add(*play_game(x_strategy, o_strategy, rnd, options))
+	return stats
+
+#tasks of a round robin : every strategy plays every strategy (itself
+#included) with both marks, games per pairing split in BATCH_SIZE batches
+def round_robin_tasks(names, games, seed, options):
+	tasks = []
+	for n, (x_name, o_name) in enumerate(itertools.product(names, repeat=2)):
+		for start in range(0, games, BATCH_SIZE):
+			tasks.append((x_name, o_name, min(BATCH_SIZE, games - start), seed + n * games + start, options))
+	return tasks
+
+#run a round robin on processes worker processes. Calls progress(stats, done
+#games, total games, seconds) as each batch comes back. Returns
+#({(x_name, o_name) : MatchStats}, seconds)
+def tournament(names, games, processes, seed=1, options=None, progress=None):
+	tasks = round_robin_tasks(names, games, seed, options)
+	total = sum(task[2] for task in tasks)
+	matches = {(x, o) : MatchStats(x, o) for x, o in itertools.product(names, repeat=2)}
+	done = 0
+	start = time.perf_counter()
+	with multiprocessing.Pool(processes) as pool:
+		for stats in pool.imap_unordered(run_batch, tasks):
+			matches[(stats.x_name, stats.o_name)].merge(stats)
+			done += stats.games
+			if(progress is not None):
+				progress(stats, done, total, time.perf_counter() - start)
+	return matches, time.perf_counter() - start
+
+def print_progress(stats, done, total, seconds):
+	print(f"  {done:>10}/{total} games {done / seconds:>12,.0f} games/s")
+
+def report(matches, seconds):
+	games = sum(m.games for m in matches.values())
+	print(f"{games} games in {seconds:.1f}s, {games / seconds:,.0f} games/s")
+	print(f"{'X':<8} {'O':<8} {'games':>9} {'X wins':>8} {'O wins':>8} {'draws':>8} {'forfeit':>8} {'moves':>6}")
+	for (x_name, o_name), m in sorted(matches.items()):
+		print(f"{x_name:<8} {o_name:<8} {m.games:>9} {m.rate(X_WINS):>8.1%} {m.rate(O_WINS):>8.1%} {m.rate(DRAW):>8.1%} "
+			f"{m.forfeits:>8} {m.moves / max(1, m.games):>6.1f}")
+
+	#score : a win is 1, a draw 1/2, over every game a strategy played
+	scores = {}
+	for (x_name, o_name), m in matches.items():
+		for name, wins in ((x_name, m.results[X_WINS]), (o_name, m.results[O_WINS])):
+			played, score = scores.get(name, (0, 0.0))
+			scores[name] = (played + m.games, score + wins + m.results[DRAW] / 2)
+	print("standings")
+	for name, (played, score) in sorted(scores.items(), key=lambda item: -item[1][1] / item[1][0]):
+		print(f"  {name:<8} {score / played:>6.1%} of {played} games")
+
+	#openings : outcome by X's first move over all games
+	openings = MatchStats("all", "all")
+	for m in matches.values():
+		openings.merge(m)
+	print("X first move    X wins  O wins   draws")
+	for cell, results in sorted(openings.openings.items(), key=lambda item: item[0] or (-1, -1)):
+		count = sum(results.values())
+		print(f"  {str(cell):<12} {results[X_WINS] / count:>7.1%} {results[O_WINS] / count:>7.1%} {results[DRAW] / count:>7.1%}")
+
+#games/s of the same tournament on 1, 2, 4 ... cpu_count processes
+def scaling(names, games, options, seed=1):
+	counts = []
+	n = 1
+	while n < os.cpu_count():
+		counts.append(n)
+		n *= 2
+	counts.append(os.cpu_count())
+	base = None
+	print(f"{'processes':>9} {'games/s':>12} {'speedup':>8}")
+	for processes in counts:
+		matches, seconds = tournament(names, games, processes, seed, options)
+		rate = sum(m.games for m in matches.values()) / seconds
+		base = base or rate
+		print(f"{processes:>9} {rate:>12,.0f} {rate / base:>7.1f}x")
+
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description="Tic Tac Toe self-play tournaments")
+	parser.add_argument("--strategies", nargs="+", choices=list(STRATEGIES), default=list(STRATEGIES))
+	parser.add_argument("--games", type=int, default=10000, help="games per pairing (X strategy, O strategy)")
+	parser.add_argument("--processes", type=int, default=os.cpu_count())
+	parser.add_argument("--rows", type=int, default=bb.ROWS)
+	parser.add_argument("--cols", type=int, default=bb.COLS)
+	parser.add_argument("--k", type=int, default=bb.K)
+	parser.add_argument("--budget", type=float, default=0.01, help="seconds per move of the search strategy")
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--scaling", action="store_true", help="report games/s for 1..cpu count processes")
+	args = parser.parse_args()
+
+	options = {'rows' : args.rows, 'cols' : args.cols, 'k' : args.k, 'budget' : args.budget}
+	if(args.scaling):
+		scaling(args.strategies, args.games, options, args.seed)
+	else:
+		matches, seconds = tournament(args.strategies, args.games, args.processes, args.seed, options, print_progress)
+		report(matches, seconds)
@@ -6,439 +6,757 @@ Custom Protocol for commands defined in Config.py
 
 import socket
 import select 
-import pandas as pd 
 import Player as plyr 
 from Config import Protocol 
 import socketserver 
 import Util
+import Framing
+import Codec
+import Archive
+import Rating
+import Lobby
+import Metrics
+import Connections
+import RateLimit
+import Spectators
+import Shard
+import struct
+from GameRoom import GameRoom, ModelChangeEvent, NO_WINNER
+import BitBoard as bb
+from BitBoard import BitBoard
 import threading
 import time
+import argparse
+import sys
+import os
+import Log
 
-DEBUG = 1 #debug flag
-def pdebug(msg):
-	if(DEBUG):
-		print("DEBUG:" + msg)
-
-"""
-Global variables
-"""
-clientCount = 0  # global reference count for clients
-CLIENTS = [] 	 # global list of client sockets
-shared_message = {'SERVER_BROADCAST' : 'Message'}  #shared message buffer
-threadLock = threading.Lock()
+#send flag of the fan-out's writes. Windows has none, a full socket then blocks the fan-out
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
 
 ########################################################################
-# Class : ModelChangeEvent - shared across client server to update
-#         which row/column/player the player chose for his/her turn
+# Class : ClientConnection - protocol state of one client connection,
+#         shared by the threaded (ServerRequestHandler) and the asyncio
+#         (AsyncServer.AsyncConnection) server engines.
+#
+#         Requests arrive as frames (see Framing.py) encoded with the
+#         connection's codec (see Codec.py). A client may send 
+#         several requests without waiting; they are processed in order
+#         and each response carries the request id it answers.
 #
-# Light weight model udpate event only sends whats changed last play
+#         Engines implement push() to write framed bytes to the client
+#         and drop() to close the connection from another thread or task.
+#         Spectators get their events through queue() and backlog(),
+#         which must not block (see Spectators.py)
 #
 ########################################################################
-class ModelChangeEvent:
-
-	def __init__(self, arow, acol, amark):
-		self.row = arow
-		self.col = acol
-		self.mark = amark 
-
-	def get_row(self):
-		return self.row
-
-	def get_col(self):
-		return self.col
-
-	def get_mark(self):
-		return self.mark
-
-	def get_event(self):
-		return (self.row, self.col, self.mark)
+class ClientConnection:
+
+	#returns False when the server is at its connection limit, the engine
+	#then closes the connection without serving it
+	def setup_connection(self, server):
+		self.game_server = server
+		self.codec = Codec.get_codec(Codec.JSON) #every connection starts with json
+		self.subscriptions = set() #ids of the rooms this connection subscribed to
+		self.spectating = set()    #ids of the rooms this connection watches
+		self.rate_bucket = None #see RateLimit.RateLimiter
+		self.conn_id = server.connections.add(self) #also sets last_seen
+		return self.conn_id is not None
+
+	#stop receiving events once the client is gone
+	def close_connection(self):
+		for room_id in list(self.subscriptions):
+			self.game_server.unsubscribe(room_id, self)
+		for room_id in list(self.spectating):
+			self.game_server.unspectate(room_id, self)
+		if(self.conn_id is not None):
+			self.game_server.connections.remove(self.conn_id)
+
+	#process every complete frame in reader, return the framed responses
+	def process_frames(self, reader):
+		Connections.touch(self)
+		responses = []
+		for request_id, payload in reader.frames():
+			responses.append(Framing.encode_frame(request_id, self.process_request(payload)))
+		return b"".join(responses)
+
+	#decode one request, run the command and return the encoded response
+	#decode, process and encode times go to the command's metrics
+	def process_request(self, payload):
+		start = time.perf_counter()
+		try:
+			client_data_decoded = self.codec.decode_request(payload)
+			command = client_data_decoded['COMMAND']
+			hash(command) #the command is the key of the response dict
+		except (ValueError, KeyError, TypeError, IndexError, struct.error) as e:
+			Log.warning("request.malformed", payload=payload[:64], error=e)
+			response = self.codec.encode_response('ERROR', "malformed request")
+			metrics = self.game_server.metrics.get_command(Metrics.MALFORMED)
+			metrics.start()
+			metrics.done(time.perf_counter() - start, 0.0, 0.0, True)
+			return response
+		metrics = self.game_server.metrics.get_command(command)
+		metrics.start()
+		decoded = time.perf_counter()
+
+		#codec negotiation is per connection, the reply still uses the old codec
+		if(command == Protocol.COMMAND_SET_CODEC):
+			codec = Codec.get_codec(client_data_decoded.get('codec'))
+			if(codec is None):
+				response = self.codec.encode_response(command, self.codec.name)
+			else:
+				response = self.codec.encode_response(command, codec.name)
+				self.codec = codec
+			metrics.done(decoded - start, 0.0, time.perf_counter() - decoded, codec is None)
+			return response
 
-	def to_string(self):
-		return (str(self.row), str(self.col),str(self.mark))
+		try:
+			#rooms of other nodes, see Shard.py
+			node = self.game_server.route(command, client_data_decoded)
+			#rate limits and load shedding, before any lock is taken
+			busy = self.game_server.admit(self, command, client_data_decoded) if node is None else None
+		except Exception as e:
+			Log.error("command.failed", command=Util.command_name(command), error=repr(e))
+			response = self.codec.encode_response(command, "ERROR: " + str(e))
+			metrics.done(decoded - start, 0.0, time.perf_counter() - decoded, True)
+			return response
+		if(node is not None):
+			response = self.codec.encode_response(Protocol.REDIRECT, Shard.redirect(node, client_data_decoded.get('room_id')))
+			metrics.done(decoded - start, 0.0, time.perf_counter() - decoded, False)
+			return response
+		if(busy is not None):
+			metrics.rejected(decoded - start)
+			return self.codec.encode_response(Protocol.BUSY, busy)
+
+		error = False
+		try:
+			status = self.game_server.process_server_commands(command, client_data_decoded, self)
+			error = isinstance(status, str) and status.startswith("ERROR")
+		except Exception as e:
+			#a bad command must not take the connection down, report it back
+			Log.error("command.failed", command=Util.command_name(command), error=repr(e))
+			status = "ERROR: " + str(e)
+			error = True
+		processed = time.perf_counter()
+		self.game_server.admission.leave(processed - decoded)
+
+		#Send result of command processing
+		#response to client in format dict
+		#{COMMAND:<RESULT>}
+		#COMMAND is from Config.py and <RESULT> is an object custom to the command
+		#Client proxy Client.py should parse this correctly.
+		response = self.codec.encode_response(command, to_wire_result(status))
+		metrics.done(decoded - start, processed - decoded, time.perf_counter() - processed, error)
+		return response
+
+	#send already framed bytes to this client. Returns False if the client is gone
+	def push(self, data):
+		raise NotImplementedError
+
+	def drop(self):
+		raise NotImplementedError
+
+	#queue framed bytes without blocking. Returns False if the client is gone
+	def queue(self, data):
+		raise NotImplementedError
+
+	#bytes queued and not sent yet, None if the client is gone
+	def backlog(self):
+		raise NotImplementedError
 
 
 ########################################################################
 # Class : ServerRequestHandler - Request Handler for TCPServer
 #         Overrides handle() to (1) process request and (2) send results
-#         back to client. Uses json serialization/deserialization for 
-#		  command and data to be transported over TCP sockets
+#         back to client. 
 #         A single instance of this class is created per client connection
+#         and runs in its own thread.
+#
+#         Rooms push events to subscribed connections from other handler
+#         threads (see push()), so all writes to the socket hold send_lock
+#
+#         Bytes queued for a spectator wait in outbox until the fan-out
+#         thread writes them without blocking (see flush()). Any other
+#         write sends the outbox first so frames are never interleaved
 #
 ########################################################################
-class ServerRequestHandler(socketserver.BaseRequestHandler):
+class ServerRequestHandler(ClientConnection, socketserver.BaseRequestHandler):
 
 
-	def handle(self):
-		#print(f"ServerRequestHandler: handle()")
+	def setup(self):
+		self.send_lock = threading.Lock()
+		self.outbox = []
+		self.queued = 0 #bytes in outbox
+		self.closed = False
+		self.accepted = self.setup_connection(self.server)
+
+	def finish(self):
+		with self.send_lock:
+			self.closed = True
+			self.outbox = []
+		self.close_connection()
 
+	def handle(self):
+		if(not self.accepted):
+			Log.warning("connection.rejected", peer=self.client_address, reason="max connections")
+			return
+		reader = Framing.FrameReader()
 		while True:
 			try:
-				client_data = self.request.recv(4096).strip()  
-				status = "ERROR"
-				if(client_data):
-					#there is data 
-					#print(f"client_data: {client_data}")
-					client_data_decoded = Util.msg_from_bytes(client_data)
-					#print(f"converted dict: {client_data_decoded}. client_data_decoded.type: {type(client_data_decoded)}")
-					if(client_data_decoded is not None):
-						status = self.server.process_server_commands(client_data_decoded['COMMAND'], client_data_decoded)
-				
-
-					#Send result of command processing
-					#response to client in format dict
-					#{COMMAND:<RESULT>}
-					#COMMAND is from Config.py and <RESULT> is an object custom to the command
-					#Client proxy Client.py should parse this correctly.
-					msg = {client_data_decoded['COMMAND']:status}
-					if(status is not None and isinstance(status, plyr.Player) and len(status.get_name()) > 0):
-						#print(f"server..check for winner result")
-						msg = {client_data_decoded['COMMAND']:status.to_string()} #get winning player details (dict of player information)
-					elif(status is not None and isinstance(status, pd.DataFrame)):
-						#print(f"****SERVER:************* got a dataframe")
-						msg = {client_data_decoded['COMMAND']:status.to_dict()}
-						#update model returns the data frame
-						#print(msg)
-					elif(status is not None and isinstance(status, ModelChangeEvent)):
-						#print(f"****SERVER:************* got a model change event")
-						#get_model returns model change event
-						msg = {client_data_decoded['COMMAND']:status.to_string()}
-					elif(status is not None and isinstance(status, str)): 
-						#check for ready return string
-						#print(f"status : {status}")
-						msg = {client_data_decoded['COMMAND']:status}
-
-
-					#result_for_client = json.dumps(msg).encode('utf-8')	
-					result_for_client = Util.msg_to_bytes(msg)
-					#print(f"Sending server results {result_for_client}")
-					self.request.sendall(result_for_client)
-					#self.request.sendto(result_for_client, ('<broadcast>', 12345))
-			except Exception as e:
-				#print(e)
-				pass
-			
+				client_data = self.request.recv(Protocol.BUFFER_SIZE)
+				if(not client_data):
+					#client closed the connection
+					break
+				reader.feed(client_data)
+				#answer every complete request in this read with a single send
+				responses = self.process_frames(reader)
+				if(responses):
+					self.write(responses)
+			except (ConnectionError, Framing.FrameError) as e:
+				Log.info("connection.closed", peer=self.client_address, error=e)
+				break
+
+	def push(self, data):
+		try:
+			self.write(data)
+			return True
+		except OSError as e:
+			Log.info("push.failed", peer=self.client_address, error=e)
+			return False
+
+	#blocking send, after whatever the outbox holds
+	def write(self, data):
+		with self.send_lock:
+			if(self.outbox):
+				self.request.sendall(b"".join(self.outbox))
+				self.outbox = []
+				self.queued = 0
+			self.request.sendall(data)
+
+	def queue(self, data):
+		with self.send_lock:
+			if(self.closed):
+				return False
+			self.outbox.append(data)
+			self.queued += len(data)
+		self.server.fanout.mark_dirty(self)
+		return True
+
+	def backlog(self):
+		return None if self.closed else self.queued
+
+	#fan-out thread : send what the socket takes without waiting. Returns
+	#True while bytes are left. A handler busy writing is retried later
+	def flush(self):
+		if(not self.send_lock.acquire(blocking=False)):
+			return True
+		try:
+			if(self.closed or not self.outbox):
+				return False
+			data = self.outbox[0] if len(self.outbox) == 1 else b"".join(self.outbox)
+			try:
+				sent = self.request.send(data, MSG_DONTWAIT)
+			except BlockingIOError:
+				sent = 0
+			except OSError:
+				self.outbox = []
+				self.queued = 0
+				return False #handle() sees the error on its next recv
+			self.outbox = [data[sent:]] if sent < len(data) else []
+			self.queued = len(data) - sent
+			return self.queued > 0
+		finally:
+			self.send_lock.release()
+
+	#wake handle() out of recv(), it then closes the connection as usual
+	def drop(self):
+		try:
+			self.request.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass #already gone
+
 
+#convert the result of a command into the json friendly value sent to the client
+def to_wire_result(status):
+	if(status is not None and isinstance(status, plyr.Player) and len(status.get_name()) > 0):
+		return status.to_string() #get winning player details (dict of player information)
+	elif(status is not None and isinstance(status, BitBoard)):
+		return status.to_list()
+	elif(status is not None and isinstance(status, ModelChangeEvent)):
+		#get_model returns model change event
+		return status.to_string()
+	return status
 
 
 ########################################################################
-# Class : Server - Subclass for TCPServer for custom handling 
-#         Overrides handle() to (1) process request and (2) send results
-#         back to client
+# Class : CommandProcessor - the game side of the server : the registry
+#         of rooms and the protocol commands. Server engines mix this in
+#         and feed it the decoded commands of their connections
 #
 ########################################################################
-class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
-
-	
-	def __init__(self):
-		super().__init__((Protocol.SERVER_IP, Protocol.SERVER_PORT), ServerRequestHandler)
-		print(f"starting tic tac toe server on : {Protocol.SERVER_IP}:{Protocol.SERVER_PORT}")
-		self.master_game_state = pd.DataFrame(([[0,0,0],[0,0,0],[0,0,0]])) # A data frame 
-		self.player_1 = None  # first player 
-		self.player_2 = None  # second player 
-		self.whose_turn = None  #which players turn is it? 
-		self.previous_turn = None #who played the previous turn? 
-		self.winner = None
-		self.this_turn = None
-		self.registered_player_count = 0 # number of registered players 
-		self.begin_game = False 
-		#initialize the model_event as a special event client 
-		#so can handle early calls to get model state before player registreation
-		#client can be smarter to avoid this special case handling
-		self.model_event = ModelChangeEvent(-1,-1,"") 
-		self.player_list = []
-
-	# start the server 
-	def start(self):
-		self.serve_forever()
-
-	#Over ride get_request so we can track the client sockets
-	#There were no examples on internet showing this for doing
-	#Broadcasts across multiple clients using TCP
-	def get_request(self):
-		pdebug("get_request")
-		try:
-			client, addr = self.socket.accept()
-			global clientCount # global reference count for clients
-			global CLIENTS     # global list of client sockets
-			clientCount += 1 
-			pdebug("clientCount " + str(clientCount))
-			if(client not in CLIENTS):
-				CLIENTS.append((client,addr))
-				print(f"Added new client from: {client}")
-		except socket.error as msg: 
-			msg = "GameServer.get_request: " + msg
-			pdebug(msg)
-
-		return(client, addr)
-
-	def broadcast(self, a_dict):
-		global clientCount
-		global CLIENTS
-		for client, address in CLIENTS: 
-			try:
-				#append the client address to the broad cast message 
-				#client can verify with it's own copy or ignore
-				a_dict['client_address'] = address
-				msg = json.dumps(a_dict).encode('utf-8')
-				client.sendall(msg)
-			except Exception as e:
-				#This client died or closed connection, remove the client socket from list
-				#and decrement reference count
-				CLIENTS.remove((client, address))
-				client.close()
-				clientCount -= 1 
-				pass
+class CommandProcessor:
+
+	#archive_path : file finished games are appended to, None for no archive
+	#nodes : "host:port" of every node when the rooms are sharded (see
+	#Shard.py), node is this one's. None for a server of its own
+	def __init__(self, archive_path=None, nodes=None, node=None):
+		#registry of all games hosted by this server keyed by room id
+		#the default room is always present so clients that never create
+		#or join a room keep the original two player behavior
+		self.rooms = {Protocol.DEFAULT_ROOM_ID : GameRoom(Protocol.DEFAULT_ROOM_ID)}
+		self.room_lock = threading.Lock() #guards room creation and removal
+		self.next_room_id = Protocol.DEFAULT_ROOM_ID + 1
+		self.node = node
+		self.ring = Shard.HashRing(nodes) if nodes else None
+		if(self.ring is not None and node not in self.ring.nodes):
+			raise ValueError(f"node {node} is not one of the shard nodes {nodes}")
+		#a sharded node other than the lobby's sends its finished games to
+		#the lobby's node, which keeps the archive and ratings of the ring
+		self.records = None
+		if(self.ring is not None and self.ring.owner(Shard.LOBBY_KEY) != node):
+			self.records = Shard.RecordSender(self.ring.owner(Shard.LOBBY_KEY))
+			archive_path = None
+		self.archive = Archive.GameArchive(archive_path) if archive_path else None
+		#ratings are not stored on their own, they are rebuilt from the archive
+		self.ratings = Rating.RatingTable()
+		if(self.archive is not None):
+			Log.info("ratings.replayed", games=self.ratings.replay(self.archive.scan()))
+		self.lobby = Lobby.Lobby(self)
+		self.metrics = Metrics.ServerMetrics()
+		self.connections = Connections.ConnectionRegistry()
+		self.limiter = RateLimit.RateLimiter()
+		self.admission = RateLimit.Admission()
+		self.fanout = Spectators.Fanout() #the asyncio engine replaces it with a Spectators.LoopFanout
+
+	#server metrics (see Metrics.py) with the room, game and lobby gauges.
+	#Rooms are read without their locks, the gauges may be a move behind
+	def get_stats(self):
+		rooms = list(self.rooms.values())
+		active = sum(1 for room in rooms if room.begin_game and room.checkForWin() is NO_WINNER)
+		gauges = self.connections.get_stats()
+		gauges.update(self.admission.get_stats())
+		gauges.update(self.fanout.get_stats())
+		if(self.records is not None):
+			gauges.update(self.records.get_stats())
+		gauges.update({'rooms' : len(rooms), 'games_active' : active, 'players' : sum(len(room.player_list) for room in rooms),
+			'spectators' : sum(len(room.audience) for room in rooms), 'lobby_waiting' : len(self.lobby.waiting)})
+		return self.metrics.snapshot(gauges)
+
+	#send a room's events to every subscribed connection. Each event is
+	#serialized once per codec in use, not once per subscriber. Spectators
+	#get them from the fan-out, see Spectators.py
+	#caller holds room.lock so events go out in the order they happened
+	def publish(self, room, events):
+		if(not events):
+			return
+		if(room.audience.spectators):
+			self.fanout.submit(room.audience, events, room.get_snapshot() if room.audience.stale else None)
+		frames = {}
+		for connection in list(room.subscribers):
+			data = frames.get(connection.codec.name)
+			if(data is None):
+				data = b"".join(Framing.encode_frame(Protocol.PUSH_REQUEST_ID, connection.codec.encode_event(e)) for e in events)
+				frames[connection.codec.name] = data
+			if(not connection.push(data)):
+				#This client died or closed connection, stop sending to it
+				room.subscribers.discard(connection)
+
+	#close the connections that sent nothing for Protocol.IDLE_TIMEOUT,
+	#engines call it every Protocol.IDLE_CHECK seconds
+	def evict_idle(self):
+		for connection in self.connections.idle():
+			Log.info("connection.evicted", conn=connection.conn_id, idle=round(time.monotonic() - connection.last_seen))
+			connection.drop()
+		self.limiter.prune()
+		#spectators that skipped the last events of a room get its snapshot
+		#once they drained, even if the room is quiet now
+		for room in list(self.rooms.values()):
+			if(room.audience.stale):
+				with room.lock:
+					self.fanout.submit(room.audience, [], room.get_snapshot())
+
+	#the node owning the room a command is addressed to when it is not this
+	#one, else None. Server wide commands stay here, the lobby and rating
+	#commands go to the lobby's node
+	def route(self, command, client_data):
+		if(self.ring is None or command in Shard.NODE_COMMANDS):
+			return None
+		if(command in Shard.LOBBY_COMMANDS or command in Shard.RATING_COMMANDS):
+			owner = self.ring.owner(Shard.LOBBY_KEY)
+		else:
+			owner = self.ring.owner(client_data.get('room_id', Protocol.DEFAULT_ROOM_ID))
+		return owner if owner != self.node else None
+
+	#charge a request to the rate limits of its connection and player, then
+	#ask admission control to let it in. Returns None when it may be
+	#processed (the caller then calls self.admission.leave()), else the
+	#busy reply, see RateLimit.py
+	def admit(self, connection, command, client_data):
+		client_id = client_data.get('client_id')
+		#only whole number ids have a player bucket, -1 is a client without an id
+		player_id = Rating.player_id(client_id)
+		wait = self.limiter.check(connection, player_id if player_id != -1 else None, command)
+		if(wait is not None):
+			Log.info("request.limited", conn=connection.conn_id, client=client_id, command=Util.command_name(command))
+			return RateLimit.busy(RateLimit.RATE, wait)
+		wait = self.admission.enter()
+		if(wait is not None):
+			Log.warning("request.shed", conn=connection.conn_id, command=Util.command_name(command))
+			return RateLimit.busy(RateLimit.OVERLOAD, wait)
+		return None
+
+	#archive and rate a finished game, or send it to the node that does.
+	#Only queued here, the archive's writer thread does the disk work
+	def record_game(self, game):
+		if(self.records is not None):
+			self.records.send(game)
+			return
+		if(self.archive is not None):
+			self.archive.append(game)
+		self.ratings.record_game(game)
+
+	#start pushing the events of a room to connection
+	def subscribe(self, room, connection):
+		room.subscribers.add(connection)
+		connection.subscriptions.add(room.get_room_id())
+		return "True"
+
+	#watch a room, caller holds room.lock so no event is missed between
+	#the snapshot and the first event
+	def spectate(self, room, connection):
+		if(not room.audience.add(connection)):
+			return "ERROR: too many spectators"
+		connection.spectating.add(room.get_room_id())
+		return room.get_snapshot()
+
+	def unspectate(self, room_id, connection):
+		connection.spectating.discard(room_id)
+		room = self.rooms.get(room_id)
+		if(room is not None):
+			room.audience.remove(connection)
+		return "True"
+
+	def unsubscribe(self, room_id, connection):
+		connection.subscriptions.discard(room_id)
+		room = self.rooms.get(room_id)
+		if(room is not None):
+			with room.lock:
+				room.subscribers.discard(connection)
+		return "True"
+
+	#create a new empty room and return its id
+	#rows, cols and k are the board and win rule of the room's games.
+	#Returns the room id, None when the server has no room left
+	def create_room(self, rows=bb.ROWS, cols=bb.COLS, k=bb.K):
+		with self.room_lock:
+			if(len(self.rooms) >= Protocol.MAX_ROOMS):
+				Log.warning("room.limit", rooms=Protocol.MAX_ROOMS)
+				return None
+			room_id = self.next_room_id
+			#sharded : skip the ids of the other nodes, so room ids are
+			#unique over all the nodes
+			while(self.ring is not None and self.ring.owner(room_id) != self.node):
+				room_id += 1
+			self.next_room_id = room_id + 1
+			self.rooms[room_id] = GameRoom(room_id, rows, cols, k)
+		Log.debug("room.created", room=room_id, rows=rows, cols=cols, k=k)
+		return room_id
+
+	#drop a room from the registry once its last player has left
+	#the default room is never removed
+	def remove_room(self, room_id):
+		if(room_id == Protocol.DEFAULT_ROOM_ID):
+			return
+		with self.room_lock:
+			room = self.rooms.get(room_id)
+			if(room is not None and room.is_empty()):
+				del self.rooms[room_id]
+				Log.debug("room.removed", room=room_id)
+
+	#O(1) lookup of the room a command is addressed to
+	#commands without a room id go to the default room
+	def get_room(self, client_data):
+		return self.rooms.get(client_data.get('room_id', Protocol.DEFAULT_ROOM_ID))
 
 	#Message processor 
 	#protocol for client server communication and command parsing 
-	def process_server_commands(self, command, client_data):
-		#print(f"Server.py: process_server_commands() ***** : {command}")
+	#room commands are handled here, every other command is applied to
+	#the room named in client_data['room_id']
+	#connection is the client connection the command came in on, it is
+	#needed by the commands that push events back to the client
+	def process_server_commands(self, command, client_data, connection=None):
+		if(command == Protocol.COMMAND_CREATE_ROOM):
+			Log.debug("command", command="CREATE_ROOM", client=client_data.get('client_id'))
+			rows = client_data.get('rows', bb.ROWS)
+			cols = client_data.get('cols', bb.COLS)
+			k = client_data.get('k', bb.K)
+			error = check_rules(rows, cols, k)
+			if(error is not None):
+				Log.info("command.rejected", command="CREATE_ROOM", error=error)
+				return error
+			return self.create_room(rows, cols, k)
+
+		#heartbeat, any frame keeps a connection from being evicted as idle
+		if(command == Protocol.COMMAND_PING):
+			return "PONG"
+
+		#directory : any node knows which one owns a room
+		if(command == Protocol.COMMAND_LOCATE_ROOM):
+			return self.ring.owner(client_data.get('room_id')) if self.ring is not None else None
+
+		#a game finished on another node of the ring, see Shard.RecordSender
+		if(command == Protocol.COMMAND_RECORD_GAME):
+			#a record that does not encode is refused before it is queued
+			self.record_game(Archive.decode_game(Archive.encode_game(client_data['game'])))
+			return "True"
+
+		#ratings are server wide, not room commands
+		if(command == Protocol.COMMAND_GET_LEADERBOARD):
+			return self.ratings.get_leaderboard(client_data.get('count', 10), client_data.get('start', 0))
+
+		if(command == Protocol.COMMAND_GET_RANK):
+			value = client_data.get('player_id', client_data.get('client_id'))
+			player_id = Rating.player_id(value)
+			if(player_id is None):
+				return f"ERROR: player ids are whole numbers, got {value!r}"
+			return self.ratings.get_rank(player_id)
+
+		#matchmaking, the lobby creates the rooms (see Lobby.py)
+		if(command == Protocol.COMMAND_ENTER_LOBBY):
+			rules = (client_data.get('rows', bb.ROWS), client_data.get('cols', bb.COLS), client_data.get('k', bb.K))
+			error = check_rules(*rules)
+			if(error is not None):
+				return error
+			client_id = Rating.player_id(client_data['client_id'])
+			if(client_id is None):
+				return f"ERROR: player ids are whole numbers, got {client_data['client_id']!r}"
+			return self.lobby.enter(client_id, client_data.get('player_name', ""), self.ratings.get_rating(client_id), rules, connection)
+
+		if(command == Protocol.COMMAND_LEAVE_LOBBY):
+			return self.lobby.leave(Rating.player_id(client_data['client_id']))
+
+		if(command == Protocol.COMMAND_LOBBY_STATUS):
+			return self.lobby.status(Rating.player_id(client_data['client_id']))
+
+		if(command == Protocol.COMMAND_LOBBY_STATS):
+			return self.lobby.get_stats()
+
+		if(command == Protocol.COMMAND_STATS):
+			return self.get_stats()
+
+		room = self.get_room(client_data)
+		if(room is None):
+			msg = "ERROR: no such room " + str(client_data.get('room_id'))
+			Log.info("command.rejected", command=Util.command_name(command), error=msg)
+			return msg
+
+		if(command == Protocol.COMMAND_UNSUBSCRIBE):
+			return self.unsubscribe(room.get_room_id(), connection)
+
+		if(command == Protocol.COMMAND_UNSPECTATE):
+			return self.unspectate(room.get_room_id(), connection)
+
+		with room.lock:
+			status = self.process_room_commands(room, command, client_data, connection)
+			self.flush_room(room)
+
+		if(command in (Protocol.COMMAND_LEAVE_ROOM, Protocol.COMMAND_UN_REGISTER_USER)):
+			self.remove_room(room.get_room_id())
+		return status
+
+	#send the events a room raised and record the games that ended in it.
+	#Caller holds room.lock
+	def flush_room(self, room):
+		self.publish(room, room.take_events())
+		for game in room.take_finished():
+			self.record_game(game)
+
+	#the bot answers the move just played, see GameRoom.play_bot(). Caller
+	#holds room.lock
+	def play_bot(self, room):
+		room.play_bot()
+
+	#process a single command against one room. Caller holds room.lock
+	def process_room_commands(self, room, command, client_data, connection=None):
 		msg = "Server Process Request"
-		mark = ""	#Assign a marker for each player
-		if(command == Protocol.COMMAND_REGISTER_USER):
-			print("server: command recieved REGISTER USER")
-			#First ever registration this session
-			if(len(self.player_list) == 0):
-				print(f"Registering as player 1 by default {client_data['client_id']}")
-				self.player_1 = plyr.Player(client_data['player_name'],"X",client_data['client_id'],True)
-				self.player_1.register_player()
-				#self.registered_player_count += 1 
-				self.player_list.append(self.player_1)
-				mark = self.player_1.get_mark()
-				print(f"server.register_player(): {self.player_1.to_string()}")
-			elif(len(self.player_list) == 1):
-				#check if player is already registered
-				p = self.player_list[0]
-				if (p.get_id() == client_data['client_id']):
-					print(f"Player : {p.get_name()} already registered with client id: {p.get_id()}")
-				else: 
-					print(f"Register SECOND Player: Registering {client_data['client_id']}")
-					self.player_2 = plyr.Player(client_data['player_name'],"O",client_data['client_id'],True)
-					self.player_2.register_player()
-					mark = self.player_2.get_mark()
-					self.player_list.append(self.player_2)				
-			else:
-				print("REGISTER_USER: user already registerd or game in progress")
-			#print(f"server.py register_player(): {self.player_list}")
+		if(Log.enabled(Log.DEBUG)):
+			Log.debug("command", command=Util.command_name(command), room=room.get_room_id(), client=client_data.get('client_id'))
+		if(command == Protocol.COMMAND_SUBSCRIBE and connection is not None):
+			return self.subscribe(room, connection)
+
+		if(command == Protocol.COMMAND_SPECTATE and connection is not None):
+			return self.spectate(room, connection)
+
+		if(command in (Protocol.COMMAND_REGISTER_USER, Protocol.COMMAND_JOIN_ROOM)):
+			mark = room.register_player(client_data)
+			#{'opponent' : Protocol.OPPONENT_BOT} : play against the server's bot
+			if(client_data.get('opponent') == Protocol.OPPONENT_BOT and mark != ""):
+				room.add_bot()
 			return mark
 		
 		#As UX develops, should be tested. Implemented but not used by client
-		if(command == Protocol.COMMAND_UN_REGISTER_USER):
-			print("server: command recieved UN REGISTER USER")
-			for p in player_list: 
-				if (p.get_id() == client_data['client_id']):
-					printf(f"Found a player : {p.get_name()} Unregistering client: {p.get_id()}")
-					player_list.remove(p)
-					self.registered_player_count -= 1 #decrement registered user count by 1
+		if(command in (Protocol.COMMAND_UN_REGISTER_USER, Protocol.COMMAND_LEAVE_ROOM)):
+			room.un_register_player(client_data)
 
-			print(f"server.un_register_player(): client_id: {client_data['client_id']}")
-
-		
 		if(command == Protocol.COMMAND_UPDATE_MODEL):
-			print("server: command recieved  COMMAND_UPDATE_MODEL")
-		
-			if(len(self.player_list) < 2):
-				msg = "Not enough players " + str(self.registered_player_count) + " waiting for others to join"
-				print(msg)
+			if(len(room.player_list) < 2):
+				msg = "Not enough players " + str(room.registered_player_count) + " waiting for others to join"
+				if(Log.enabled(Log.DEBUG)):
+					Log.debug("move.rejected", room=room.get_room_id(), reason=msg)
 				return msg	
 
-			if(self.begin_game):
-				self.update_data_model(client_data)
+			if(room.begin_game):
+				room.update_data_model(client_data)
+				self.play_bot(room)
 			else:				
-				print(f"server.update_model(): not enough players {self.registered_player_count} wait for others to join")
+				if(Log.enabled(Log.DEBUG)):
+					Log.debug("move.rejected", room=room.get_room_id(), reason="game not started", players=room.registered_player_count)
 
 
 		if(command == Protocol.COMMAND_GET_MODEL):	
-			print("server: command recieved COMMAND_GET_MODEL")
-			return self.get_model()
+			return room.get_model()
 
 		#check if any player has won the game
 		#if so return the player name 
 		#else return the "No Winner"
 		if(command == Protocol.COMMAND_CHECK_FOR_WIN):	
-			print("server: command recieved COMMAND_CHECK_FOR_WIN")
-			if(self.begin_game):
-				self.winner =  self.checkForWin()
+			if(room.begin_game):
+				room.winner =  room.checkForWin()
 			else:
-				self.winner = plyr.Player("No Winner", "--", "000", False)
-			return self.winner
+				room.winner = NO_WINNER
+			return room.winner
 
 		if(command == Protocol.COMMAND_RESET):
-			print("server: command recieved COMMAND_RESET ")
-			self.reset()
+			room.reset()
 
 		if(command == Protocol.COMMAND_NEXT_TURN):
-			print("server: command recieved to NEXT_TURN game")
-			if(self.begin_game):
-				return self.next_turn(client_data)		
+			if(room.begin_game):
+				return room.next_turn(client_data)		
 
 		if(command == Protocol.COMMAND_CHECK_FOR_READY):
-			return self.check_for_ready()
-
-
-	
-	# server call to check if game is ready to begin 
-	# precondition is two players have to register 
-	def check_for_ready(self):
-		##if we have 2 registerd players, the clients can begin the game
-		print(f"server.py: check for ready: self.begin_game : {self.begin_game}")
-		if (len(self.player_list) == 2):		
-			self.begin_game = True
-		return str(self.begin_game)
-
-
-	def next_turn(self, command_details):
-		id = 0000
-		if command_details is not None:
-			self.this_turn = command_details['client_id']
-			id = self.this_turn
-			#print(f"server.next_turn: Player Turn: {self.this_turn}")
-		return id
-
-    # Return row, col and mark in a model change event
-	def get_model(self):
-		return self.model_event
-
-
-	#Reset the play state 
-	def reset(self):
-		self.master_game_state = pd.DataFrame(([[0,0,0],[0,0,0],[0,0,0]])) # A data frame 
-		self.player_1 = None  # first player 
-		self.player_2 = None  # second player 
-		self.whose_turn = None  #which players turn is it? 
-		self.previous_turn = None #who played the previous turn? 
-		self.winner = None
-		self.this_turn = None
-		self.registered_player_count = 0 # number of registered players 
-		self.begin_game = False 
-		#initialize the model_event as a special event client 
-		#so can handle early calls to get model state before player registreation
-		#client can be smarter to avoid this special case handling
-		self.model_event = ModelChangeEvent(-1,-1,"") 
-		self.player_list = []
-
-	#update server side data model - single version of truth
-	def update_data_model(self, new_data):
-		#print("update_data_model")
-		
-		if(self.begin_game == False):
-			return 
-
-		if not type(new_data) == dict:
-			print(f"Server.py update_data_model(): data model format error. dict expected, received: {type(new_data)}")
-			return 
-		
-		#print(f"update_data_model {self.whose_turn}")
-		#TODO: Prevent same player from playing back to back
-		if  new_data['client_id'] == self.player_1.get_id():
-			self.whose_turn = self.player_1
-		else:
-			self.whose_turn = self.player_2
+			return room.check_for_ready()
 
+		#the moves a client missed, see GameRoom.get_moves_since()
+		if(command == Protocol.COMMAND_GET_MOVES_SINCE):
+			return room.get_moves_since(client_data.get('seq', 0))
 
-		if((self.previous_turn is not None) and (self.previous_turn.get_id() == self.whose_turn.get_id())):
-			#same player is trying to play again, ignore it. 
-			print(f"player {self.previous_turn.get_name()} with id {self.previous_turn.get_id()} is attempting to paly out of turn")
-			return 
+		#one round trip for readiness, winner and last move
+		if(command == Protocol.COMMAND_GET_STATE):
+			return room.get_state(client_data.get('version'))
 
-		print(f"current turn for player: {self.whose_turn.get_name()} and client_id: {self.whose_turn.get_id()} and player mark : {self.whose_turn.get_mark()}")
+		if(command == Protocol.COMMAND_GET_RULES):
+			return room.get_rules()
 
-		#update the data frame 
-		self.master_game_state.iloc[new_data['row'], new_data['column']] = self.whose_turn.get_mark()
 
-		#create a model event based on changes 
-		self.model_event = ModelChangeEvent(new_data['row'], new_data['column'], self.whose_turn.get_mark())
+#return an error message for a board a room can't be created with, else None
+def check_rules(rows, cols, k):
+	for value in (rows, cols, k):
+		if(not isinstance(value, int) or isinstance(value, bool)):
+			return f"ERROR: board size must be whole numbers, got {rows}x{cols} k={k}"
+	if(not (1 <= rows <= Protocol.MAX_BOARD_SIDE and 1 <= cols <= Protocol.MAX_BOARD_SIDE)):
+		return f"ERROR: board must be 1 to {Protocol.MAX_BOARD_SIDE} cells a side, got {rows}x{cols}"
+	if(not (1 <= k <= max(rows, cols))):
+		return f"ERROR: k={k} does not fit on a {rows}x{cols} board"
+	return None
 
-		self.previous_turn = self.whose_turn
-		#print(f"update_data_model: model updated: {self.master_game_state}")
-		print(f"update_data_model: model event: {self.model_event.to_string()}")
 
+########################################################################
+# Class : Server - Subclass for TCPServer for custom handling 
+#         One thread per client connection (ServerRequestHandler)
+#         See AsyncServer.py for the asyncio engine
+#
+########################################################################
+class Server(socketserver.ThreadingMixIn, socketserver.TCPServer, CommandProcessor):
 
-	# Check if we have Tic Tac Toe
-	# Return the winning player
-	# TODO: This is unnecessarily complex. Simplify using matrix checks
-	def checkForWin(self):
-		
-		#print(f"sever.py - checkForWin...master_game_state: {self.master_game_state}")
-
-		if self.player_1 is not None:
-			P1 = self.player_1.get_mark()
-
-		if self.player_2 is not None:
-			P2 = self.player_2.get_mark()
-
-		for x in range(3):
-			for y in range(1):
-				#print(f"Loop1: x: {x}, y: {y}")
-				if ( (self.master_game_state.iloc[x,y] == P1) & (self.master_game_state.iloc[x,y+1] == P1) & (self.master_game_state.iloc[x,y+2] == P1)):
-					print(f"server.py - checkForWin: Winner is {self.player_1.get_name()}")
-					return self.player_1
-				if ( (self.master_game_state.iloc[x,y] == P2) & (self.master_game_state.iloc[x,y+1] == P2) & (self.master_game_state.iloc[x,y+2] == P2)):
-					print(f"server.py - checkForWin: Winner is {self.player_2.get_name()}")
-					return self.player_2
-
-		#Columns
-		for y in range(3):
-			for x in range(1):
-				#print(f"Loop2: x: {x}, y: {y}")
-				if ( (self.master_game_state.iloc[x,y] == P1) & (self.master_game_state.iloc[x+1,y] == P1) & (self.master_game_state.iloc[x+2,y] == P1)):
-					print(f"server.py - checkForWin: Winner is {self.player_1.get_name()}")
-					return self.player_1
-				if ( (self.master_game_state.iloc[x,y] == P2) & (self.master_game_state.iloc[x+1,y] == P2) & (self.master_game_state.iloc[x+2,y] == P2)):
-					print(f"server.py - checkForWin: Winner is {self.player_2.get_name()}")
-					return self.player_2
-
-		x = 0	
-		y = 0
-		#print(f"Checking Diagonals: x: {x}, y: {y}")
-		if ( (self.master_game_state.iloc[x,y] == P1) & (self.master_game_state.iloc[x+1,y+1] == P1) & (self.master_game_state.iloc[x+2,y+2] == P1)):
-
-			print(f"server.py - checkForWin: Winner is {self.player_1.get_name()}")
-			return self.player_1
-		if ( (self.master_game_state.iloc[x,y+2] == P1) & (self.master_game_state.iloc[x+1,y+1] == P1) & (self.master_game_state.iloc[x+2,y] == P1)):
-
-			print(f"server.py - checkForWin: Winner is {self.player_1.get_name()}")
-			return self.player_1
-
-		if ( (self.master_game_state.iloc[x,y] == P2) & (self.master_game_state.iloc[x+1,y+1] == P2) & (self.master_game_state.iloc[x+2,y+2] == P2)):
-		
-			print(f"server.py - checkForWin: Winner is {self.player_2.get_name()}")
-			return self.player_2
-		if ( (self.master_game_state.iloc[x,y+2] == P2) & (self.master_game_state.iloc[x+1,y+1] == P2) & (self.master_game_state.iloc[x+2,y] == P2)):
+	daemon_threads = True #don't keep the process alive for idle clients
+	allow_reuse_address = True #restart on the same port while old connections sit in TIME_WAIT
+	
+	def __init__(self, host=None, port=None, archive_path=None, nodes=None):
+		host = host or Protocol.SERVER_IP
+		port = Protocol.SERVER_PORT if port is None else port
+		socketserver.TCPServer.__init__(self, (host, port), ServerRequestHandler)
+		CommandProcessor.__init__(self, archive_path, nodes, Shard.node_name(host, port))
+		threading.Thread(target=self.reap_idle, daemon=True).start()
+		Log.info("server.started", engine="threaded", host=host, port=self.server_address[1])
 
-			print(f"server.py - checkForWin: Winner is {self.player_2.get_name()}")
-			return self.player_2	
+	# start the server 
+	def start(self):
+		self.serve_forever()
 
-		print(f"server.py - checkForWin: No one Yet")	
-		p = (plyr.Player("No Winner", "--", "000", False))
-		print(f"server.py checkForWin() : {p.to_string()}")
-		return p
+	#reaper thread : evict idle connections, see CommandProcessor.evict_idle()
+	def reap_idle(self):
+		while True:
+			time.sleep(Protocol.IDLE_CHECK)
+			self.evict_idle()
 
 
 if __name__ == "__main__":
 
+	parser = argparse.ArgumentParser(description="Tic Tac Toe server")
+	parser.add_argument("--mode", choices=["threaded", "async"], default=Protocol.SERVER_MODE, help="server engine")
+	parser.add_argument("--host", default=Protocol.SERVER_IP)
+	parser.add_argument("--port", type=int, default=Protocol.SERVER_PORT)
+	parser.add_argument("--archive", default=Protocol.ARCHIVE_PATH, help="file finished games are appended to, \"\" for none")
+	parser.add_argument("--metrics-port", type=int, default=Protocol.METRICS_PORT, help="port of the local http metrics endpoint, 0 for none")
+	parser.add_argument("--log-level", choices=list(Log.LEVELS), default=Protocol.LOG_LEVEL)
+	parser.add_argument("--log-format", choices=["text", "json"], default="text")
+	parser.add_argument("--nodes", default=",".join(Protocol.SHARD_NODES), help="host:port of every node sharing the rooms, comma separated, see Shard.py")
+	parser.add_argument("--workers", type=int, default=Protocol.PREFORK_WORKERS, help="worker processes sharing the port, see Prefork.py")
+	parser.add_argument("--worker-port", type=int, default=None,
+		help="private port of the first worker, the others follow (default : after the port and the metrics ports)")
+	args = parser.parse_args()
+	Log.configure(level=args.log_level, format=args.log_format)
+	nodes = [node for node in args.nodes.split(",") if node] or None
+	if(nodes is not None and Shard.node_name(args.host, args.port) not in nodes):
+		parser.error(f"--nodes must include this node {Shard.node_name(args.host, args.port)}")
+
+	if(args.workers > 1):
+		#one process per core, the workers shard the rooms, see Prefork.py
+		if(nodes is not None):
+			parser.error("--workers and --nodes can't be combined")
+		if(not hasattr(os, "fork")):
+			parser.error("--workers needs fork()")
+		import Prefork
+		#port ranges : the server's, the workers' and their metrics endpoints
+		metrics = range(args.metrics_port, args.metrics_port + args.workers) if args.metrics_port else range(0)
+		if(not args.worker_port):
+			args.worker_port = max([args.port] + list(metrics)) + 1
+		ranges = [("--port", range(args.port, args.port + 1)), ("--worker-port", range(args.worker_port, args.worker_port + args.workers)),
+			("--metrics-port", metrics)]
+		for i, (name, ports) in enumerate(ranges):
+			if(ports and ports.stop > 65536):
+				parser.error(f"{name} ports {ports.start}-{ports.stop - 1} go past 65535")
+			for other_name, other in ranges[i + 1:]:
+				if(set(ports) & set(other)):
+					parser.error(f"{name} ports {ports.start}-{ports.stop - 1} overlap {other_name} ports {other.start}-{other.stop - 1}")
+		sys.exit(0 if Prefork.Prefork(args).run() else 1)
+
+	if(args.mode == "async"):
+		#one event loop serves every client, see AsyncServer.py
+		import AsyncServer
+		server = AsyncServer.AsyncServer(args.host, args.port, args.archive, nodes)
+		if(args.metrics_port):
+			Metrics.start_http(server, args.metrics_port)
+		server.start()
+		sys.exit(0)
+
 	#create a threaded TCP server with a request handler which is instantiated for each client
-	server = Server()
+	server = Server(args.host, args.port, args.archive, nodes)
+	if(args.metrics_port):
+		Metrics.start_http(server, args.metrics_port)
 	ip, port = server.server_address
 
 	# Start a thread with the server -- that thread will then start one
     # more thread for each request
 	server_thread = threading.Thread(target=server.serve_forever)
     # Exit the server thread when the main thread terminates
-	server_thread.setDaemon(True)
+	server_thread.daemon = True
 	server_thread.start()
-	print("Server main loop running in thread:", server_thread.getName())
+	Log.info("server.thread", name=server_thread.name)
 
-	#Server simply broadcasts the shared buffer to all clients. 
-	#TODO: Brodcast only when there is something new
+	#Game events are pushed to subscribed clients as they happen (see publish())
 	while True:
-		print(f"Clients:\n {CLIENTS}\n******")
-		#BUG : There is a bug that when broadcasting the socket 
-		# resets. This works in prototype at https://github.com/nkamkolkar/multithreaded-client-server
-		# Needs investigations as to why this is breaking
-		#server.broadcast(shared_message)
+		Log.debug("server.connections", **server.connections.get_stats())
 		time.sleep(5)
 
 	server.shutdown()
-
-
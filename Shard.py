@@ -0,0 +1,181 @@
+"""
+Shard.py : games spread over several server nodes by consistent hashing.
+
+Every node of a sharded deployment is started with the same node list,
+eg: two local nodes
+	python Server.py --port 12345 --nodes 127.0.0.1:12345,127.0.0.1:12346
+	python Server.py --port 12346 --nodes 127.0.0.1:12345,127.0.0.1:12346
+A room belongs to the node its id hashes to on a ring of
+Protocol.SHARD_VNODES points per node, so adding a node moves about
+1/(nodes + 1) of the room ids to it and leaves the others where they were.
+A node only hands out room ids it owns (see CommandProcessor.create_room()).
+
+A room command sent to a node that does not own the room is answered
+{Protocol.REDIRECT : {'node' : "host:port", 'room_id' : id}} instead of
+{command : result}. GameNetworkClient moves to that node and sends it
+again. Any node answers COMMAND_LOCATE_ROOM, so clients may start on any
+node. The default room belongs to the node its id hashes to, like any room.
+
+The lobby commands are redirected to the one node holding the lobby (see
+LOBBY_KEY), a matched pair plays on that node. That node also keeps the
+archive and the ratings of the whole ring, which the lobby reads : the
+rating commands are redirected to it and the other nodes send it their
+finished games (COMMAND_RECORD_GAME, see RecordSender). The metrics are
+per node.
+"""
+
+import bisect
+import hashlib
+import queue
+import socket
+import threading
+import time
+import Codec
+import Framing
+import Log
+from Config import Protocol
+
+#commands every node answers itself, whatever room they name
+NODE_COMMANDS = frozenset((Protocol.COMMAND_CREATE_ROOM, Protocol.COMMAND_SET_CODEC, Protocol.COMMAND_PING,
+	Protocol.COMMAND_STATS, Protocol.COMMAND_LOCATE_ROOM))
+
+#the lobby is on the node owning LOBBY_KEY, so every player waits in the
+#same one. The rooms it creates for its matches are on that node too
+LOBBY_COMMANDS = frozenset((Protocol.COMMAND_ENTER_LOBBY, Protocol.COMMAND_LEAVE_LOBBY,
+	Protocol.COMMAND_LOBBY_STATUS, Protocol.COMMAND_LOBBY_STATS))
+LOBBY_KEY = "lobby"
+
+#answered by the node owning LOBBY_KEY, the only one with ratings
+RATING_COMMANDS = frozenset((Protocol.COMMAND_GET_LEADERBOARD, Protocol.COMMAND_GET_RANK, Protocol.COMMAND_RECORD_GAME))
+
+
+#64 bit position on the ring, the same in every process (unlike hash())
+def ring_hash(key):
+	return int.from_bytes(hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest(), 'big')
+
+def node_name(host, port):
+	return f"{host}:{port}"
+
+#"host:port" -> (host, port)
+def parse_node(name):
+	host, _, port = name.rpartition(":")
+	return host, int(port)
+
+
+########################################################################
+# Class : HashRing - consistent hashing of room ids onto node names
+########################################################################
+class HashRing:
+
+	def __init__(self, nodes=(), vnodes=Protocol.SHARD_VNODES):
+		self.vnodes = vnodes
+		self.nodes = []
+		self.points = [] #sorted ring positions
+		self.owners = [] #node of the point at the same index
+		for node in nodes:
+			self.add(node)
+
+	def add(self, node):
+		if(node in self.nodes):
+			return
+		self.nodes.append(node)
+		for i in range(self.vnodes):
+			point = ring_hash(f"{node}#{i}")
+			index = bisect.bisect(self.points, point)
+			self.points.insert(index, point)
+			self.owners.insert(index, node)
+
+	def remove(self, node):
+		if(node not in self.nodes):
+			return
+		self.nodes.remove(node)
+		kept = [(p, n) for p, n in zip(self.points, self.owners) if n != node]
+		self.points = [p for p, n in kept]
+		self.owners = [n for p, n in kept]
+
+	#node owning key : the first point at or after its hash, wrapping around
+	def owner(self, key):
+		if(not self.points):
+			return None
+		index = bisect.bisect_left(self.points, ring_hash(key))
+		return self.owners[index % len(self.owners)]
+
+	def __len__(self):
+		return len(self.nodes)
+
+
+#the reply to a room command sent to the wrong node
+def redirect(node, room_id):
+	return {'node' : node, 'room_id' : room_id}
+
+
+########################################################################
+# Class : RecordSender - sends the games finished on this node to the
+#         node keeping the archive and the ratings, from one thread over
+#         one connection. send() never blocks, the games wait in a queue
+#         of Protocol.RECORD_QUEUE_SIZE while that node is unreachable
+########################################################################
+class RecordSender:
+
+	def __init__(self, node):
+		self.node = node
+		self.games = queue.Queue(maxsize=Protocol.RECORD_QUEUE_SIZE)
+		self.codec = Codec.get_codec(Codec.JSON)
+		self.sock = None
+		self.reader = None
+		self.request_id = 0
+		self.sent = 0
+		self.dropped = 0
+		threading.Thread(target=self.run, daemon=True).start()
+
+	#queue a finished game, an archive record (see Archive.encode_game)
+	def send(self, game):
+		try:
+			self.games.put_nowait(game)
+		except queue.Full:
+			self.dropped += 1
+			Log.warning("records.dropped", node=self.node, queued=self.games.qsize())
+
+	def run(self):
+		while True:
+			game = self.games.get()
+			wait = self.deliver(game)
+			while wait is not None:
+				time.sleep(wait)
+				wait = self.deliver(game)
+
+	#None once the game is taken or refused for good, else the seconds to
+	#wait before sending it again
+	def deliver(self, game):
+		fresh = self.sock is None
+		try:
+			if(fresh):
+				self.sock = socket.create_connection(parse_node(self.node), timeout=Protocol.CALL_TIMEOUT)
+				self.reader = Framing.FrameReader()
+			self.request_id = self.request_id % 0xFFFFFFFF + 1
+			request = self.codec.encode_request({'COMMAND' : Protocol.COMMAND_RECORD_GAME, 'game' : game})
+			self.sock.sendall(Framing.encode_frame(self.request_id, request))
+			frame = self.reader.read_frame(self.sock)
+			if(frame is None):
+				raise ConnectionError("connection closed")
+			reply = self.codec.decode_response(frame[1])
+		except (OSError, ValueError, Framing.FrameError) as e:
+			if(self.sock is not None):
+				self.sock.close()
+			self.sock = None
+			if(not fresh):
+				#the node closed an idle connection, try a new one at once
+				return 0.0
+			Log.warning("records.send_failed", node=self.node, error=e)
+			return Protocol.RECORD_RETRY
+		if(Protocol.BUSY in reply):
+			return reply[Protocol.BUSY].get('retry_after', Protocol.RECORD_RETRY)
+		result = reply.get(str(Protocol.COMMAND_RECORD_GAME), reply)
+		if(result != "True"):
+			Log.error("records.refused", node=self.node, reply=result)
+		else:
+			self.sent += 1
+		return None
+
+	def get_stats(self):
+		return {'records_queued' : self.games.qsize(), 'records_sent' : self.sent, 'records_dropped' : self.dropped}
@@ -0,0 +1,287 @@
+"""
+Spectators.py : spectators of a room and the fan-out of its events.
+
+A spectator watches a room (COMMAND_SPECTATE) : it gets the room's events
+pushed like a subscriber, but through the server's fan-out instead of the
+command that raised them. The command only hands the events to the fan-out
+(see Fanout.submit()), so players never wait on their spectators. The
+fan-out serializes every event once per codec and queues the same bytes
+on all the spectators of the room without blocking.
+
+Events wait up to Protocol.FANOUT_DELAY seconds for the next events of
+their room, so a busy room costs a spectator one write per delay, not one
+per move.
+
+A spectator whose connection has more than Protocol.SPECTATOR_MAX_BACKLOG
+bytes queued skips the events instead of queueing more. Once it drained
+it is sent an EVENT_SNAPSHOT of the whole room (fast-forward) and then the
+events again. A spectator still behind after Protocol.SPECTATOR_LAG_TIMEOUT
+seconds is dropped.
+
+Connections queue bytes with queue(data) (False when the connection is
+gone) and report the bytes not yet sent with backlog() (None when gone).
+"""
+
+import collections
+import queue
+import threading
+import time
+import Framing
+import Log
+from Config import Protocol
+
+
+########################################################################
+# Class : Spectator - fan-out state of one spectator of one room
+########################################################################
+class Spectator:
+
+	__slots__ = ("connection", "stale", "since")
+
+	def __init__(self, connection):
+		self.connection = connection
+		self.stale = False #skipped events, gets a snapshot next
+		self.since = 0.0   #when it started skipping
+
+
+########################################################################
+# Class : Audience - the spectators of one room. Spectators are added and
+#         removed by the command threads, deliver() runs on the fan-out
+########################################################################
+class Audience:
+
+	def __init__(self, room_id):
+		self.room_id = room_id
+		self.lock = threading.Lock()
+		self.spectators = {} #connection -> Spectator
+		self.stale = 0       #spectators waiting for a snapshot
+
+	def __len__(self):
+		return len(self.spectators)
+
+	#returns False when the room has Protocol.MAX_SPECTATORS already
+	def add(self, connection):
+		with self.lock:
+			if(connection not in self.spectators and len(self.spectators) >= Protocol.MAX_SPECTATORS):
+				return False
+			self.spectators.setdefault(connection, Spectator(connection))
+			return True
+
+	def remove(self, connection):
+		with self.lock:
+			spectator = self.spectators.pop(connection, None)
+			if(spectator is not None and spectator.stale):
+				self.stale -= 1
+
+	def set_stale(self, spectator, stale):
+		with self.lock:
+			if(spectator.stale != stale and spectator.connection in self.spectators):
+				spectator.stale = stale
+				self.stale += 1 if stale else -1
+
+	#queue a delivery's events (or its snapshot) on spectators, a list of
+	#this room's Spectator, runs on the fan-out. Every event is encoded
+	#once per codec, all the spectators using that codec get the same bytes
+	def deliver(self, delivery, spectators, fanout):
+		now = time.monotonic()
+		for spectator in spectators:
+			connection = spectator.connection
+			backlog = connection.backlog()
+			if(backlog is None):
+				self.remove(connection)
+				continue
+			if(backlog > Protocol.SPECTATOR_MAX_BACKLOG):
+				if(not spectator.stale):
+					spectator.since = now
+					self.set_stale(spectator, True)
+				elif(now - spectator.since > Protocol.SPECTATOR_LAG_TIMEOUT):
+					Log.info("spectator.dropped", room=self.room_id, conn=connection.conn_id, backlog=backlog)
+					self.remove(connection)
+					fanout.dropped += 1
+					connection.drop()
+				continue
+			if(spectator.stale):
+				if(delivery.snapshot is None):
+					continue #the next event or the catch up of evict_idle() brings one
+				data = delivery.encode(connection.codec, True)
+				self.set_stale(spectator, False)
+				fanout.fast_forwards += 1
+			elif(delivery.events):
+				data = delivery.encode(connection.codec, False)
+			else:
+				continue
+			if(not connection.queue(data)):
+				self.remove(connection)
+
+
+########################################################################
+# Class : Delivery - events of one room on their way to its spectators
+########################################################################
+class Delivery:
+
+	__slots__ = ("audience", "events", "snapshot", "spectators", "next", "frames")
+
+	def __init__(self, audience, events, snapshot):
+		self.audience = audience
+		self.events = events
+		self.snapshot = snapshot #room snapshot taken with the last event, or None
+		self.spectators = None   #taken when the delivery starts
+		self.next = 0            #first spectator not served yet
+		self.frames = {}         #(codec name, snapshot?) -> bytes
+
+	#append a later delivery of the same room. Its snapshot is the only
+	#one still in step with the events
+	def merge(self, later):
+		self.events = self.events + later.events
+		self.snapshot = later.snapshot
+
+	def encode(self, codec, snapshot):
+		key = (codec.name, snapshot)
+		data = self.frames.get(key)
+		if(data is None):
+			if(snapshot):
+				messages = [{'EVENT' : Protocol.EVENT_SNAPSHOT, 'room_id' : self.audience.room_id, 'data' : self.snapshot}]
+			else:
+				messages = self.events
+			data = b"".join(Framing.encode_frame(Protocol.PUSH_REQUEST_ID, codec.encode_event(m)) for m in messages)
+			self.frames[key] = data
+		return data
+
+	def start(self):
+		with self.audience.lock:
+			self.spectators = list(self.audience.spectators.values())
+
+
+#merge the deliveries of the same room, the first one of a room keeps its
+#place. A spectator then gets one write for all the events of a batch
+def coalesce(deliveries):
+	rooms = {}
+	merged = []
+	for delivery in deliveries:
+		first = rooms.get(delivery.audience)
+		if(first is None):
+			rooms[delivery.audience] = delivery
+			merged.append(delivery)
+		else:
+			first.merge(delivery)
+	return merged
+
+
+########################################################################
+# Class : Fanout - delivers the spectators' events from one thread, in
+#         the order the rooms submitted them. Threaded connections only
+#         append to an outbox in queue(), this thread also writes the
+#         outboxes without blocking (see flush()), retrying the
+#         connections that could not take everything every
+#         Protocol.SPECTATOR_WRITE_WAIT seconds
+########################################################################
+class Fanout:
+
+	def __init__(self):
+		self.items = queue.Queue()
+		self.dirty = set() #connections with queued bytes, see ServerRequestHandler.queue()
+		self.dirty_lock = threading.Lock()
+		self.thread = None
+		self.thread_lock = threading.Lock()
+		self.fast_forwards = 0
+		self.dropped = 0
+
+	#hand a room's events to the fan-out. Caller holds the room lock, so
+	#the events of a room are submitted in order
+	def submit(self, audience, events, snapshot=None):
+		if(self.thread is None):
+			self.start()
+		self.items.put(Delivery(audience, events, snapshot))
+
+	def start(self):
+		with self.thread_lock:
+			if(self.thread is None):
+				self.thread = threading.Thread(target=self.run, daemon=True)
+				self.thread.start()
+
+	def mark_dirty(self, connection):
+		with self.dirty_lock:
+			self.dirty.add(connection)
+
+	def run(self):
+		pending = set() #connections whose socket did not take all their bytes
+		while True:
+			deliveries = []
+			try:
+				deliveries.append(self.items.get(timeout=Protocol.SPECTATOR_WRITE_WAIT if pending else None))
+				time.sleep(Protocol.FANOUT_DELAY) #let the rooms add to the batch
+				while True:
+					deliveries.append(self.items.get_nowait())
+			except queue.Empty:
+				pass
+			for delivery in coalesce(deliveries):
+				try:
+					delivery.start()
+					delivery.audience.deliver(delivery, delivery.spectators, self)
+				except Exception as e:
+					Log.error("fanout.failed", room=delivery.audience.room_id, error=repr(e))
+			with self.dirty_lock:
+				dirty, self.dirty = self.dirty, set()
+			for connection in dirty | pending:
+				if(connection.flush()):
+					pending.add(connection)
+				else:
+					pending.discard(connection)
+
+	def get_stats(self):
+		return {'spectator_fast_forwards' : self.fast_forwards, 'spectators_dropped' : self.dropped,
+			'fanout_queue' : self.items.qsize()}
+
+
+########################################################################
+# Class : LoopFanout - Fanout of the asyncio engine. Connections write
+#         to their transport, which never blocks, so deliveries run on the
+#         event loop. They are cut in slices of Protocol.FANOUT_SLICE
+#         spectators so the players' commands are served in between
+########################################################################
+class LoopFanout(Fanout):
+
+	def __init__(self, loop):
+		Fanout.__init__(self)
+		self.loop = loop
+		self.deliveries = collections.deque()
+		self.waiting = {} #audience -> its delivery not started yet, later events are merged into it
+		self.scheduled = False
+
+	#called on the loop thread, like every command of the asyncio engine
+	def submit(self, audience, events, snapshot=None):
+		delivery = Delivery(audience, events, snapshot)
+		waiting = self.waiting.get(audience)
+		if(waiting is not None):
+			waiting.merge(delivery)
+			return
+		self.waiting[audience] = delivery
+		self.deliveries.append(delivery)
+		if(not self.scheduled):
+			self.scheduled = True
+			self.loop.call_later(Protocol.FANOUT_DELAY, self.run_slice)
+
+	def run_slice(self):
+		budget = Protocol.FANOUT_SLICE
+		while self.deliveries and budget > 0:
+			delivery = self.deliveries[0]
+			if(delivery.spectators is None):
+				del self.waiting[delivery.audience]
+				delivery.start()
+			spectators = delivery.spectators[delivery.next:delivery.next + budget]
+			delivery.next += len(spectators)
+			budget -= len(spectators)
+			try:
+				delivery.audience.deliver(delivery, spectators, self)
+			except Exception as e:
+				Log.error("fanout.failed", room=delivery.audience.room_id, error=repr(e))
+			if(delivery.next >= len(delivery.spectators)):
+				self.deliveries.popleft()
+		if(self.deliveries):
+			self.loop.call_soon(self.run_slice)
+		else:
+			self.scheduled = False
+
+	def get_stats(self):
+		return {'spectator_fast_forwards' : self.fast_forwards, 'spectators_dropped' : self.dropped,
+			'fanout_queue' : len(self.deliveries)}
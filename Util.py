@@ -1,4 +1,5 @@
 import json
+from Config import Protocol
 
 ########################################################################
 # Class : Util - utility functions for serializing commands/data between
@@ -13,3 +14,9 @@ def msg_from_bytes(msg):
 #Encode to byte array 
 def msg_to_bytes(msg):
 	return json.dumps(msg).encode('utf-8')
+
+#name of a protocol command for logs and stats, eg: 6 -> "GET_MODEL"
+def command_name(command):
+	return COMMAND_NAMES.get(command, str(command))
+
+COMMAND_NAMES = {value : name[len("COMMAND_"):] for name, value in vars(Protocol).items() if name.startswith("COMMAND_")}
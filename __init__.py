@@ -4,7 +4,27 @@ import GameNetworkClient
 import Config
 import client
 import ModelChangeEvent
+import GameRoom
+import BitBoard
 import Board
 import Util 
+import Framing
+import AsyncServer
+import Codec
+import LoadGen
+import GameClient
+import Bot
+import BatchEval
+import SelfPlay
 
 
+import Archive
+import Rating
+import Lobby
+import Metrics
+import Log
+import Connections
+import RateLimit
+import Spectators
+import Shard
+import Prefork
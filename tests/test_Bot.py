@@ -0,0 +1,47 @@
+"""
+test_Bot.py : the bot keeps its time budget and still plays sound moves.
+Run from the repository root : python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import time
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BitBoard as bb
+import Bot
+
+#what a move may take past its budget : the node or move ordering running
+#when the deadline passes
+SLACK = 0.5
+
+
+class TestBot(unittest.TestCase):
+
+	def test_budget_holds_on_a_large_board(self):
+		budget = 0.05
+		board = bb.BitBoard(32, 32, 5)
+		Bot.get_rules(board.geometry)
+		mark = "X"
+		slowest = 0.0
+		for i in range(12):
+			start = time.monotonic()
+			row, col = Bot.choose_move(board, mark, budget)
+			slowest = max(slowest, time.monotonic() - start)
+			board.place(row, col, mark)
+			mark = "O" if mark == "X" else "X"
+		self.assertLess(slowest, budget * (1 + SLACK))
+
+	def test_takes_a_win_and_blocks_one(self):
+		board = bb.BitBoard()
+		board.place(0, 0, "X")
+		board.place(1, 1, "O")
+		board.place(0, 1, "X")
+		self.assertEqual(Bot.choose_move(board, "O"), (0, 2))
+		board.place(2, 2, "O")
+		self.assertEqual(Bot.choose_move(board, "X"), (0, 2))
+
+
+if __name__ == '__main__':
+	unittest.main()